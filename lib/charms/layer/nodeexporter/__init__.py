@@ -0,0 +1 @@
+'''Helpers for the Prometheus node exporter charm.'''
@@ -0,0 +1,177 @@
+'''A caching HTTP front-end for the exporter.
+
+When several Prometheus servers scrape the same unit, each scrape makes
+the exporter collect all the metrics again. The front-end serves a
+collection to all consumers for a configurable TTL, and concurrent
+scrapes of the same path share a single upstream request. Responses
+can be gzipped once per collection, instead of once per consumer.
+
+The module only uses the standard library, since it's run as a service
+outside of the charm's virtualenv:
+
+    python3 cache.py --address 10.0.0.1 --port 9101 --ttl 10 --gzip
+'''
+import argparse
+import gzip
+import http.client
+import http.server
+import socketserver
+import threading
+import time
+import urllib.request
+
+
+UPSTREAM_URL = 'http://localhost:9100'
+PORT = 9101
+
+
+class Entry:
+    '''A cached upstream response.'''
+
+    def __init__(self, body, content_type, fetched, compress):
+        self.body = body
+        self.content_type = content_type
+        self.fetched = fetched
+        self.gzipped = gzip.compress(body) if compress else None
+
+
+class _Flight:
+    '''An upstream request that concurrent scrapes wait for.'''
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+        self.error = None
+
+
+class ScrapeCache:
+    '''Cache upstream responses by path for a TTL.
+
+    @ivar fetches: The number of upstream requests that have been made.
+    '''
+
+    def __init__(self, upstream=UPSTREAM_URL, ttl=10, compress=False,
+                 timeout=30, clock=time.monotonic):
+        self.upstream = upstream.rstrip('/')
+        self.ttl = ttl
+        self.compress = compress
+        self.timeout = timeout
+        self.clock = clock
+        self.fetches = 0
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._flights = {}
+
+    def get(self, path):
+        '''Return a fresh Entry for the given path and query string.
+
+        OSError is raised if the upstream request fails.
+        '''
+        with self._lock:
+            now = self.clock()
+            entry = self._entries.get(path)
+            if entry is not None and now - entry.fetched < self.ttl:
+                return entry
+            flight = self._flights.get(path)
+            leader = flight is None
+            if leader:
+                flight = self._flights[path] = _Flight()
+        if leader:
+            self._fetch(path, flight)
+        elif not flight.done.wait(self.timeout):
+            raise OSError('Timed out waiting for {}'.format(path))
+        if flight.error is not None:
+            raise flight.error
+        return flight.entry
+
+    def _fetch(self, path, flight):
+        '''Make the upstream request, and complete the flight.
+
+        The flight is completed whatever happens, so that the waiting
+        scrapes don't hang, and the next scrape makes a new request.
+        '''
+        try:
+            with urllib.request.urlopen(
+                    self.upstream + path, timeout=self.timeout) as response:
+                body = response.read()
+                content_type = response.headers.get(
+                    'Content-Type', 'text/plain')
+            flight.entry = Entry(
+                body, content_type, self.clock(), self.compress)
+        except OSError as error:
+            flight.error = error
+        except http.client.HTTPException as error:
+            # A truncated or garbled response. It's reported like any
+            # other upstream error.
+            flight.error = OSError(
+                'Invalid response from upstream: {!r}'.format(error))
+        finally:
+            if flight.entry is None and flight.error is None:
+                # An unexpected error, which the leader raises.
+                flight.error = OSError(
+                    'Failed to fetch {} from upstream'.format(path))
+            with self._lock:
+                del self._flights[path]
+                if flight.entry is not None:
+                    now = self.clock()
+                    self._entries = {
+                        key: entry for key, entry in self._entries.items()
+                        if now - entry.fetched < self.ttl}
+                    self._entries[path] = flight.entry
+            flight.done.set()
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+
+    daemon_threads = True
+
+
+def make_server(cache, port=PORT, address=''):
+    '''Return an HTTP server that serves scrapes from the cache.'''
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            try:
+                entry = cache.get(self.path)
+            except OSError as error:
+                self.send_error(502, str(error))
+                return
+            body = entry.body
+            self.send_response(200)
+            self.send_header('Content-Type', entry.content_type)
+            accept_encoding = self.headers.get('Accept-Encoding', '')
+            if entry.gzipped is not None and 'gzip' in accept_encoding:
+                body = entry.gzipped
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((address, port), Handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Caching front-end for the node exporter.')
+    parser.add_argument(
+        '--address', default='',
+        help='The address to listen on. All addresses by default.')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--upstream', default=UPSTREAM_URL)
+    parser.add_argument(
+        '--ttl', type=float, default=10,
+        help='How long a collection is served for, in seconds.')
+    parser.add_argument(
+        '--gzip', action='store_true',
+        help='Gzip responses for clients that accept it.')
+    args = parser.parse_args(argv)
+    cache = ScrapeCache(args.upstream, ttl=args.ttl, compress=args.gzip)
+    make_server(cache, port=args.port, address=args.address).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+'''Check that the installed exporter supports what the charm configures.
+
+The charm passes node_exporter flags through the snap's "args" setting,
+which the snap's configure hook hands to the exporter. The flags for
+choosing the collectors and filtering their series were added in
+different node_exporter versions, and older snaps don't have a
+configure hook at all, so both are checked before the exporter is
+configured. An exporter given a flag it doesn't know fails to start.
+'''
+import os
+import re
+
+
+VERSION_RE = re.compile(r'\bversion v?([0-9]+)\.([0-9]+)\.([0-9]+)')
+# The --collector.<name> and --no-collector.<name> flags replaced
+# -collectors.enabled in 0.15.0.
+MIN_VERSION = (0, 15, 0)
+# The versions that added the flags the charm passes, by flag prefix.
+FLAG_VERSIONS = [
+    ('--collector.disable-defaults', (1, 1, 0)),
+    ('--collector.netdev.device-', (1, 3, 0)),
+    ('--collector.filesystem.mount-points-exclude', (1, 3, 0)),
+    ('--collector.filesystem.fs-types-exclude', (1, 3, 0)),
+    ('--collector.diskstats.device-exclude', (1, 3, 0)),
+    ('--collector.diskstats.device-include', (1, 4, 0)),
+]
+
+
+def parse_version(output):
+    '''Return the version in the output of node_exporter --version.
+
+    @return: A (major, minor, patch) tuple, or None if there's no
+        version in the output.
+    '''
+    match = VERSION_RE.search(output)
+    if match is None:
+        return None
+    return tuple(int(part) for part in match.groups())
+
+
+def format_version(version):
+    return '.'.join(str(part) for part in version)
+
+
+def get_required_version(arg):
+    '''Return the node_exporter version that added the flag.'''
+    for prefix, version in FLAG_VERSIONS:
+        if arg.startswith(prefix):
+            return version
+    return MIN_VERSION
+
+
+def check_version(version, args):
+    '''Check that the node_exporter version supports all the flags.
+
+    A ValueError is raised for the first flag it doesn't support.
+
+    @param version: The installed version, as a tuple.
+    @param args: The command line arguments passed to the exporter.
+    '''
+    for arg in args:
+        required = get_required_version(arg)
+        if version < required:
+            raise ValueError(
+                'node_exporter {} doesn\'t support {}, which needs {} or '
+                'later'.format(
+                    format_version(version), arg.split('=', 1)[0],
+                    format_version(required)))
+
+
+def has_configure_hook(snap_dir):
+    '''Return whether the snap in snap_dir takes settings, like "args".'''
+    return os.path.exists(os.path.join(snap_dir, 'meta', 'hooks', 'configure'))
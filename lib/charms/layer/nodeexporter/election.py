@@ -0,0 +1,139 @@
+'''Elect the unit that manages the exporter on a machine.
+
+Subordinate units of different applications can be deployed to the
+same machine, and they all share the exporter snap. The unit that
+manages it is recorded in a file next to the snap's data, which is
+locked while it's read and written. A unit stays active until it's
+stopped, or until its agent directory is gone.
+
+The units can have different config, so the active unit also shares
+how it configured the exporter, in another file next to the election
+file. The passive units publish the exporter using that, rather than
+using their own config.
+'''
+import contextlib
+import fcntl
+import json
+import os
+import tempfile
+
+
+ELECTION_PATH = (
+    '/var/snap/bjornt-prometheus-node-exporter/common/charm-active-unit')
+AGENTS_DIR = '/var/lib/juju/agents'
+
+
+def is_alive(unit):
+    '''Return whether the unit is still deployed on this machine.'''
+    return os.path.isdir(os.path.join(
+        AGENTS_DIR, 'unit-' + unit.replace('/', '-')))
+
+
+@contextlib.contextmanager
+def locked(path):
+    '''Hold an exclusive lock for the election file.'''
+    with open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def get_active_unit(path=ELECTION_PATH):
+    '''Return the recorded active unit, or None.'''
+    try:
+        with open(path) as election_file:
+            return election_file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def get_shared_path(path):
+    '''Return the path of the file the active unit shares its config in.'''
+    return path + '.exporter'
+
+
+def set_active_unit(unit, path):
+    write_file(path, unit + '\n')
+
+
+def write_file(path, content):
+    '''Replace the file's content atomically.'''
+    fd, temp_path = tempfile.mkstemp(
+        prefix='.' + os.path.basename(path), suffix='.tmp',
+        dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'w') as temp_file:
+            temp_file.write(content)
+        os.rename(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def elect(unit, path=ELECTION_PATH, is_alive=is_alive):
+    '''Return the active unit, making it the given unit if needed.
+
+    The unit becomes active if no unit is, or if the active unit isn't
+    alive anymore.
+    '''
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with locked(path):
+        active_unit = get_active_unit(path)
+        if active_unit is None or (
+                active_unit != unit and not is_alive(active_unit)):
+            set_active_unit(unit, path)
+            active_unit = unit
+        return active_unit
+
+
+def release(unit, path=ELECTION_PATH):
+    '''Let another unit become active, if the unit is the active one.'''
+    if not os.path.exists(path):
+        return
+    with locked(path):
+        if get_active_unit(path) == unit:
+            os.unlink(path)
+            if os.path.exists(get_shared_path(path)):
+                os.unlink(get_shared_path(path))
+
+
+def share_exporter(unit, exporter, path=ELECTION_PATH):
+    '''Record how the active unit configured the exporter.
+
+    Nothing is recorded if the unit isn't the active one anymore.
+
+    @param exporter: A JSON-serializable description of the exporter.
+    @return: Whether the recorded description changed.
+    '''
+    content = json.dumps(
+        {'unit': unit, 'exporter': exporter}, sort_keys=True) + '\n'
+    shared_path = get_shared_path(path)
+    with locked(path):
+        if get_active_unit(path) != unit:
+            return False
+        try:
+            with open(shared_path) as shared_file:
+                if shared_file.read() == content:
+                    return False
+        except FileNotFoundError:
+            pass
+        write_file(shared_path, content)
+    return True
+
+
+def get_shared_exporter(path=ELECTION_PATH):
+    '''Return what the active unit shared about the exporter, or None.
+
+    None is also returned if the description was shared by a unit that
+    isn't active anymore.
+    '''
+    try:
+        with open(get_shared_path(path)) as shared_file:
+            shared = json.load(shared_file)
+    except (OSError, ValueError):
+        return None
+    if shared.get('unit') != get_active_unit(path):
+        return None
+    return shared.get('exporter')
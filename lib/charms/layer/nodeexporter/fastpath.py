@@ -0,0 +1,137 @@
+'''Skip update-status when nothing has changed since the last full run.
+
+Running a hook through the reactive framework means bootstrapping the
+virtualenv, loading all the layers and testing every handler. Most
+update-status hooks don't have anything to do, so the charm's
+update-status hook first compares a fingerprint of the config, the
+prometheus-client relation ids, the installed snap revision, the
+unit managing the exporter and the config it shared to the one stored
+by the last full hook run, and exits early if they match. The managing
+unit is included so that a passive unit takes over as soon as the
+active one is stopped, and the shared config so that a passive unit
+republishes the exporter when the active one reconfigures it.
+
+The full run also stores when it next needs update-status to do
+periodic work, like refreshing the snap in its slot, and the early
+exit is only taken before that.
+
+The module only uses the standard library, since the check is done
+before the charm's virtualenv is activated.
+'''
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+import time
+
+
+STATE_PATH = '.nodeexporter-fastpath.json'
+SNAP_CURRENT = '/snap/bjornt-prometheus-node-exporter/current'
+# The same as election.ELECTION_PATH, which can't be imported here.
+ELECTION_PATH = (
+    '/var/snap/bjornt-prometheus-node-exporter/common/charm-active-unit')
+# The same as election.get_shared_path(ELECTION_PATH).
+SHARED_PATH = ELECTION_PATH + '.exporter'
+# The container relation always exists for a subordinate, and changes
+# to it are handled by its own hooks, so only this one is included.
+RELATION_NAME = 'prometheus-client'
+# The longest time update-status is skipped, even if nothing changed.
+MAX_SKIP = 30 * 60
+
+
+def get_fingerprint(config, relation_ids, snap_revision, active_unit,
+                    shared=None):
+    '''Return a digest of the state that update-status depends on.
+
+    @param config: The charm config, as a dict.
+    @param relation_ids: The prometheus-client relation ids.
+    @param snap_revision: The installed snap revision, or None.
+    @param active_unit: The unit managing the exporter, or None.
+    @param shared: The content of the file the active unit shares its
+        config in, or None.
+    '''
+    data = json.dumps(
+        [config, sorted(relation_ids), snap_revision, active_unit, shared],
+        sort_keys=True)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def get_snap_revision(current=SNAP_CURRENT):
+    '''Return the installed revision of the snap, or None.'''
+    try:
+        return os.readlink(current)
+    except OSError:
+        return None
+
+
+def get_active_unit(path=ELECTION_PATH):
+    '''Return the unit managing the exporter, or None.'''
+    try:
+        with open(path) as election_file:
+            return election_file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def get_shared(path=SHARED_PATH):
+    '''Return the content of the shared config file, or None.'''
+    try:
+        with open(path) as shared_file:
+            return shared_file.read()
+    except FileNotFoundError:
+        return None
+
+
+def get_current_fingerprint():
+    '''Return the fingerprint, using the hook tools directly.'''
+    config = json.loads(subprocess.check_output(
+        ['config-get', '--all', '--format=json']).decode('utf-8'))
+    relation_ids = json.loads(subprocess.check_output(
+        ['relation-ids', '--format=json', RELATION_NAME]).decode('utf-8'))
+    return get_fingerprint(
+        config, relation_ids or [], get_snap_revision(), get_active_unit(),
+        get_shared())
+
+
+def write_state(fingerprint, due, path=STATE_PATH):
+    '''Store the fingerprint of a full run, atomically.
+
+    @param due: The timestamp at which update-status next has work to
+        do, regardless of the fingerprint.
+    '''
+    fd, temp_path = tempfile.mkstemp(
+        prefix='.fastpath', suffix='.tmp',
+        dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'w') as temp_file:
+            json.dump({'fingerprint': fingerprint, 'due': due}, temp_file)
+        os.rename(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def read_state(path=STATE_PATH):
+    '''Return the stored state as a dict, or None if there isn't any.'''
+    try:
+        with open(path) as state_file:
+            return json.load(state_file)
+    except (OSError, ValueError):
+        return None
+
+
+def can_skip(path=STATE_PATH, clock=time.time,
+             current_fingerprint=get_current_fingerprint):
+    '''Return whether update-status can exit without a full run.
+
+    Any error while checking means that a full run is needed.
+    '''
+    state = read_state(path)
+    if state is None or clock() >= state.get('due', 0):
+        return False
+    try:
+        fingerprint = current_fingerprint()
+    except (OSError, ValueError, subprocess.CalledProcessError):
+        return False
+    return fingerprint == state.get('fingerprint')
@@ -0,0 +1,81 @@
+'''Check that the exporter is serving metrics.
+
+The exporter is probed from update-status with a short timeout. While
+it's healthy, the time between probes is doubled after each successful
+one, up to MAX_INTERVAL, so that a healthy exporter is rarely probed.
+After a failure, it's probed on every update-status. A single failure
+is only reported as maintenance, since the exporter may have been
+restarting, and the unit is blocked with the last error once
+FAILURE_THRESHOLD consecutive probes have failed.
+'''
+from charms.layer.nodeexporter import scrape
+
+
+EXPORTER_URL = 'http://localhost:9100'
+TIMEOUT = 2
+# Only the first failure is treated as transient.
+FAILURE_THRESHOLD = 2
+# The time between probes after the first successful one, in seconds.
+MIN_INTERVAL = 10 * 60
+MAX_INTERVAL = 60 * 60
+# Only the cheapest collector is asked for, if it's enabled.
+PROBE_PATH = '/metrics?collect[]=time'
+
+
+def probe(url, timeout=TIMEOUT):
+    '''Request the URL, returning a (latency, error) tuple.
+
+    The error is None if the request succeeded.
+    '''
+    try:
+        latency, _ = scrape.scrape(url, timeout=timeout)
+    except scrape.SCRAPE_ERRORS as error:
+        return None, str(error) or repr(error)
+    return latency, None
+
+
+def is_due(state, now):
+    '''Return whether the exporter should be probed now.
+
+    @param state: The state returned by the previous update(), or None.
+    '''
+    if state is None:
+        return True
+    return now >= state['checked'] + state['interval']
+
+
+def update(state, now, latency, error):
+    '''Return the state updated with the probe's result.
+
+    @return: A dict with the number of consecutive 'failures', the
+        'latency' of the last successful probe, the 'error' of the last
+        failed one, when it was 'checked' and the 'interval' until the
+        next probe.
+    '''
+    state = dict(state or {'failures': 0, 'latency': None, 'interval': 0})
+    state['checked'] = now
+    if error is None:
+        state['failures'] = 0
+        state['latency'] = latency
+        state['error'] = None
+        state['interval'] = min(
+            MAX_INTERVAL, max(MIN_INTERVAL, state['interval'] * 2))
+    else:
+        state['failures'] += 1
+        state['error'] = error
+        state['interval'] = 0
+    return state
+
+
+def get_status(state):
+    '''Return the workload status for the state, or None if healthy.
+
+    @return: A (status, message) tuple, or None.
+    '''
+    if state is None or not state['failures']:
+        return None
+    if state['failures'] < FAILURE_THRESHOLD:
+        return 'maintenance', (
+            'Exporter health check failed ({}/{}): {}'.format(
+                state['failures'], FAILURE_THRESHOLD, state['error']))
+    return 'blocked', 'Exporter is unhealthy: {}'.format(state['error'])
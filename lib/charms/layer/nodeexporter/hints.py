@@ -0,0 +1,76 @@
+'''Recommend scrape intervals and timeouts based on scrape durations.
+
+The charm samples how long the exporter takes to answer a scrape, and
+keeps the recent samples. The recommendations are based on a high
+percentile of them, and are only republished when they change enough,
+so that they don't cause relation churn.
+'''
+import math
+import re
+
+from charms.layer.nodeexporter import scrape
+
+
+MAX_SAMPLES = 12
+# The recommended timeout is this many times the estimated duration.
+TIMEOUT_FACTOR = 3
+MIN_TIMEOUT = 1
+# How much the timeout has to change before it's republished.
+THRESHOLD = 0.25
+DURATION_RE = re.compile(r'^([0-9]+)(ms|s|m|h)$')
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def parse_duration(duration):
+    '''Return the seconds in a Prometheus duration, like "15s" or "5m".'''
+    match = DURATION_RE.match(duration)
+    if match is None:
+        raise ValueError('Invalid duration: {}'.format(duration))
+    return int(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+
+def add_sample(samples, duration):
+    '''Return the samples with the duration added, keeping the latest.'''
+    return (samples + [duration])[-MAX_SAMPLES:]
+
+
+def estimate(samples):
+    '''Return the estimated scrape duration, in seconds.'''
+    return scrape.percentile(samples, 95)
+
+
+def recommend_timeout(samples):
+    '''Return the recommended scrape timeout in seconds, or None.
+
+    @param samples: Recent scrape durations, in seconds.
+    '''
+    if not samples:
+        return None
+    return max(MIN_TIMEOUT, math.ceil(estimate(samples) * TIMEOUT_FACTOR))
+
+
+def get_interval(min_interval, timeout):
+    '''Return the scrape interval to recommend with the given timeout.
+
+    Prometheus doesn't accept timeouts that are longer than the
+    interval, so the interval is increased if needed.
+
+    @param min_interval: The shortest interval to recommend, as a
+        Prometheus duration.
+    '''
+    if timeout is None or timeout <= parse_duration(min_interval):
+        return min_interval
+    return '{}s'.format(timeout)
+
+
+def should_publish(published, recommended, threshold=THRESHOLD):
+    '''Return whether the recommended timeout should be published.
+
+    Small changes compared to the published timeout are ignored, so
+    that the recommendations don't flap.
+    '''
+    if recommended is None:
+        return False
+    if published is None:
+        return True
+    return abs(recommended - published) >= max(1, published * threshold)
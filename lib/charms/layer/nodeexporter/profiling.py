@@ -0,0 +1,207 @@
+'''Profile how long the reactive handlers of a hook take.
+
+The profiler wraps the invocation of the reactive handlers and the
+subprocess functions the hook tools are called through, so that it can
+tell how much of a handler's time was spent waiting for hook tools,
+snap and systemctl. Optionally each handler is run under cProfile as
+well, and the functions it spent the most time in are kept.
+
+Each hook adds a record to a bounded list in the unitdata kv store,
+which the hook-profile action aggregates. If a handler fails, the
+wrapped functions are restored straight away, since the hook won't
+complete and nothing is recorded.
+'''
+import cProfile
+import os
+import pstats
+import re
+import subprocess
+import time
+
+from charms.reactive import bus
+
+
+PROFILE_KEY = 'nodeexporter.hook-profile'
+MAX_RECORDS = 100
+# The number of functions to keep for each handler, when using cProfile.
+MAX_FUNCTIONS = 10
+SUBPROCESS_FUNCTIONS = ['call', 'check_call', 'check_output', 'run']
+
+
+class Profiler:
+    '''Record the time spent in each reactive handler of a hook.
+
+    @ivar hook: The name of the hook being profiled.
+    @ivar handlers: A list of dicts, one for each handler invocation.
+    @ivar tool_calls: The number of subprocesses run during the hook.
+    @ivar tool_time: The seconds spent waiting for subprocesses.
+    '''
+
+    def __init__(self, hook, use_cprofile=False, clock=time.monotonic):
+        self.hook = hook
+        self.use_cprofile = use_cprofile
+        self.clock = clock
+        self.handlers = []
+        self.tool_calls = 0
+        self.tool_time = 0.0
+        self._start = None
+        self._originals = {}
+        self._depth = 0
+
+    def install(self):
+        '''Start profiling the handlers and subprocesses.'''
+        self._start = self.clock()
+        self._originals[(bus.Handler, 'invoke')] = bus.Handler.invoke
+        bus.Handler.invoke = self._wrap_invoke(bus.Handler.invoke)
+        for name in SUBPROCESS_FUNCTIONS:
+            function = getattr(subprocess, name, None)
+            if function is not None:
+                self._originals[(subprocess, name)] = function
+                setattr(subprocess, name, self._wrap_subprocess(function))
+
+    def uninstall(self):
+        '''Stop profiling, restoring the wrapped functions.'''
+        for (owner, name), function in self._originals.items():
+            setattr(owner, name, function)
+        self._originals.clear()
+
+    def get_record(self):
+        '''Return what has been recorded, as a JSON serializable dict.'''
+        return {
+            'hook': self.hook,
+            'time': time.time(),
+            'duration': self.clock() - self._start,
+            'tool-calls': self.tool_calls,
+            'tool-time': self.tool_time,
+            'handlers': self.handlers,
+        }
+
+    def _wrap_invoke(self, invoke):
+        profiler = self
+
+        def profiled_invoke(handler):
+            tool_calls, tool_time = profiler.tool_calls, profiler.tool_time
+            profile = cProfile.Profile() if profiler.use_cprofile else None
+            start = profiler.clock()
+            try:
+                if profile is None:
+                    invoke(handler)
+                else:
+                    profile.runcall(invoke, handler)
+            except BaseException:
+                profiler.uninstall()
+                raise
+            finally:
+                record = {
+                    'handler': handler.id(),
+                    'duration': profiler.clock() - start,
+                    'tool-calls': profiler.tool_calls - tool_calls,
+                    'tool-time': profiler.tool_time - tool_time,
+                }
+                if profile is not None:
+                    record['functions'] = get_top_functions(profile)
+                profiler.handlers.append(record)
+        return profiled_invoke
+
+    def _wrap_subprocess(self, function):
+        def profiled_function(*args, **kwargs):
+            # check_call() uses call(), and check_output() uses run(),
+            # so only the outermost call is counted.
+            if self._depth:
+                return function(*args, **kwargs)
+            self._depth += 1
+            start = self.clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._depth -= 1
+                self.tool_calls += 1
+                self.tool_time += self.clock() - start
+        return profiled_function
+
+
+def format_key(name):
+    '''Return a name as an action result key.
+
+    Action result keys can only contain lowercase letters, digits and
+    hyphens, with dots separating the levels. The whole name is kept,
+    so that handlers with the same function name in different files
+    aren't merged.
+    '''
+    return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-')
+
+
+def get_top_functions(profile, limit=MAX_FUNCTIONS):
+    '''Return the functions with the most cumulative time in a profile.
+
+    @return: A list of [function, calls, cumulative seconds] lists,
+        with the function formatted as "file:line(name)".
+    '''
+    stats = pstats.Stats(profile).stats
+    functions = []
+    for (filename, line, name), (_, calls, _, cumulative, _) in (
+            stats.items()):
+        function = '{}:{}({})'.format(os.path.basename(filename), line, name)
+        functions.append([function, calls, cumulative])
+    functions.sort(key=lambda function: function[2], reverse=True)
+    return functions[:limit]
+
+
+def add_record(kv, record, max_records=MAX_RECORDS):
+    '''Store a hook record, dropping the oldest ones.'''
+    records = kv.get(PROFILE_KEY, [])
+    records.append(record)
+    kv.set(PROFILE_KEY, records[-max_records:])
+
+
+def summarize(values):
+    '''Return the count, mean and max of the values.'''
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values),
+        'max': max(values),
+    }
+
+
+def aggregate(records, hook=None):
+    '''Aggregate the stored hook records.
+
+    @param records: The records, as stored by add_record().
+    @param hook: Only include records for this hook, if given.
+    @return: A dict with 'hooks' and 'handlers' dicts, mapping hook
+        names and handler ids to the summary of their durations,
+        together with the mean number of subprocesses and the mean time
+        spent in them. If cProfile was used, 'functions' maps
+        functions to their total cumulative time.
+    '''
+    hooks = {}
+    handlers = {}
+    functions = {}
+    for record in records:
+        if hook is not None and record['hook'] != hook:
+            continue
+        hooks.setdefault(record['hook'], []).append(record)
+        for handler in record['handlers']:
+            handlers.setdefault(handler['handler'], []).append(handler)
+            for function, _, cumulative in handler.get('functions', []):
+                functions[function] = (
+                    functions.get(function, 0) + cumulative)
+    return {
+        'hooks': {
+            name: summarize_records(entries)
+            for name, entries in hooks.items()},
+        'handlers': {
+            name: summarize_records(entries)
+            for name, entries in handlers.items()},
+        'functions': functions,
+    }
+
+
+def summarize_records(records):
+    '''Summarize hook or handler records.'''
+    summary = summarize([record['duration'] for record in records])
+    summary['tool-calls'] = sum(
+        record['tool-calls'] for record in records) / len(records)
+    summary['tool-time'] = sum(
+        record['tool-time'] for record in records) / len(records)
+    return summary
@@ -0,0 +1,376 @@
+'''An agent pushing the exporter's metrics to a remote endpoint.
+
+For networks where Prometheus can't scrape the exporter, the agent
+scrapes it locally and pushes the samples instead. To keep the traffic
+down, samples whose value hasn't changed are only sent again after a
+while, several scrapes are sent together as a batch, and the batches
+are gzipped.
+
+The batches are in the Prometheus text format, with a timestamp for
+each sample, and are POSTed with Content-Encoding: gzip. Each batch is
+written to a spool directory before it's sent, and is removed once it
+has been accepted, so batches survive outages of the endpoint and
+restarts of the agent. The spool is bounded, and the oldest batches
+are dropped when it's full. Batches the endpoint rejects as invalid
+are dropped too, rather than retried. A sample only counts as sent
+once its batch has been accepted, so the samples of dropped batches
+are sent again with the next scrape.
+
+Every sample is labelled with the instance it comes from, and with the
+exporter that served it, since the main exporter and the one for slow
+collectors expose some of the same series. Labels the sample already
+has are renamed to exported_<name>, like Prometheus does.
+
+The module only uses the standard library, since it's run as a service
+outside of the charm's virtualenv:
+
+    python3 push.py --endpoint https://push.example.com/api/v1/import \
+        --label instance=web-1 --upstream main=http://localhost:9100/metrics
+'''
+import argparse
+import gzip
+import http.client
+import os
+import re
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+
+UPSTREAM_URL = 'http://localhost:9100/metrics'
+SPOOL_DIR = '/var/snap/bjornt-prometheus-node-exporter/common/push-spool'
+MAX_SPOOL_BYTES = 64 * 1024 * 1024
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+# The label naming the upstream exporter a sample comes from.
+UPSTREAM_LABEL = 'exporter'
+# The errors a failed or garbled scrape raises.
+SCRAPE_ERRORS = (OSError, http.client.HTTPException, UnicodeDecodeError)
+# The client errors that may succeed if the batch is sent again.
+RETRY_STATUSES = frozenset([408, 429])
+# A label of a series, and its quoted value.
+LABEL_RE = re.compile(
+    r'\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*=\s*("(?:[^"\\]|\\.)*")\s*(?:,|$)')
+
+
+def parse_lines(text):
+    '''Yield (series, value) tuples for the samples in the text.
+
+    The series is the metric name together with its labels, as they
+    appear in the text.
+    '''
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        series, _, value = line.rpartition(' ')
+        if series:
+            yield series, value
+
+
+def format_labels(labels):
+    '''Return the labels formatted as in the text format, sorted.'''
+    return ','.join(
+        '{}="{}"'.format(name, value.replace('\\', '\\\\').replace(
+            '"', '\\"').replace('\n', '\\n'))
+        for name, value in sorted(labels.items()))
+
+
+def add_labels(series, labels):
+    '''Return the series with the given labels added in front.
+
+    If the series already has one of the labels, it's renamed to
+    exported_<name>.
+
+    @param series: The metric name together with its labels, as they
+        appear in the text.
+    @param labels: A dict of the labels to add.
+    '''
+    formatted = format_labels(labels)
+    name, brace, rest = series.partition('{')
+    if not brace or rest.lstrip().startswith('}'):
+        return '{}{{{}}}'.format(name, formatted)
+    pairs = LABEL_RE.findall(rest.rstrip()[:-1])
+    if any(label in labels for label, _ in pairs):
+        rest = ','.join(
+            '{}={}'.format(
+                'exported_' + label if label in labels else label, value)
+            for label, value in pairs) + '}'
+    return '{}{{{},{}'.format(name, formatted, rest)
+
+
+class Deduplicator:
+    '''Drop samples that haven't changed since they were last sent.
+
+    Unchanged samples are still sent every resend_interval seconds, so
+    that the receiver doesn't consider the series stale.
+
+    Samples that are waiting to be sent in a batch are also dropped, but
+    they only count as sent once the batch has been delivered. If the
+    batch is dropped instead, they are sent again.
+    '''
+
+    def __init__(self, resend_interval):
+        self.resend_interval = resend_interval
+        # (value, time) of the last delivered sample of each series.
+        self._sent = {}
+        # (value, time, batch) of the samples waiting to be delivered.
+        self._queued = {}
+
+    def filter(self, samples, now, batch=None):
+        '''Return the samples that need to be sent.
+
+        @param samples: An iterable of (series, value) tuples.
+        @param now: The current time, in seconds.
+        @param batch: An id of the batch the samples are sent in.
+        '''
+        changed = []
+        seen = set()
+        for series, value in samples:
+            seen.add(series)
+            last = self._queued.get(series) or self._sent.get(series)
+            if (last is not None and last[0] == value and
+                    now - last[1] < self.resend_interval):
+                continue
+            self._queued[series] = (value, now, batch)
+            changed.append((series, value))
+        # Forget series that have disappeared, so that they are sent
+        # if they come back.
+        for sent in [self._sent, self._queued]:
+            for series in set(sent) - seen:
+                del sent[series]
+        return changed
+
+    def delivered(self, batch):
+        '''Count the samples of the batch as sent.'''
+        for series, (value, sampled, queued_batch) in list(
+                self._queued.items()):
+            if queued_batch == batch:
+                self._sent[series] = (value, sampled)
+                del self._queued[series]
+
+    def dropped(self, batch):
+        '''Send the samples of the batch again, since it was dropped.'''
+        for series, (_, _, queued_batch) in list(self._queued.items()):
+            if queued_batch == batch:
+                del self._queued[series]
+
+
+class Spool:
+    '''A directory of gzipped batches waiting to be sent.'''
+
+    def __init__(self, directory=SPOOL_DIR, max_bytes=MAX_SPOOL_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._sequence = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def add(self, payload):
+        '''Store a batch, dropping the oldest ones if the spool is full.
+
+        @return: The path of the stored batch.
+        '''
+        self._sequence += 1
+        name = '{:017.6f}-{:06d}.prom.gz'.format(time.time(), self._sequence)
+        fd, temp_path = tempfile.mkstemp(
+            prefix='.batch', suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                temp_file.write(payload)
+            os.rename(temp_path, os.path.join(self.directory, name))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self.prune()
+        return os.path.join(self.directory, name)
+
+    def pending(self):
+        '''Return the paths of the stored batches, oldest first.'''
+        return [
+            os.path.join(self.directory, name)
+            for name in sorted(os.listdir(self.directory))
+            if name.endswith('.prom.gz')]
+
+    def prune(self):
+        '''Remove the oldest batches until the spool fits max_bytes.'''
+        paths = self.pending()
+        sizes = [os.path.getsize(path) for path in paths]
+        total = sum(sizes)
+        for path, size in zip(paths, sizes):
+            if total <= self.max_bytes:
+                break
+            os.unlink(path)
+            total -= size
+
+
+class Pusher:
+    '''Scrape the exporter, and push the samples in batches.
+
+    @ivar batch: The lines of the batch that is being collected.
+    @ivar scrapes: The number of scrapes in the batch.
+    @ivar batch_id: The id of the batch in the deduplicator.
+    @ivar spooled: The ids of the spooled batches, keyed by path. Only
+        the ones spooled by this agent are included.
+    '''
+
+    def __init__(self, endpoint, spool, upstreams=(('main', UPSTREAM_URL),),
+                 labels=None, batch_size=4, resend_interval=240, timeout=10,
+                 clock=time.time):
+        '''
+        @param upstreams: (name, url) tuples of the exporters to scrape.
+            The name is set as the UPSTREAM_LABEL of their samples.
+        @param labels: A dict of labels to set on all the samples, like
+            the instance.
+        '''
+        self.endpoint = endpoint
+        self.spool = spool
+        self.upstreams = [
+            (dict(labels or {}, **{UPSTREAM_LABEL: name}), url)
+            for name, url in upstreams]
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.clock = clock
+        self.deduplicator = Deduplicator(resend_interval)
+        self.batch = []
+        self.scrapes = 0
+        self.batch_id = 0
+        self.spooled = {}
+
+    def scrape(self):
+        '''Return the labelled samples of all the upstream exporters.
+
+        One of the SCRAPE_ERRORS is raised if an exporter can't be
+        scraped.
+        '''
+        samples = []
+        for labels, url in self.upstreams:
+            with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                text = response.read().decode('utf-8')
+            samples.extend(
+                (add_labels(series, labels), value)
+                for series, value in parse_lines(text))
+        return samples
+
+    def collect(self):
+        '''Scrape the exporters, and push the batch if it's complete.'''
+        now = self.clock()
+        samples = self.scrape()
+        timestamp = int(now * 1000)
+        for series, value in self.deduplicator.filter(
+                samples, now, self.batch_id):
+            self.batch.append('{} {} {}\n'.format(series, value, timestamp))
+        self.scrapes += 1
+        if self.scrapes >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        '''Spool the collected batch, and send all the spooled ones.'''
+        if self.batch:
+            path = self.spool.add(
+                gzip.compress(''.join(self.batch).encode('utf-8')))
+            self.spooled[path] = self.batch_id
+        self.batch = []
+        self.scrapes = 0
+        self.batch_id += 1
+        return self.send_pending()
+
+    def send_pending(self):
+        '''Send the spooled batches, oldest first.
+
+        Sending stops at the first failure, and is retried after the
+        next batch. Batches the endpoint rejects with a client error are
+        dropped, since sending them again wouldn't help, and they would
+        keep the batches after them from being sent.
+
+        @return: The number of batches that were sent.
+        '''
+        sent = 0
+        pending = self.spool.pending()
+        # Forget the batches that were pruned from the spool.
+        for path in set(self.spooled) - set(pending):
+            self.deduplicator.dropped(self.spooled.pop(path))
+        for path in pending:
+            with open(path, 'rb') as batch_file:
+                payload = batch_file.read()
+            request = urllib.request.Request(
+                self.endpoint, data=payload, method='POST', headers={
+                    'Content-Type': CONTENT_TYPE,
+                    'Content-Encoding': 'gzip'})
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout):
+                    pass
+            except urllib.error.HTTPError as error:
+                if error.code >= 500 or error.code in RETRY_STATUSES:
+                    print('Failed to push {}: {}'.format(path, error),
+                          file=sys.stderr)
+                    break
+                print('Dropping {}, which was rejected: {}'.format(
+                    path, error), file=sys.stderr)
+                os.unlink(path)
+                if path in self.spooled:
+                    self.deduplicator.dropped(self.spooled.pop(path))
+                continue
+            except OSError as error:
+                print('Failed to push {}: {}'.format(path, error),
+                      file=sys.stderr)
+                break
+            os.unlink(path)
+            if path in self.spooled:
+                self.deduplicator.delivered(self.spooled.pop(path))
+            sent += 1
+        return sent
+
+
+def parse_pair(arg):
+    '''Parse a NAME=VALUE command line argument.'''
+    name, equals, value = arg.partition('=')
+    if not equals or not name:
+        raise argparse.ArgumentTypeError(
+            'Expected NAME=VALUE: {}'.format(arg))
+    return name, value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Push the node exporter metrics to an endpoint.')
+    parser.add_argument('--endpoint', required=True)
+    parser.add_argument(
+        '--upstream', action='append', dest='upstreams', type=parse_pair,
+        help='An exporter to scrape, as NAME=URL. It can be given more '
+             'than once.')
+    parser.add_argument(
+        '--label', action='append', dest='labels', type=parse_pair,
+        help='A label to set on all the samples, as NAME=VALUE. It can be '
+             'given more than once.')
+    parser.add_argument(
+        '--interval', type=float, default=15,
+        help='How often the exporter is scraped, in seconds.')
+    parser.add_argument(
+        '--batch-size', type=int, default=4,
+        help='The number of scrapes in each batch.')
+    parser.add_argument(
+        '--resend-interval', type=float, default=240,
+        help='How often unchanged samples are sent, in seconds.')
+    parser.add_argument('--spool-dir', default=SPOOL_DIR)
+    parser.add_argument(
+        '--max-spool-bytes', type=int, default=MAX_SPOOL_BYTES)
+    parser.add_argument('--timeout', type=float, default=10)
+    args = parser.parse_args(argv)
+    pusher = Pusher(
+        args.endpoint, Spool(args.spool_dir, args.max_spool_bytes),
+        upstreams=args.upstreams or [('main', UPSTREAM_URL)],
+        labels=dict(args.labels or []),
+        batch_size=args.batch_size, resend_interval=args.resend_interval,
+        timeout=args.timeout)
+    while True:
+        start = time.monotonic()
+        try:
+            pusher.collect()
+        except SCRAPE_ERRORS as error:
+            print('Failed to scrape: {!r}'.format(error), file=sys.stderr)
+        time.sleep(max(0, args.interval - (time.monotonic() - start)))
+
+
+if __name__ == '__main__':
+    main()
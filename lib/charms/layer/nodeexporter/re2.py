@@ -0,0 +1,315 @@
+'''Check that regular expressions use the syntax node_exporter accepts.
+
+node_exporter compiles the collector filters with Go's regexp package,
+which implements the RE2 syntax. It differs from Python's re in both
+directions, e.g. RE2 doesn't have lookarounds or backreferences, but
+has \\z and \\p{Greek}, so Python's re can't be used for the check.
+
+The regexes are instead parsed using the grammar of Go's regexp/syntax
+package, with the Perl flags regexp.Compile uses. Anything that isn't
+part of the grammar is rejected, and the errors are worded like Go's.
+'''
+import re
+
+
+# The most a single repetition can repeat.
+MAX_REPEAT = 1000
+FLAGS_RE = re.compile(r'\(\?([imsU]*)(?:-([imsU]*))?([:)])')
+NAME_RE = re.compile(r'^[A-Za-z0-9_]+$')
+REPEAT_RE = re.compile(r'\{(0|[1-9][0-9]*)(,(0|[1-9][0-9]*)?)?\}')
+ASCII_CLASS_RE = re.compile(r'\[:\^?([^:\]]*):\]')
+PERL_CLASSES = 'dDsSwW'
+ASSERTIONS = 'AbBz'
+SIMPLE_ESCAPES = {'a': 7, 'f': 12, 'n': 10, 'r': 13, 't': 9, 'v': 11}
+OCTAL_DIGITS = '01234567'
+HEX_DIGITS = '0123456789abcdefABCDEF'
+ASCII_CLASSES = frozenset([
+    'alnum', 'alpha', 'ascii', 'blank', 'cntrl', 'digit', 'graph', 'lower',
+    'print', 'punct', 'space', 'upper', 'word', 'xdigit'])
+# The names \p accepts: the Unicode general categories and scripts that
+# Go's unicode package has tables for.
+UNICODE_CLASSES = frozenset([
+    'Any',
+    'C', 'Cc', 'Cf', 'Co', 'Cs', 'L', 'Ll', 'Lm', 'Lo', 'Lt', 'Lu', 'M',
+    'Mc', 'Me', 'Mn', 'N', 'Nd', 'Nl', 'No', 'P', 'Pc', 'Pd', 'Pe', 'Pf',
+    'Pi', 'Po', 'Ps', 'S', 'Sc', 'Sk', 'Sm', 'So', 'Z', 'Zl', 'Zp', 'Zs',
+    'Adlam', 'Ahom', 'Anatolian_Hieroglyphs', 'Arabic', 'Armenian',
+    'Avestan', 'Balinese', 'Bamum', 'Bassa_Vah', 'Batak', 'Bengali',
+    'Bhaiksuki', 'Bopomofo', 'Brahmi', 'Braille', 'Buginese', 'Buhid',
+    'Canadian_Aboriginal', 'Carian', 'Caucasian_Albanian', 'Chakma', 'Cham',
+    'Cherokee', 'Chorasmian', 'Common', 'Coptic', 'Cuneiform', 'Cypriot',
+    'Cypro_Minoan', 'Cyrillic', 'Deseret', 'Devanagari', 'Dives_Akuru',
+    'Dogra', 'Duployan', 'Egyptian_Hieroglyphs', 'Elbasan', 'Elymaic',
+    'Ethiopic', 'Georgian', 'Glagolitic', 'Gothic', 'Grantha', 'Greek',
+    'Gujarati', 'Gunjala_Gondi', 'Gurmukhi', 'Han', 'Hangul',
+    'Hanifi_Rohingya', 'Hanunoo', 'Hatran', 'Hebrew', 'Hiragana',
+    'Imperial_Aramaic', 'Inherited', 'Inscriptional_Pahlavi',
+    'Inscriptional_Parthian', 'Javanese', 'Kaithi', 'Kannada', 'Katakana',
+    'Kawi', 'Kayah_Li', 'Kharoshthi', 'Khitan_Small_Script', 'Khmer',
+    'Khojki', 'Khudawadi', 'Lao', 'Latin', 'Lepcha', 'Limbu', 'Linear_A',
+    'Linear_B', 'Lisu', 'Lycian', 'Lydian', 'Mahajani', 'Makasar',
+    'Malayalam', 'Mandaic', 'Manichaean', 'Marchen', 'Masaram_Gondi',
+    'Medefaidrin', 'Meetei_Mayek', 'Mende_Kikakui', 'Meroitic_Cursive',
+    'Meroitic_Hieroglyphs', 'Miao', 'Modi', 'Mongolian', 'Mro', 'Multani',
+    'Myanmar', 'Nabataean', 'Nag_Mundari', 'Nandinagari', 'New_Tai_Lue',
+    'Newa', 'Nko', 'Nushu', 'Nyiakeng_Puachue_Hmong', 'Ogham', 'Ol_Chiki',
+    'Old_Hungarian', 'Old_Italic', 'Old_North_Arabian', 'Old_Permic',
+    'Old_Persian', 'Old_Sogdian', 'Old_South_Arabian', 'Old_Turkic',
+    'Old_Uyghur', 'Oriya', 'Osage', 'Osmanya', 'Pahawh_Hmong', 'Palmyrene',
+    'Pau_Cin_Hau', 'Phags_Pa', 'Phoenician', 'Psalter_Pahlavi', 'Rejang',
+    'Runic', 'Samaritan', 'Saurashtra', 'Sharada', 'Shavian', 'Siddham',
+    'SignWriting', 'Sinhala', 'Sogdian', 'Sora_Sompeng', 'Soyombo',
+    'Sundanese', 'Syloti_Nagri', 'Syriac', 'Tagalog', 'Tagbanwa', 'Tai_Le',
+    'Tai_Tham', 'Tai_Viet', 'Takri', 'Tamil', 'Tangsa', 'Tangut', 'Telugu',
+    'Thaana', 'Thai', 'Tibetan', 'Tifinagh', 'Tirhuta', 'Toto', 'Ugaritic',
+    'Vai', 'Vithkuqi', 'Wancho', 'Warang_Citi', 'Yezidi', 'Yi',
+    'Zanabazar_Square'])
+
+
+def check(regex):
+    '''Raise a ValueError if node_exporter wouldn't accept the regex.'''
+    _Parser(regex).parse()
+
+
+class _Parser:
+    '''Parse a regex, without building anything from it.
+
+    @ivar pos: The index of the next character to parse.
+    '''
+
+    def __init__(self, regex):
+        self.regex = regex
+        self.pos = 0
+        self.names = set()
+
+    def fail(self, message, start, end=None):
+        raise ValueError('{}: `{}`'.format(
+            message, self.regex[start:self.pos if end is None else end]))
+
+    def parse(self):
+        regex = self.regex
+        depth = 0
+        # Whether there is something to apply a repetition to.
+        operand = False
+        # Whether the previous item was a repetition, which Perl syntax
+        # doesn't allow to be repeated again, like in a** or a++.
+        repeated = False
+        while self.pos < len(regex):
+            start = self.pos
+            char = regex[start]
+            repeat = None
+            if char in '*+?':
+                self.pos += 1
+                repeat = char
+            elif char == '{':
+                match = REPEAT_RE.match(regex, start)
+                if match is None:
+                    # A brace that isn't a repetition is a literal.
+                    self.pos += 1
+                else:
+                    self.pos = match.end()
+                    repeat = match.group(0)
+                    low = int(match.group(1))
+                    high = low
+                    if match.group(2):
+                        high = (
+                            int(match.group(3)) if match.group(3) else None)
+                    if (low > MAX_REPEAT or
+                            (high is not None and
+                             (high > MAX_REPEAT or high < low))):
+                        self.fail('invalid repeat count', start)
+            if repeat is not None:
+                if regex[self.pos:self.pos + 1] == '?':
+                    self.pos += 1
+                if repeated:
+                    self.fail('invalid nested repetition operator', start)
+                if not operand:
+                    self.fail('missing argument to repetition operator', start)
+                repeated = True
+                continue
+            repeated = False
+            if char == '(':
+                if regex.startswith('(?', start):
+                    if self.parse_group_flags():
+                        depth += 1
+                        operand = False
+                    continue
+                self.pos += 1
+                depth += 1
+                operand = False
+            elif char == ')':
+                self.pos += 1
+                if depth == 0:
+                    self.fail('unexpected )', start)
+                depth -= 1
+                operand = True
+            elif char == '|':
+                self.pos += 1
+                operand = False
+            elif char == '[':
+                self.parse_class()
+                operand = True
+            elif char == '\\':
+                self.parse_escape(in_class=False)
+                operand = True
+            else:
+                self.pos += 1
+                operand = True
+        if depth:
+            self.fail('missing closing )', 0, len(regex))
+
+    def parse_group_flags(self):
+        '''Parse a group starting with (?, or a flag change.
+
+        @return: Whether a group was opened.
+        '''
+        regex = self.regex
+        start = self.pos
+        for prefix in ['(?P<', '(?<']:
+            if regex.startswith(prefix, start):
+                end = regex.find('>', start)
+                if end < 0:
+                    self.fail('invalid named capture', start, len(regex))
+                self.pos = end + 1
+                name = regex[start + len(prefix):end]
+                if not NAME_RE.match(name):
+                    self.fail('invalid named capture', start)
+                if name in self.names:
+                    self.fail('duplicate capture group name', start)
+                self.names.add(name)
+                return True
+        match = FLAGS_RE.match(regex, start)
+        # Flags have to follow a -, like in (?-i) or (?i-s).
+        if match is None or match.group(2) == '':
+            self.fail(
+                'invalid or unsupported Perl syntax', start,
+                min(start + 3, len(regex)))
+        self.pos = match.end()
+        return match.group(3) == ':'
+
+    def parse_class(self):
+        '''Parse a character class, like [a-z] or [^[:space:]].'''
+        regex = self.regex
+        start = self.pos
+        self.pos += 1
+        if regex[self.pos:self.pos + 1] == '^':
+            self.pos += 1
+        first = True
+        while True:
+            if self.pos >= len(regex):
+                self.fail('missing closing ]', start)
+            char = regex[self.pos]
+            if char == ']' and not first:
+                self.pos += 1
+                return
+            first = False
+            if regex.startswith('[:', self.pos):
+                match = ASCII_CLASS_RE.match(regex, self.pos)
+                if match is not None:
+                    if match.group(1) not in ASCII_CLASSES:
+                        self.fail(
+                            'invalid character class range', self.pos,
+                            match.end())
+                    self.pos = match.end()
+                    continue
+            low_start = self.pos
+            low = self.parse_class_char()
+            if low is None:
+                continue
+            if (regex[self.pos:self.pos + 1] == '-' and
+                    regex[self.pos + 1:self.pos + 2] not in ('', ']')):
+                self.pos += 1
+                high = self.parse_class_char()
+                if high is None or high < low:
+                    self.fail('invalid character class range', low_start)
+
+    def parse_class_char(self):
+        '''Parse a character in a class.
+
+        @return: The code point of the character, or None if it was a
+            class, like \\d.
+        '''
+        if self.regex[self.pos] == '\\':
+            return self.parse_escape(in_class=True)
+        self.pos += 1
+        return ord(self.regex[self.pos - 1])
+
+    def parse_escape(self, in_class):
+        '''Parse an escape sequence.
+
+        @return: The code point of the escaped character, or None if the
+            sequence isn't a single character, like \\d or \\b.
+        '''
+        regex = self.regex
+        start = self.pos
+        if start + 1 >= len(regex):
+            self.fail('trailing backslash at end of expression', start)
+        char = regex[start + 1]
+        self.pos = start + 2
+        if char in PERL_CLASSES:
+            return None
+        if char in 'pP':
+            self.parse_unicode_class(start)
+            return None
+        if not in_class:
+            if char in ASSERTIONS:
+                return None
+            if char == 'Q':
+                # The text up to \E, or to the end, is literal.
+                end = regex.find('\\E', self.pos)
+                self.pos = len(regex) if end < 0 else end + 2
+                return None
+        if char in OCTAL_DIGITS:
+            following = regex[self.pos:self.pos + 1]
+            if char != '0' and (not following or
+                                following not in OCTAL_DIGITS):
+                # A single non-zero digit would be a backreference.
+                self.fail('invalid escape sequence', start)
+            # Up to three digits are octal.
+            while (self.pos < start + 4 and self.pos < len(regex) and
+                   regex[self.pos] in OCTAL_DIGITS):
+                self.pos += 1
+            return int(regex[start + 1:self.pos], 8)
+        if char == 'x':
+            if regex[self.pos:self.pos + 1] == '{':
+                end = regex.find('}', self.pos)
+                digits = regex[self.pos + 1:end] if end >= 0 else ''
+                if (not digits or
+                        any(digit not in HEX_DIGITS for digit in digits) or
+                        int(digits, 16) > 0x10ffff):
+                    self.fail(
+                        'invalid escape sequence', start,
+                        len(regex) if end < 0 else end + 1)
+                self.pos = end + 1
+                return int(digits, 16)
+            digits = regex[self.pos:self.pos + 2]
+            if (len(digits) < 2 or
+                    any(digit not in HEX_DIGITS for digit in digits)):
+                self.fail(
+                    'invalid escape sequence', start,
+                    min(self.pos + 2, len(regex)))
+            self.pos += 2
+            return int(digits, 16)
+        if char in SIMPLE_ESCAPES:
+            return SIMPLE_ESCAPES[char]
+        if ord(char) < 0x80 and not char.isalnum():
+            # Escaped punctuation is a literal.
+            return ord(char)
+        self.fail('invalid escape sequence', start)
+
+    def parse_unicode_class(self, start):
+        '''Parse the name after \\p or \\P, like L or {Greek}.'''
+        regex = self.regex
+        if regex[self.pos:self.pos + 1] == '{':
+            end = regex.find('}', self.pos)
+            if end < 0:
+                self.fail('invalid character class range', start, len(regex))
+            name = regex[self.pos + 1:end]
+            if name.startswith('^'):
+                name = name[1:]
+            self.pos = end + 1
+        else:
+            name = regex[self.pos:self.pos + 1]
+            self.pos += 1
+        if name not in UNICODE_CLASSES:
+            self.fail('invalid character class range', start)
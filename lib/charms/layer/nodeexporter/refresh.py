@@ -0,0 +1,74 @@
+'''Spread snap refreshes over a daily window.
+
+If all the units refresh the snap at the same time, all the exporters
+restart at once, which leaves a gap in the metrics. Instead, the
+refresh window is split into slots, and each unit is given a slot based
+on a hash of a key, like the unit name. Each slot gets about the same
+share of the units, so only that share restarts at any moment.
+
+Times are in UTC.
+'''
+import datetime
+import hashlib
+import re
+
+
+WINDOW_RE = re.compile(
+    r'^([01][0-9]|2[0-3]):([0-5][0-9])-([01][0-9]|2[0-3]):([0-5][0-9])$')
+MINUTES_PER_DAY = 24 * 60
+
+
+def parse_window(window):
+    '''Parse a window like "02:00-06:00".
+
+    The window may span midnight, like "22:00-02:00". If the start and
+    the end are the same, the window is the whole day.
+
+    @return: A (start, length) tuple, in minutes, with the start
+        counted from midnight.
+    '''
+    match = WINDOW_RE.match(window)
+    if match is None:
+        raise ValueError('Invalid refresh window: {}'.format(window))
+    start_hour, start_minute, end_hour, end_minute = map(int, match.groups())
+    start = start_hour * 60 + start_minute
+    end = end_hour * 60 + end_minute
+    length = (end - start) % MINUTES_PER_DAY or MINUTES_PER_DAY
+    return start, length
+
+
+def get_slot_offset(key, length, slot_minutes):
+    '''Return the start of the key's slot, in minutes into the window.'''
+    slots = max(1, length // slot_minutes)
+    digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+    return (int(digest, 16) % slots) * slot_minutes
+
+
+def get_slot_start(now, window, slot_minutes, key):
+    '''Return when the key's latest slot started, at or before now.
+
+    @param now: The current time, as a naive UTC datetime.
+    '''
+    start, length = parse_window(window)
+    minute = (start + get_slot_offset(key, length, slot_minutes)) % (
+        MINUTES_PER_DAY)
+    slot_start = datetime.datetime.combine(
+        now.date(), datetime.time(minute // 60, minute % 60))
+    if slot_start > now:
+        slot_start -= datetime.timedelta(days=1)
+    return slot_start
+
+
+def get_current_slot(now, window, slot_minutes, key):
+    '''Return the start of the key's slot if it's open now, or None.'''
+    slot_start = get_slot_start(now, window, slot_minutes, key)
+    if now - slot_start < datetime.timedelta(minutes=slot_minutes):
+        return slot_start
+    return None
+
+
+def get_next_slot(now, window, slot_minutes, key):
+    '''Return when the key's next slot starts, after now.'''
+    return (
+        get_slot_start(now, window, slot_minutes, key) +
+        datetime.timedelta(days=1))
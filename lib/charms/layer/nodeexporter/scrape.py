@@ -0,0 +1,124 @@
+'''Scrape the exporter and measure what it costs.
+
+The module only uses the standard library, so that it can be used
+outside of hooks as well.
+'''
+import concurrent.futures
+import http.client
+import math
+import re
+import time
+import urllib.request
+
+
+EXPORTER_URL = 'http://localhost:9100/metrics'
+COLLECTOR_DURATION_METRIC = 'node_scrape_collector_duration_seconds'
+SAMPLE_RE = re.compile(
+    r'^(?P<name>[a-zA-Z_:][a-zA-Z0-9_:]*)'
+    r'(?:\{(?P<labels>.*)\})?'
+    r'\s+(?P<value>\S+)(?:\s+(?P<timestamp>\S+))?\s*$')
+LABEL_RE = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+# The errors a failed scrape raises. A truncated or garbled response
+# raises an HTTPException rather than an OSError.
+SCRAPE_ERRORS = (OSError, http.client.HTTPException)
+
+
+def scrape(url=EXPORTER_URL, timeout=10, headers=None):
+    '''Scrape the given URL.
+
+    One of the SCRAPE_ERRORS is raised if the scrape fails.
+
+    @return: A tuple of the duration in seconds, and the response body.
+    '''
+    request = urllib.request.Request(url, headers=headers or {})
+    start = time.monotonic()
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        body = response.read()
+    return time.monotonic() - start, body
+
+
+def parse_samples(text):
+    '''Yield (name, labels, value) tuples for the samples in the text.
+
+    Comments and lines that can't be parsed are skipped.
+    '''
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        match = SAMPLE_RE.match(line)
+        if match is None:
+            continue
+        labels = {}
+        if match.group('labels'):
+            labels = dict(LABEL_RE.findall(match.group('labels')))
+        try:
+            value = float(match.group('value'))
+        except ValueError:
+            continue
+        yield match.group('name'), labels, value
+
+
+def get_collector_durations(text):
+    '''Return a dict mapping collector names to their scrape durations.'''
+    return {
+        labels['collector']: value
+        for name, labels, value in parse_samples(text)
+        if name == COLLECTOR_DURATION_METRIC and 'collector' in labels}
+
+
+def percentile(values, percent):
+    '''Return the given percentile of the values, using nearest rank.'''
+    if not values:
+        return None
+    values = sorted(values)
+    rank = math.ceil(percent / 100 * len(values))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def summarize(values):
+    return {
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+    }
+
+
+def benchmark(url=EXPORTER_URL, count=10, concurrency=1, timeout=10):
+    '''Scrape the URL count times and summarize the cost.
+
+    Up to concurrency scrapes are done at the same time.
+
+    @return: A dict with the number of successful scrapes and errors,
+        p50/p95/p99 latencies in seconds, the mean response size in
+        bytes, the number of series, and the latency percentiles of
+        each collector, as reported by the exporter itself.
+    '''
+    durations = []
+    sizes = []
+    series = []
+    collectors = {}
+    errors = []
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        futures = [
+            executor.submit(scrape, url, timeout) for _ in range(count)]
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                duration, body = future.result()
+            except SCRAPE_ERRORS as error:
+                errors.append(str(error) or repr(error))
+                continue
+            text = body.decode('utf-8', 'replace')
+            durations.append(duration)
+            sizes.append(len(body))
+            series.append(sum(1 for _ in parse_samples(text)))
+            for name, value in get_collector_durations(text).items():
+                collectors.setdefault(name, []).append(value)
+    return {
+        'scrapes': len(durations),
+        'errors': errors,
+        'latency': summarize(durations),
+        'bytes': int(sum(sizes) / len(sizes)) if sizes else 0,
+        'series': max(series) if series else 0,
+        'collectors': {
+            name: summarize(values) for name, values in collectors.items()},
+    }
@@ -0,0 +1,75 @@
+'''Cache snaps attached as resources, keyed by their checksum.
+
+Juju hands out the path of the current resource revision, but doesn't
+say whether it changed since the last hook. Copying the snap into a
+cache named after its checksum lets the charm tell whether it has
+already installed it, and keeps the installed snap around if the
+resource is removed.
+'''
+import hashlib
+import os
+import shutil
+import tempfile
+
+
+CHUNK_SIZE = 1024 * 1024
+# The number of snaps to keep in the cache, including the current one.
+MAX_CACHED = 2
+
+
+def get_digest(path):
+    '''Return the sha256 hex digest of the file's content.'''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as snap_file:
+        for chunk in iter(lambda: snap_file.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_cached_path(name, digest, directory):
+    '''Return the path the snap with the given digest is cached at.'''
+    return os.path.join(directory, '{}_{}.snap'.format(name, digest))
+
+
+def cache_snap(name, path, directory):
+    '''Copy the snap into the cache, unless it's already there.
+
+    The oldest cached snaps of the same name are removed, so that only
+    MAX_CACHED of them are kept.
+
+    @param name: The name of the snap.
+    @param path: The path of the snap file to cache.
+    @param directory: The cache directory, which has to exist.
+    @return: A (cached path, digest) tuple.
+    '''
+    digest = get_digest(path)
+    cached_path = get_cached_path(name, digest, directory)
+    if os.path.exists(cached_path):
+        # Mark it as the most recently used one.
+        os.utime(cached_path)
+    else:
+        fd, temp_path = tempfile.mkstemp(
+            prefix='.' + name, suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as temp_file, \
+                    open(path, 'rb') as snap_file:
+                shutil.copyfileobj(snap_file, temp_file, CHUNK_SIZE)
+            os.rename(temp_path, cached_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+    prune(name, directory, keep=cached_path)
+    return cached_path, digest
+
+
+def prune(name, directory, keep):
+    '''Remove the least recently used snaps, keeping MAX_CACHED.'''
+    prefix = name + '_'
+    cached = [
+        os.path.join(directory, filename)
+        for filename in os.listdir(directory)
+        if filename.startswith(prefix) and filename.endswith('.snap')]
+    cached.sort(key=os.path.getmtime, reverse=True)
+    for path in cached[MAX_CACHED:]:
+        if path != keep:
+            os.unlink(path)
@@ -0,0 +1,180 @@
+'''Manage the systemd services that the charm runs next to the exporter.
+
+Drop-ins are used to change the snap's own service, since its unit file
+is managed by snapd.
+'''
+import os
+import subprocess
+
+
+SYSTEMD_DIR = '/etc/systemd/system'
+
+SERVICE_TEMPLATE = '''\
+[Unit]
+Description={description}
+After=network.target
+
+[Service]
+ExecStart={command}
+Restart=always
+RestartSec=5
+{user}{extra}
+[Install]
+WantedBy=multi-user.target
+'''
+# A service run by a timer, rather than kept running.
+ONESHOT_TEMPLATE = '''\
+[Unit]
+Description={description}
+
+[Service]
+Type=oneshot
+ExecStart={command}
+{user}{extra}'''
+# The timer starts the service shortly after the timer itself is
+# started, which also happens on boot, and then every interval.
+TIMER_TEMPLATE = '''\
+[Unit]
+Description={description}
+
+[Timer]
+OnActiveSec=1
+OnUnitActiveSec={interval}
+
+[Install]
+WantedBy=timers.target
+'''
+# The directives for services that don't need to run as root.
+USER_TEMPLATE = '''\
+User={user}
+Group={group}
+NoNewPrivileges=yes
+PrivateTmp=yes
+'''
+
+
+def get_unit_path(name):
+    return os.path.join(SYSTEMD_DIR, name + '.service')
+
+
+def install_service(name, description, command, extra='', user=None,
+                    group=None):
+    '''Write a unit file for the service, and (re)start it.
+
+    @param name: The name of the service, without .service.
+    @param command: The command to run, as a list of arguments.
+    @param extra: Extra lines for the [Service] section.
+    @param user: The user to run the service as, instead of root.
+    @param group: The group to run the service as, if user is set.
+    '''
+    if extra and not extra.endswith('\n'):
+        extra += '\n'
+    unit = SERVICE_TEMPLATE.format(
+        description=description,
+        command=' '.join(quote(arg) for arg in command),
+        user=USER_TEMPLATE.format(user=user, group=group) if user else '',
+        extra=extra)
+    with open(get_unit_path(name), 'w') as unit_file:
+        unit_file.write(unit)
+    subprocess.check_call(['systemctl', 'daemon-reload'])
+    subprocess.check_call(['systemctl', 'enable', name])
+    subprocess.check_call(['systemctl', 'restart', name])
+
+
+def get_timer_path(name):
+    return os.path.join(SYSTEMD_DIR, name + '.timer')
+
+
+def install_timer(name, description, command, interval, extra='',
+                  user=None, group=None):
+    '''Write a service and a timer that runs it, and (re)start the timer.
+
+    @param name: The name of the service and timer, without suffix.
+    @param command: The command to run, as a list of arguments.
+    @param interval: The seconds between the runs of the command.
+    @param extra: Extra lines for the [Service] section.
+    @param user: The user to run the service as, instead of root.
+    @param group: The group to run the service as, if user is set.
+    '''
+    if extra and not extra.endswith('\n'):
+        extra += '\n'
+    service = ONESHOT_TEMPLATE.format(
+        description=description,
+        command=' '.join(quote(arg) for arg in command),
+        user=USER_TEMPLATE.format(user=user, group=group) if user else '',
+        extra=extra)
+    with open(get_unit_path(name), 'w') as unit_file:
+        unit_file.write(service)
+    timer = TIMER_TEMPLATE.format(
+        description=description, interval='{}s'.format(interval))
+    with open(get_timer_path(name), 'w') as timer_file:
+        timer_file.write(timer)
+    subprocess.check_call(['systemctl', 'daemon-reload'])
+    subprocess.check_call(['systemctl', 'enable', name + '.timer'])
+    subprocess.check_call(['systemctl', 'restart', name + '.timer'])
+
+
+def remove_timer(name):
+    '''Stop and remove the timer and its service, if they're installed.'''
+    path = get_timer_path(name)
+    if not os.path.exists(path):
+        return
+    subprocess.check_call(['systemctl', 'disable', '--now', name + '.timer'])
+    os.unlink(path)
+    if os.path.exists(get_unit_path(name)):
+        os.unlink(get_unit_path(name))
+    subprocess.check_call(['systemctl', 'daemon-reload'])
+
+
+def remove_service(name):
+    '''Stop and remove the service, if it's installed.'''
+    path = get_unit_path(name)
+    if not os.path.exists(path):
+        return
+    subprocess.check_call(['systemctl', 'disable', '--now', name])
+    os.unlink(path)
+    subprocess.check_call(['systemctl', 'daemon-reload'])
+
+
+def get_drop_in_path(service, name):
+    return os.path.join(SYSTEMD_DIR, service + '.service.d', name + '.conf')
+
+
+def install_drop_in(service, name, directives):
+    '''Write a drop-in for the [Service] section of a service.
+
+    The service isn't restarted, so that the caller can restart it
+    once, together with other changes.
+
+    @param service: The name of the service, without .service.
+    @param directives: A list of (key, value) tuples.
+    '''
+    path = get_drop_in_path(service, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as drop_in_file:
+        drop_in_file.write('[Service]\n')
+        for key, value in directives:
+            drop_in_file.write('{}={}\n'.format(key, value))
+    subprocess.check_call(['systemctl', 'daemon-reload'])
+
+
+def remove_drop_in(service, name):
+    '''Remove a drop-in, if it exists, without restarting the service.
+
+    @return: True if the drop-in existed.
+    '''
+    path = get_drop_in_path(service, name)
+    if not os.path.exists(path):
+        return False
+    os.unlink(path)
+    subprocess.check_call(['systemctl', 'daemon-reload'])
+    return True
+
+
+def quote(arg):
+    '''Quote an argument for a systemd ExecStart line.'''
+    if arg and not any(char in arg for char in ' \t"\'\\$%'):
+        return arg
+    return '"{}"'.format(
+        arg.replace('\\', '\\\\').replace('"', '\\"').replace('%', '%%')
+        .replace('$', '$$'))
@@ -0,0 +1,295 @@
+'''Write metrics files for the node_exporter textfile collector.
+
+The textfile collector fails the whole scrape if it reads a file that
+is only partly written, so files are written to a temporary file in
+the same directory and renamed into place.
+
+The module only uses the standard library, so that it can be run as a
+script from cron jobs as well:
+
+    some-command | python3 textfile.py write backup
+
+The charm's timer runs the configured generators the same way:
+
+    python3 textfile.py run --state state.json generators.json
+'''
+import argparse
+import hashlib
+import json
+import os
+import re
+import shlex
+import subprocess
+import sys
+import tempfile
+
+
+TEXTFILE_DIR = (
+    '/var/snap/bjornt-prometheus-node-exporter/common/textfile_collector')
+MAX_BYTES = 1024 * 1024
+MAX_SERIES = 10000
+# The seconds a generator command can run for.
+COMMAND_TIMEOUT = 60
+NAME_RE = re.compile(r'^[A-Za-z0-9_-]+$')
+
+
+class BudgetExceeded(Exception):
+    '''Raised when metrics exceed the size or series budget.'''
+
+
+def count_series(text):
+    '''Return the number of series in the given exposition text.'''
+    return sum(
+        1 for line in text.splitlines()
+        if line.strip() and not line.startswith('#'))
+
+
+def write_metrics(name, text, directory=TEXTFILE_DIR, max_bytes=MAX_BYTES,
+                  max_series=MAX_SERIES):
+    '''Atomically write the metrics in text to <directory>/<name>.prom.
+
+    BudgetExceeded is raised, and nothing is written, if the metrics are
+    larger than max_bytes or contain more than max_series series.
+    '''
+    if not NAME_RE.match(name):
+        raise ValueError('Invalid metrics file name: {}'.format(name))
+    if not text.endswith('\n'):
+        text += '\n'
+    content = text.encode('utf-8')
+    if len(content) > max_bytes:
+        raise BudgetExceeded(
+            '{}: {} bytes exceeds the budget of {} bytes'.format(
+                name, len(content), max_bytes))
+    series = count_series(text)
+    if series > max_series:
+        raise BudgetExceeded(
+            '{}: {} series exceeds the budget of {} series'.format(
+                name, series, max_series))
+    # The collector only reads *.prom files, so it won't see the
+    # temporary file.
+    fd, temp_path = tempfile.mkstemp(
+        prefix='.' + name, suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(content)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.chmod(temp_path, 0o644)
+        os.rename(temp_path, get_path(name, directory))
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def remove_metrics(name, directory=TEXTFILE_DIR):
+    '''Remove <directory>/<name>.prom, if it exists.'''
+    try:
+        os.unlink(get_path(name, directory))
+    except FileNotFoundError:
+        pass
+
+
+def get_path(name, directory=TEXTFILE_DIR):
+    return os.path.join(directory, name + '.prom')
+
+
+class Generator:
+    '''Something that renders a metrics file.
+
+    @ivar name: The name of the metrics file, without .prom.
+    @ivar inputs: Callable returning JSON-serializable data describing
+        the inputs of the generator. The metrics are only rendered again
+        if the inputs change. If it returns None, the metrics are
+        rendered every time.
+    @ivar render: Callable returning the metrics as exposition text.
+    '''
+
+    def __init__(self, name, inputs, render):
+        self.name = name
+        self.inputs = inputs
+        self.render = render
+
+
+class CommandGenerator(Generator):
+    '''A generator that runs a command and renders its output.
+
+    The inputs are the modification times and sizes of the given input
+    paths. Without input paths, the command runs every time.
+    '''
+
+    def __init__(self, name, command, input_paths=(),
+                 timeout=COMMAND_TIMEOUT):
+        super().__init__(name, self._get_inputs, self._run)
+        self.command = command
+        self.input_paths = list(input_paths)
+        self.timeout = timeout
+
+    def _get_inputs(self):
+        if not self.input_paths:
+            return None
+        inputs = [self.command]
+        for path in self.input_paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                inputs.append([path, None, None])
+            else:
+                inputs.append([path, stat.st_mtime, stat.st_size])
+        return inputs
+
+    def _run(self):
+        return subprocess.check_output(
+            shlex.split(self.command), timeout=self.timeout,
+            universal_newlines=True)
+
+
+class GeneratorRegistry:
+    '''Generators that are rendered incrementally.
+
+    The digests of the generator inputs are kept in a state dict,
+    which the caller is responsible for persisting between runs.
+    '''
+
+    def __init__(self, directory=TEXTFILE_DIR, max_bytes=MAX_BYTES,
+                 max_series=MAX_SERIES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_series = max_series
+        self.generators = {}
+
+    def register(self, generator):
+        self.generators[generator.name] = generator
+
+    def run(self, state):
+        '''Render the generators whose inputs have changed.
+
+        Metrics files of generators that are no longer registered are
+        removed.
+
+        @param state: Dict mapping generator names to the digest of
+            their inputs at the last successful render. It's updated in
+            place.
+        @return: A tuple of the names of the rendered generators, and
+            a dict mapping names of failed generators to their errors.
+        '''
+        rendered = []
+        errors = {}
+        for name in sorted(set(state) - set(self.generators)):
+            remove_metrics(name, self.directory)
+            del state[name]
+        for name, generator in sorted(self.generators.items()):
+            inputs = generator.inputs()
+            digest = None
+            if inputs is not None:
+                digest = hashlib.sha256(
+                    json.dumps(inputs, sort_keys=True).encode('utf-8')
+                    ).hexdigest()
+                if (state.get(name) == digest and
+                        os.path.exists(get_path(name, self.directory))):
+                    continue
+            try:
+                write_metrics(
+                    name, generator.render(), directory=self.directory,
+                    max_bytes=self.max_bytes, max_series=self.max_series)
+            except (BudgetExceeded, OSError, ValueError,
+                    subprocess.SubprocessError) as error:
+                errors[name] = str(error)
+                state.pop(name, None)
+                continue
+            state[name] = digest
+            rendered.append(name)
+        return rendered, errors
+
+
+def load_registry(path, directory=TEXTFILE_DIR, max_bytes=MAX_BYTES,
+                  max_series=MAX_SERIES):
+    '''Return a registry with the command generators described in a file.
+
+    @param path: A JSON file mapping generator names to dicts with the
+        'command' to run and its 'inputs'.
+    '''
+    registry = GeneratorRegistry(
+        directory=directory, max_bytes=max_bytes, max_series=max_series)
+    with open(path) as registry_file:
+        generators = json.load(registry_file)
+    for name, options in sorted(generators.items()):
+        registry.register(CommandGenerator(
+            name, options['command'], input_paths=options.get('inputs', [])))
+    return registry
+
+
+def read_state(path):
+    '''Return the generator state stored by write_state(), or {}.'''
+    try:
+        with open(path) as state_file:
+            return json.load(state_file)
+    except FileNotFoundError:
+        return {}
+
+
+def write_state(path, state):
+    '''Store the generator state, atomically.'''
+    fd, temp_path = tempfile.mkstemp(
+        prefix='.state', suffix='.tmp',
+        dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'w') as temp_file:
+            json.dump(state, temp_file)
+        os.rename(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Write metrics for the node_exporter textfile collector.')
+    parser.add_argument(
+        '--directory', default=TEXTFILE_DIR,
+        help='The textfile collector directory.')
+    parser.add_argument('--max-bytes', type=int, default=MAX_BYTES)
+    parser.add_argument('--max-series', type=int, default=MAX_SERIES)
+    subparsers = parser.add_subparsers(dest='command')
+    write_parser = subparsers.add_parser(
+        'write', help='Atomically write metrics read from stdin.')
+    write_parser.add_argument('name', help='File name, without .prom.')
+    remove_parser = subparsers.add_parser(
+        'remove', help='Remove a metrics file.')
+    remove_parser.add_argument('name', help='File name, without .prom.')
+    run_parser = subparsers.add_parser(
+        'run', help='Render the generators whose inputs have changed.')
+    run_parser.add_argument(
+        'registry', help='JSON file describing the generators.')
+    run_parser.add_argument(
+        '--state', required=True,
+        help='JSON file the digests of the generator inputs are kept in.')
+    args = parser.parse_args(argv)
+    if args.command == 'write':
+        try:
+            write_metrics(
+                args.name, sys.stdin.read(), directory=args.directory,
+                max_bytes=args.max_bytes, max_series=args.max_series)
+        except (BudgetExceeded, ValueError) as error:
+            parser.exit(1, 'error: {}\n'.format(error))
+    elif args.command == 'remove':
+        remove_metrics(args.name, directory=args.directory)
+    elif args.command == 'run':
+        registry = load_registry(
+            args.registry, directory=args.directory,
+            max_bytes=args.max_bytes, max_series=args.max_series)
+        state = read_state(args.state)
+        rendered, errors = registry.run(state)
+        write_state(args.state, state)
+        for name in rendered:
+            print('Rendered textfile metrics: {}'.format(name))
+        for name, error in sorted(errors.items()):
+            print('Failed to render textfile metrics {}: {}'.format(
+                name, error), file=sys.stderr)
+        if errors:
+            parser.exit(1)
+    else:
+        parser.error('a command is required')
+
+
+if __name__ == '__main__':
+    main()
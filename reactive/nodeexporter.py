@@ -1,17 +1,1439 @@
-from charms.reactive import when
-from charmhelpers.core import hookenv
+import datetime
+import hashlib
+import json
+import os
+import re
+import shlex
+import socket
+import subprocess
+import time
+
+import yaml
+
+from charms.layer.nodeexporter import (
+    cache, compat, election, fastpath, health, hints, profiling, re2,
+    refresh, scrape, snapcache, systemd, textfile)
+from charms.reactive import (
+    hook, is_state, remove_state, set_state, when, when_not)
+from charms.reactive.helpers import data_changed
+from charmhelpers.core import hookenv, host, unitdata
+
+
+SNAP_NAME = 'bjornt-prometheus-node-exporter'
+SNAP_CHANNEL = 'stable'
+EXPORTER_PORT = 9100
+COLLECTOR_NAME_RE = re.compile(r'^[a-z0-9_]+$')
+# Config options for filtering out series, and the exporter flags
+# they map to. Options in the same group are mutually exclusive.
+COLLECTOR_FILTERS = [
+    [('netdev_device_include', 'collector.netdev.device-include'),
+     ('netdev_device_exclude', 'collector.netdev.device-exclude')],
+    [('diskstats_device_include', 'collector.diskstats.device-include'),
+     ('diskstats_device_exclude', 'collector.diskstats.device-exclude')],
+    [('filesystem_mount_points_exclude',
+      'collector.filesystem.mount-points-exclude')],
+    [('filesystem_fs_types_exclude', 'collector.filesystem.fs-types-exclude')],
+]
+# The collectors node_exporter enables by default on Linux.
+DEFAULT_COLLECTORS = frozenset([
+    'arp', 'bcache', 'bonding', 'btrfs', 'conntrack', 'cpu', 'cpufreq',
+    'diskstats', 'dmi', 'edac', 'entropy', 'fibrechannel', 'filefd',
+    'filesystem', 'hwmon', 'infiniband', 'ipvs', 'loadavg', 'mdadm',
+    'meminfo', 'netclass', 'netdev', 'netstat', 'nfs', 'nfsd', 'nvme', 'os',
+    'powersupplyclass', 'pressure', 'rapl', 'schedstat', 'selinux',
+    'sockstat', 'softnet', 'stat', 'tapestats', 'textfile', 'thermal_zone',
+    'time', 'timex', 'udp_queues', 'uname', 'vmstat', 'xfs', 'zfs'])
+PRINCIPAL_UNIT_KEY = 'nodeexporter.principal-unit'
+PUBLISHED_KEY = 'nodeexporter.published'
+FILTERS_KEY = 'nodeexporter.collector-filters'
+CONSUMERS_KEY = 'nodeexporter.consumers'
+SCRAPE_SAMPLES_KEY = 'nodeexporter.scrape-samples'
+SCRAPE_TIMEOUT_KEY = 'nodeexporter.scrape-timeout'
+# Where the hooks used to keep the state of the textfile generators,
+# before they were run by a timer.
+TEXTFILE_STATE_KEY = 'nodeexporter.textfile-generators'
+SNAP_SOURCE_KEY = 'nodeexporter.snap-source'
+SNAP_CACHE_DIRNAME = 'nodeexporter-snaps'
+REFRESH_HELD_KEY = 'nodeexporter.refresh-held'
+REFRESH_SLOT_KEY = 'nodeexporter.refresh-slot'
+ACTIVE_UNIT_KEY = 'nodeexporter.active-unit'
+HEALTH_KEY = 'nodeexporter.health'
+EXPORTER_VERSION_KEY = 'nodeexporter.exporter-version'
+# The data_changed() ids of what the active unit applies to the exporter.
+ACTIVE_DATA_CHANGED_IDS = [
+    'nodeexporter.args', 'nodeexporter.scrape-cache',
+    'nodeexporter.slow-exporter', 'nodeexporter.limits', 'nodeexporter.push',
+    'nodeexporter.textfile-cli', 'nodeexporter.textfile-generators']
+# The data_changed() ids of the services and commands that run code
+# from the charm directory, or whose unit files the charm renders.
+CHARM_CODE_DATA_CHANGED_IDS = [
+    'nodeexporter.scrape-cache', 'nodeexporter.slow-exporter',
+    'nodeexporter.push', 'nodeexporter.textfile-cli',
+    'nodeexporter.textfile-generators']
+TEXTFILE_CLI_PATH = '/usr/local/bin/node-exporter-textfile'
+SCRAPE_CACHE_SERVICE = 'node-exporter-scrape-cache'
+SLOW_EXPORTER_SERVICE = 'node-exporter-slow'
+SLOW_EXPORTER_PORT = 9110
+PUSH_SERVICE = 'node-exporter-push'
+PUSH_SPOOL_DIR = '/var/snap/{}/common/push-spool'.format(SNAP_NAME)
+TEXTFILE_GENERATORS_SERVICE = 'node-exporter-textfile-generators'
+TEXTFILE_GENERATORS_PATH = (
+    '/var/snap/{}/common/textfile-generators.json'.format(SNAP_NAME))
+TEXTFILE_STATE_DIR = '/var/snap/{}/common/textfile-generators'.format(
+    SNAP_NAME)
+TEXTFILE_STATE_PATH = os.path.join(TEXTFILE_STATE_DIR, 'state.json')
+# The user and group the services that don't need root run as.
+SERVICE_USER = 'nobody'
+SERVICE_GROUP = 'nogroup'
+# The service snapd runs the exporter as.
+SNAP_SERVICE = 'snap.{0}.{0}'.format(SNAP_NAME)
+LIMITS_DROP_IN = 'nodeexporter-limits'
+CPU_QUOTA_RE = re.compile(r'^[1-9][0-9]*%$')
+MEMORY_LIMIT_RE = re.compile(r'^[1-9][0-9]*[KMGT]?$')
+IO_SCHEDULING_CLASSES = ['realtime', 'best-effort', 'idle']
+EXPORTER_COMMAND = '/snap/bin/bjornt-prometheus-node-exporter'
+SCRAPE_INTERVAL_RE = re.compile(r'^[0-9]+(ms|s|m|h)$')
+SCRAPE_INTERVALS = {'scrape_interval': '15s', 'slow_scrape_interval': '5m'}
+# The config options describing the exporter that is published. Passive
+# units publish the active unit's values of them.
+EXPORTER_OPTIONS = [
+    'enable_collectors', 'disable_collectors', 'slow_collectors',
+    'slow_exporter_port', 'scrape_cache_ttl', 'scrape_cache_port',
+    'scrape_interval', 'slow_scrape_interval', 'scrape_hints',
+] + [option for group in COLLECTOR_FILTERS for option, _ in group]
+
+
+def start_profiling():
+    '''Profile the handlers of the current hook, if hook_profiling is set.
+
+    This is run by the reactive framework once the handlers are loaded,
+    before any of them are dispatched, so that loading the handlers
+    doesn't wrap anything. The wrapped functions are restored and the
+    record is stored when the hook has completed.
+    '''
+    config = hookenv.config()
+    if not config.get('hook_profiling'):
+        return
+    profiler = profiling.Profiler(
+        hookenv.hook_name(),
+        use_cprofile=config.get('hook_profiling_cprofile', False))
+    profiler.install()
+
+    def stop_profiling():
+        profiler.uninstall()
+        profiling.add_record(unitdata.kv(), profiler.get_record())
+
+    hookenv.atexit(stop_profiling)
+
+
+hookenv.atstart(start_profiling)
+
+
+@hook('container-relation-joined')
+def container_joined():
+    unitdata.kv().set(PRINCIPAL_UNIT_KEY, hookenv.remote_unit())
+
+
+@hook('container-relation-departed')
+def container_departed():
+    kv = unitdata.kv()
+    if kv.get(PRINCIPAL_UNIT_KEY) == hookenv.remote_unit():
+        kv.unset(PRINCIPAL_UNIT_KEY)
+
+
+@hook('prometheus-client-relation-{joined,changed}')
+def prometheus_client_changed():
+    '''Record which Prometheus is on the relation, and what it requests.
+
+    The relation data is only read here, so that other hooks don't have
+    to call relation-get.
+    '''
+    remote_unit = hookenv.remote_unit()
+    kv = unitdata.kv()
+    consumers = kv.get(CONSUMERS_KEY, {})
+    consumers[hookenv.relation_id()] = {
+        'application': remote_unit.split('/', 1)[0],
+        'collectors': (hookenv.relation_get('collectors') or '').split(),
+    }
+    kv.set(CONSUMERS_KEY, consumers)
+
+
+@hook('install', 'upgrade-charm')
+def check_snap_resource():
+    '''Check the snap resource once the snap layer has set up snapd.
+
+    Attaching a new resource revision triggers upgrade-charm.
+    '''
+    set_state('nodeexporter.install-snap')
+
+
+@when('nodeexporter.install-snap')
+@when_not('snap.installed.bjornt-prometheus-node-exporter')
+def install_first_snap():
+    '''Install the snap, unless another unit on the machine manages it.
+
+    Units are only elected once the snap is installed, so the first unit
+    on the machine installs it. The others use the installed snap, and
+    install it from their own source if they become active.
+    '''
+    active_unit = election.get_active_unit()
+    if active_unit not in (None, hookenv.local_unit()):
+        hookenv.log('Using the snap installed by ' + active_unit)
+        set_state('snap.installed.bjornt-prometheus-node-exporter')
+        return
+    install_snap_from_source()
+
+
+@when('nodeexporter.install-snap', 'nodeexporter.active')
+def install_snap():
+    '''Install the exporter snap again, if its source has changed.
+
+    The snap is shared by the units on the machine, and installing it
+    restarts the exporter, so only the active unit installs it.
+    '''
+    install_snap_from_source()
+
+
+def install_snap_from_source():
+    '''Install the exporter snap, from the resource if one is attached.
+
+    The snap is only installed again if its checksum has changed.
+    '''
+    remove_state('nodeexporter.install-snap')
+    resource_path = get_snap_resource()
+    if resource_path is None:
+        install_snap_from_store(
+            hookenv.config().get('snap_channel') or SNAP_CHANNEL)
+        return
+    cache_dir = get_snap_cache_dir()
+    host.mkdir(cache_dir, perms=0o700)
+    cached_path, digest = snapcache.cache_snap(
+        SNAP_NAME, resource_path, cache_dir)
+    source = 'resource:' + digest
+    if not update_snap_source(source):
+        hookenv.log('The snap resource is already installed')
+        return
+    hookenv.log('Installing the snap resource with sha256 ' + digest)
+    subprocess.check_call(['snap', 'install', '--dangerous', cached_path])
+    set_state('snap.installed.bjornt-prometheus-node-exporter')
+
+
+@hook('config-changed')
+def change_snap_channel():
+    '''Switch to the configured channel, unless using the resource.'''
+    source = unitdata.kv().get(SNAP_SOURCE_KEY)
+    if source is None or source.startswith('resource:'):
+        return
+    if not is_state('nodeexporter.active'):
+        return
+    install_snap_from_store(
+        hookenv.config().get('snap_channel') or SNAP_CHANNEL)
+
+
+@when('snap.installed.bjornt-prometheus-node-exporter')
+def configure_exporter():
+    '''Check that the config is valid.
+
+    The handlers applying the config only run if it is. They are gated
+    on nodeexporter.config-valid, rather than on the absence of
+    nodeexporter.invalid-config, since only removing a state makes the
+    handlers that were already selected in this hook get tested again.
+    '''
+    try:
+        get_exporter_args(hookenv.config())
+        get_textfile_generators(hookenv.config())
+        get_scrape_cache_command(hookenv.config())
+        get_consumer_collectors(hookenv.config())
+        get_slow_exporter_command(hookenv.config())
+        get_scrape_intervals(hookenv.config())
+        get_refresh_window(hookenv.config())
+        get_resource_limits(hookenv.config())
+        get_push_command(hookenv.config())
+        check_exporter_support(hookenv.config())
+    except ValueError as error:
+        hookenv.status_set('blocked', str(error))
+        set_state('nodeexporter.invalid-config')
+        remove_state('nodeexporter.config-valid')
+        return
+    remove_state('nodeexporter.invalid-config')
+    set_state('nodeexporter.config-valid')
+
+
+@when('snap.installed.bjornt-prometheus-node-exporter')
+@when_not('nodeexporter.stopped')
+def elect_exporter():
+    '''Elect the unit that manages the exporter on this machine.
+
+    Subordinate units of different applications can end up on the same
+    machine. They share the snap, so only one of them configures it,
+    and the others publish the same endpoint.
+    '''
+    unit = hookenv.local_unit()
+    active_unit = election.elect(unit)
+    kv = unitdata.kv()
+    previous_active_unit = kv.get(ACTIVE_UNIT_KEY)
+    kv.set(ACTIVE_UNIT_KEY, active_unit)
+    if (active_unit != previous_active_unit and
+            is_state('prometheus-client.available')):
+        # The role is part of the relation data, and the handler
+        # publishing it may already have run in this hook.
+        publish_relation_data()
+    if active_unit != unit:
+        remove_state('nodeexporter.active')
+    elif not is_state('nodeexporter.active'):
+        # Another unit may have changed the exporter while this one
+        # was passive, so everything is applied again.
+        kv.unsetrange(
+            ACTIVE_DATA_CHANGED_IDS, prefix='reactive.data_changed.')
+        kv.unset(REFRESH_HELD_KEY)
+        set_state('nodeexporter.active')
+
+
+@hook('stop')
+def release_exporter():
+    '''Let another unit on the machine manage the exporter.
+
+    If this unit is the active one, the services and the command it
+    installed are removed first, since they run code from the charm
+    directory, which is removed together with the unit. The unit that
+    takes over installs them again.
+    '''
+    set_state('nodeexporter.stopped')
+    if is_state('nodeexporter.active'):
+        for service in [
+                SCRAPE_CACHE_SERVICE, SLOW_EXPORTER_SERVICE, PUSH_SERVICE]:
+            systemd.remove_service(service)
+        systemd.remove_timer(TEXTFILE_GENERATORS_SERVICE)
+        systemd.remove_drop_in(SNAP_SERVICE, LIMITS_DROP_IN)
+        if os.path.exists(TEXTFILE_CLI_PATH):
+            os.unlink(TEXTFILE_CLI_PATH)
+        remove_state('nodeexporter.active')
+    election.release(hookenv.local_unit())
+
+
+@hook('upgrade-charm')
+def restart_charm_services():
+    '''Reinstall the services, so that they run the upgraded code.
+
+    Their commands don't change on upgrade, so they wouldn't be
+    restarted otherwise.
+    '''
+    unitdata.kv().unsetrange(
+        CHARM_CODE_DATA_CHANGED_IDS, prefix='reactive.data_changed.')
+
+
+@when('snap.installed.bjornt-prometheus-node-exporter', 'nodeexporter.active',
+      'nodeexporter.config-valid')
+def apply_exporter_args():
+    '''Pass the configured command line arguments to the exporter.
+
+    The exporter is restarted only if the arguments have changed.
+    '''
+    args = get_exporter_args(hookenv.config())
+    if data_changed('nodeexporter.args', args):
+        subprocess.check_call(
+            ['snap', 'set', SNAP_NAME,
+             'args=' + ' '.join(shlex.quote(arg) for arg in args)])
+        set_state('nodeexporter.restart')
+        unitdata.kv().set(
+            FILTERS_KEY, get_collector_filters(hookenv.config()))
+
+
+@when('snap.installed.bjornt-prometheus-node-exporter', 'nodeexporter.active',
+      'nodeexporter.config-valid')
+def configure_refresh_hold():
+    '''Hold the automatic snap refreshes if there's a refresh window.
+
+    The snap is then refreshed in the unit's slot of the window by
+    update-status instead.
+    '''
+    kv = unitdata.kv()
+    hold = get_refresh_window(hookenv.config()) is not None
+    if kv.get(REFRESH_HELD_KEY, False) == hold:
+        return
+    subprocess.check_call(
+        ['snap', 'refresh', '--hold' if hold else '--unhold', SNAP_NAME])
+    kv.set(REFRESH_HELD_KEY, hold)
+
+
+@hook('update-status')
+def refresh_snap_in_window():
+    '''Refresh the snap once per window, in the unit's slot.'''
+    config = hookenv.config()
+    try:
+        window = get_refresh_window(config)
+    except ValueError:
+        return
+    if window is None:
+        return
+    if not is_state('nodeexporter.active'):
+        return
+    slot = refresh.get_current_slot(
+        datetime.datetime.utcnow(), window, config['refresh_slot_minutes'],
+        get_refresh_key())
+    kv = unitdata.kv()
+    if slot is None or kv.get(REFRESH_SLOT_KEY) == slot.isoformat():
+        return
+    kv.set(REFRESH_SLOT_KEY, slot.isoformat())
+    if kv.get(SNAP_SOURCE_KEY, '').startswith('resource:'):
+        # Snaps installed from a file aren't refreshed from the store.
+        return
+    hookenv.log('Refreshing the snap in the slot starting at {}'.format(
+        slot.isoformat()))
+    subprocess.check_call(['snap', 'refresh', SNAP_NAME])
+
+
+@when('nodeexporter.restart')
+def restart_exporter():
+    subprocess.check_call(['snap', 'restart', SNAP_NAME])
+    remove_state('nodeexporter.restart')
+
+
+@when('snap.installed.bjornt-prometheus-node-exporter')
+@when_not('nodeexporter.textfile-ready')
+def setup_textfile_directory():
+    host.mkdir(textfile.TEXTFILE_DIR, perms=0o755)
+    set_state('nodeexporter.textfile-ready')
+
+
+@when('nodeexporter.textfile-ready', 'nodeexporter.active')
+def install_textfile_cli():
+    '''Install a command for writing to the textfile collector directory.'''
+    config = hookenv.config()
+    command = [
+        '/usr/bin/python3', get_module_path('textfile'),
+        '--max-bytes', str(config.get('textfile_max_bytes') or
+                           textfile.MAX_BYTES),
+        '--max-series', str(config.get('textfile_max_series') or
+                            textfile.MAX_SERIES),
+    ]
+    if data_changed('nodeexporter.textfile-cli', command):
+        cli = '#!/bin/sh\nexec {} "$@"\n'.format(
+            ' '.join(shlex.quote(arg) for arg in command))
+        host.write_file(TEXTFILE_CLI_PATH, cli.encode('utf-8'), perms=0o755)
+
+
+@when('nodeexporter.textfile-ready', 'nodeexporter.active',
+      'nodeexporter.config-valid')
+def configure_textfile_generators():
+    '''Run the textfile generators from a timer, if there are any.
+
+    The generators run as an unprivileged user outside of the hooks, so
+    that slow commands don't hold up the hooks. The hooks only write
+    the file describing the generators, and install the timer.
+    '''
+    config = hookenv.config()
+    generators = get_textfile_generators(config)
+    command = get_textfile_generators_command(config)
+    interval = config.get('textfile_generators_interval')
+    if not data_changed(
+            'nodeexporter.textfile-generators',
+            [generators, command, interval]):
+        return
+    unitdata.kv().unset(TEXTFILE_STATE_KEY)
+    if not generators:
+        remove_textfile_generators()
+        return
+    host.write_file(
+        TEXTFILE_GENERATORS_PATH,
+        json.dumps(generators, sort_keys=True).encode('utf-8'),
+        perms=0o644)
+    # The textfile directory and the metrics files that the hooks wrote
+    # are owned by root. The sticky bit keeps the generators from
+    # replacing files that other tools write.
+    extra = [
+        'PermissionsStartOnly=true',
+        'TimeoutStartSec={}'.format(
+            len(generators) * textfile.COMMAND_TIMEOUT + 30),
+        'ExecStartPre=/bin/mkdir -p {}'.format(TEXTFILE_STATE_DIR),
+        'ExecStartPre=/bin/chown -R {}:{} {}'.format(
+            SERVICE_USER, SERVICE_GROUP, TEXTFILE_STATE_DIR),
+        'ExecStartPre=/bin/chgrp {} {}'.format(
+            SERVICE_GROUP, textfile.TEXTFILE_DIR),
+        'ExecStartPre=/bin/chmod 1775 {}'.format(textfile.TEXTFILE_DIR),
+    ] + [
+        'ExecStartPre=-/bin/chown {}:{} {}'.format(
+            SERVICE_USER, SERVICE_GROUP, textfile.get_path(name))
+        for name in sorted(generators)]
+    systemd.install_timer(
+        TEXTFILE_GENERATORS_SERVICE, 'Prometheus node exporter textfile '
+        'generators', command, interval, extra='\n'.join(extra),
+        user=SERVICE_USER, group=SERVICE_GROUP)
+
+
+def remove_textfile_generators():
+    '''Remove the timer, and the metrics files the generators wrote.'''
+    systemd.remove_timer(TEXTFILE_GENERATORS_SERVICE)
+    # Running the generators with none registered removes their files.
+    textfile.GeneratorRegistry().run(
+        textfile.read_state(TEXTFILE_STATE_PATH))
+    for path in [TEXTFILE_GENERATORS_PATH, TEXTFILE_STATE_PATH]:
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+@when('snap.installed.bjornt-prometheus-node-exporter', 'nodeexporter.active',
+      'nodeexporter.config-valid')
+def configure_scrape_cache():
+    '''Run the caching front-end, if it's enabled.'''
+    command = get_scrape_cache_command(hookenv.config())
+    if not data_changed('nodeexporter.scrape-cache', command):
+        return
+    if command is None:
+        systemd.remove_service(SCRAPE_CACHE_SERVICE)
+    else:
+        systemd.install_service(
+            SCRAPE_CACHE_SERVICE, 'Prometheus node exporter scrape cache',
+            command, user=SERVICE_USER, group=SERVICE_GROUP)
+
+
+@when('snap.installed.bjornt-prometheus-node-exporter', 'nodeexporter.active',
+      'nodeexporter.config-valid')
+def configure_slow_exporter():
+    '''Run a second exporter instance for the slow collectors, if any.'''
+    command = get_slow_exporter_command(hookenv.config())
+    limits = get_resource_limits(hookenv.config())
+    if not data_changed('nodeexporter.slow-exporter', [command, limits]):
+        return
+    if command is None:
+        systemd.remove_service(SLOW_EXPORTER_SERVICE)
+    else:
+        # It runs as root, like the snap's own service, since snap run
+        # needs a home directory for the user.
+        systemd.install_service(
+            SLOW_EXPORTER_SERVICE,
+            'Prometheus node exporter for slow collectors', command,
+            extra=''.join(
+                '{}={}\n'.format(key, value) for key, value in limits))
+
+
+@when('snap.installed.bjornt-prometheus-node-exporter', 'nodeexporter.active',
+      'nodeexporter.config-valid')
+def configure_push_agent():
+    '''Push the metrics to push_endpoint, if it's set.'''
+    command = get_push_command(hookenv.config())
+    if not data_changed('nodeexporter.push', command):
+        return
+    if command is None:
+        systemd.remove_service(PUSH_SERVICE)
+    else:
+        # The spool may have been written by an agent running as root.
+        extra = ''.join([
+            'PermissionsStartOnly=true\n',
+            'ExecStartPre=/bin/mkdir -p {}\n'.format(PUSH_SPOOL_DIR),
+            'ExecStartPre=/bin/chown -R {}:{} {}\n'.format(
+                SERVICE_USER, SERVICE_GROUP, PUSH_SPOOL_DIR)])
+        systemd.install_service(
+            PUSH_SERVICE, 'Prometheus node exporter push agent', command,
+            extra=extra, user=SERVICE_USER, group=SERVICE_GROUP)
+
+
+@when('snap.installed.bjornt-prometheus-node-exporter', 'nodeexporter.active',
+      'nodeexporter.config-valid')
+def configure_resource_limits():
+    '''Limit the resources the exporter can use, using a drop-in.
+
+    The exporter is restarted together with any argument changes, so
+    that it's only restarted once.
+    '''
+    limits = get_resource_limits(hookenv.config())
+    if not data_changed('nodeexporter.limits', limits):
+        return
+    if limits:
+        systemd.install_drop_in(SNAP_SERVICE, LIMITS_DROP_IN, limits)
+    elif not systemd.remove_drop_in(SNAP_SERVICE, LIMITS_DROP_IN):
+        return
+    set_state('nodeexporter.restart')
+
+
+@when('snap.installed.bjornt-prometheus-node-exporter', 'nodeexporter.active',
+      'nodeexporter.config-valid')
+def share_exporter_config():
+    '''Let the passive units publish the exporter as it's configured.
+
+    They pick up the change in their next update-status hook.
+    '''
+    if election.share_exporter(hookenv.local_unit(), get_exporter_state()):
+        hookenv.log('Shared the exporter config with the passive units')
+
+
+@hook('update-status')
+def check_exporter_health():
+    '''Probe the exporter, backing off while it's healthy.'''
+    if not is_state('snap.installed.bjornt-prometheus-node-exporter'):
+        return
+    kv = unitdata.kv()
+    state = kv.get(HEALTH_KEY)
+    now = time.time()
+    if not health.is_due(state, now):
+        return
+    try:
+        url = get_health_url(get_exporter_config())
+    except ValueError:
+        # The config is reported as invalid instead.
+        return
+    latency, error = health.probe(url)
+    if error is not None:
+        hookenv.log(
+            'Exporter health check failed: {}'.format(error),
+            level=hookenv.WARNING)
+    kv.set(HEALTH_KEY, health.update(state, now, latency, error))
+
+
+@hook('update-status')
+def sample_scrape_duration():
+    '''Sample how long the exporter takes to answer a scrape.
+
+    The recommended scrape timeout is only updated if it changes
+    significantly, to avoid republishing the relation data needlessly.
+    '''
+    kv = unitdata.kv()
+    if not hookenv.config().get('scrape_hints'):
+        kv.unset(SCRAPE_SAMPLES_KEY)
+        kv.unset(SCRAPE_TIMEOUT_KEY)
+        return
+    if not is_state('snap.installed.bjornt-prometheus-node-exporter'):
+        return
+    url = 'http://localhost:{}/metrics'.format(EXPORTER_PORT)
+    try:
+        duration, _ = scrape.scrape(url, timeout=30)
+    except scrape.SCRAPE_ERRORS as error:
+        hookenv.log(
+            'Failed to sample the scrape duration: {}'.format(error),
+            level=hookenv.WARNING)
+        return
+    samples = hints.add_sample(kv.get(SCRAPE_SAMPLES_KEY, []), duration)
+    kv.set(SCRAPE_SAMPLES_KEY, samples)
+    timeout = hints.recommend_timeout(samples)
+    if hints.should_publish(kv.get(SCRAPE_TIMEOUT_KEY), timeout):
+        kv.set(SCRAPE_TIMEOUT_KEY, timeout)
+        try:
+            interval = get_raised_scrape_interval(hookenv.config(), timeout)
+        except ValueError:
+            # configure_exporter() reports the invalid config.
+            return
+        if interval is not None:
+            hookenv.log(
+                'The scrape timeout of {}s is longer than scrape_interval, '
+                'so the suggested scrape interval is raised to {}'.format(
+                    timeout, interval),
+                level=hookenv.WARNING)
+
+
+@when('snap.installed.bjornt-prometheus-node-exporter')
+@when_not('nodeexporter.invalid-config')
+def ready():
+    status = health.get_status(unitdata.kv().get(HEALTH_KEY))
+    if status is not None:
+        hookenv.status_set(*status)
+        return
+    active_unit = unitdata.kv().get(ACTIVE_UNIT_KEY)
+    if active_unit not in (None, hookenv.local_unit()):
+        hookenv.status_set(
+            'active', 'Ready, exporter managed by {}'.format(active_unit))
+        return
+    config = hookenv.config()
+    details = []
+    limits = get_resource_limits(config)
+    if limits:
+        details.append('limits: {}'.format(
+            ', '.join('{}={}'.format(key, value) for key, value in limits)))
+    interval = get_raised_scrape_interval(
+        config, unitdata.kv().get(SCRAPE_TIMEOUT_KEY))
+    if interval is not None:
+        details.append('scrape interval raised to {}'.format(interval))
+    hookenv.status_set('active', ', '.join(['Ready'] + details))
+
+
+@when('snap.installed.bjornt-prometheus-node-exporter')
+@when_not('nodeexporter.invalid-config')
+def store_fastpath_state():
+    '''Let update-status skip the full run until something changes.
+
+    The fingerprint is stored when the hook has completed, so that it
+    reflects what all the handlers did.
+    '''
+    hookenv.atexit(write_fastpath_state)
 
 
 @when('prometheus-client.available')
 def prometheus_client(prometheus):
-    prometheus.configure(port=9100)
+    '''Publish the exporter endpoint on the prometheus-client relations.
+
+    The handler runs on every hook, so the data is only written to
+    relations that haven't seen it yet. Otherwise each hook would
+    trigger relation-changed hooks on all the Prometheus units.
+    '''
+    publish_relation_data()
+
+
+def publish_relation_data():
+    '''Publish the data to the prometheus-client relations that need it.'''
+    kv = unitdata.kv()
+    published = kv.get(PUBLISHED_KEY, {})
+    relation_ids = hookenv.relation_ids('prometheus-client')
+    for relation_id in relation_ids:
+        data = get_relation_data(relation_id)
+        digest = get_digest(data)
+        if published.get(relation_id) != digest:
+            hookenv.relation_set(relation_id, data)
+            published[relation_id] = digest
+            log_unavailable_collectors(relation_id)
+    published = {
+        relation_id: digest for relation_id, digest in published.items()
+        if relation_id in relation_ids}
+    kv.set(PUBLISHED_KEY, published)
+    consumers = {
+        relation_id: consumer
+        for relation_id, consumer in kv.get(CONSUMERS_KEY, {}).items()
+        if relation_id in relation_ids}
+    kv.set(CONSUMERS_KEY, consumers)
+
+
+def log_unavailable_collectors(relation_id):
+    '''Warn about collectors the relation asks for that aren't enabled.'''
+    try:
+        unavailable = get_unavailable_collectors(
+            get_exporter_config(), relation_id)
+    except ValueError:
+        # configure_exporter() reports the invalid config.
+        return
+    if unavailable:
+        hookenv.log(
+            'Collectors requested for {} that aren\'t enabled: {}'.format(
+                relation_id, ', '.join(sorted(unavailable))),
+            level=hookenv.WARNING)
+
+
+def get_snap_resource():
+    '''Return the path of the attached snap resource, or None.
+
+    An empty file means that no snap is attached, since a resource
+    can't be removed once it has been attached.
+    '''
+    path = hookenv.resource_get(SNAP_NAME)
+    if not path or not os.path.getsize(path):
+        return None
+    return path
+
+
+def get_snap_cache_dir():
+    '''Return the directory snap resources are cached in.
+
+    It's in the unit's directory, next to the charm directory, so
+    that it isn't affected by charm upgrades.
+    '''
+    return os.path.join(
+        os.path.dirname(os.path.abspath(hookenv.charm_dir())),
+        SNAP_CACHE_DIRNAME)
+
+
+def update_snap_source(source):
+    '''Record where the snap is installed from.
+
+    @return: True if the source has changed, or the snap isn't
+        installed yet.
+    '''
+    kv = unitdata.kv()
+    installed = is_state('snap.installed.bjornt-prometheus-node-exporter')
+    if installed and kv.get(SNAP_SOURCE_KEY) == source:
+        return False
+    kv.set(SNAP_SOURCE_KEY, source)
+    return True
+
+
+def install_snap_from_store(channel):
+    '''Install the snap from the store, or switch it to the channel.'''
+    previous = unitdata.kv().get(SNAP_SOURCE_KEY)
+    if not update_snap_source('channel:' + channel):
+        return
+    if not is_state('snap.installed.bjornt-prometheus-node-exporter'):
+        command = ['snap', 'install', '--channel=' + channel, SNAP_NAME]
+    elif previous is None or previous.startswith('resource:'):
+        # A snap installed from a file can only be refreshed from the
+        # store with --amend. If another unit on the machine installed
+        # the snap, it may have been installed from a file.
+        command = [
+            'snap', 'refresh', '--amend', '--channel=' + channel, SNAP_NAME]
+    else:
+        command = ['snap', 'refresh', '--channel=' + channel, SNAP_NAME]
+    subprocess.check_call(command)
+    set_state('snap.installed.bjornt-prometheus-node-exporter')
 
-    principal_unit = get_principal_unit()
-    prometheus.set_remote(**{'principal-unit': principal_unit})
+
+def write_fastpath_state():
+    '''Store the fingerprint that the update-status hook checks.'''
+    config = hookenv.config()
+    fingerprint = fastpath.get_fingerprint(
+        dict(config), hookenv.relation_ids(fastpath.RELATION_NAME),
+        fastpath.get_snap_revision(), election.get_active_unit(),
+        fastpath.get_shared())
+    fastpath.write_state(
+        fingerprint, get_update_status_due(config),
+        path=os.path.join(hookenv.charm_dir(), fastpath.STATE_PATH))
+
+
+def get_update_status_due(config):
+    '''Return when update-status next has periodic work to do.
+
+    Until then, update-status only does a full run if the fingerprint
+    has changed. The scrape duration is sampled on the full runs.
+    '''
+    now = time.time()
+    due = now + fastpath.MAX_SKIP
+    health_state = unitdata.kv().get(HEALTH_KEY)
+    if health_state is not None:
+        due = min(
+            due, health_state['checked'] + health_state['interval'])
+    window = get_refresh_window(config)
+    if window is not None and is_state('nodeexporter.active'):
+        utcnow = datetime.datetime.utcnow()
+        slot_minutes = config['refresh_slot_minutes']
+        key = get_refresh_key()
+        slot = refresh.get_current_slot(utcnow, window, slot_minutes, key)
+        if (slot is not None and
+                unitdata.kv().get(REFRESH_SLOT_KEY) != slot.isoformat()):
+            # The slot is open, but the snap hasn't been refreshed in
+            # it yet, e.g. because another hook ran in the slot.
+            return now
+        slot = refresh.get_next_slot(utcnow, window, slot_minutes, key)
+        due = min(due, now + (slot - utcnow).total_seconds())
+    return due
+
+
+def get_relation_data(relation_id):
+    '''Return the data to publish on the given prometheus-client relation.
+
+    'port', 'metrics-path', 'params', 'scrape-interval' and
+    'scrape-timeout' describe the main exporter. 'endpoints' lists all
+    the exporter endpoints that should be scraped, including the one
+    for slow collectors, each with its suggested scrape interval.
+
+    'exporter-role' is 'passive' if another unit on the machine manages
+    the exporter, which is named by 'active-unit'. Passive units publish
+    the same endpoint, as the active unit configured it, with their own
+    'principal-unit'.
+    '''
+    exporter = get_exporter_state()
+    config = get_exporter_config(exporter)
+    private_address = hookenv.unit_get('private-address')
+    endpoints = get_endpoints(
+        config, relation_id, exporter['scrape-timeout'])
+    data = {
+        'hostname': private_address,
+        'private-address': private_address,
+        'port': str(get_scrape_port(config)),
+        'principal-unit': get_principal_unit(),
+        'collector-filters': json.dumps(
+            exporter['collector-filters'], sort_keys=True),
+        'metrics-path': '/metrics',
+        'params': json.dumps({}),
+        'endpoints': json.dumps(endpoints, sort_keys=True),
+    }
+    active_unit = unitdata.kv().get(ACTIVE_UNIT_KEY)
+    if active_unit is not None:
+        data['active-unit'] = active_unit
+        data['exporter-role'] = (
+            'active' if active_unit == hookenv.local_unit() else 'passive')
+    main_endpoint = endpoints[0] if endpoints else {}
+    if main_endpoint.get('port') == data['port']:
+        data['params'] = json.dumps(main_endpoint['params'], sort_keys=True)
+        data['scrape-interval'] = main_endpoint['scrape-interval']
+        if 'scrape-timeout' in main_endpoint:
+            data['scrape-timeout'] = main_endpoint['scrape-timeout']
+    return data
+
+
+def get_exporter_state():
+    '''Return a description of the exporter that is published.
+
+    The active unit describes it using its own config and state. Passive
+    units use the description the active unit shared, and fall back to
+    their own until it has shared one.
+
+    @return: A dict with the 'config' of the EXPORTER_OPTIONS, the
+        exporter's 'collector-filters', and the sampled 'scrape-timeout',
+        which is None if there isn't one.
+    '''
+    kv = unitdata.kv()
+    config = hookenv.config()
+    state = {
+        'config': {option: config.get(option) for option in EXPORTER_OPTIONS},
+        'collector-filters': kv.get(FILTERS_KEY, {}),
+        'scrape-timeout': kv.get(SCRAPE_TIMEOUT_KEY),
+    }
+    if kv.get(ACTIVE_UNIT_KEY) not in (None, hookenv.local_unit()):
+        state = election.get_shared_exporter() or state
+    return state
+
+
+def get_exporter_config(exporter=None):
+    '''Return the unit's config, with the published exporter options.'''
+    if exporter is None:
+        exporter = get_exporter_state()
+    return dict(hookenv.config(), **exporter['config'])
+
+
+def get_endpoints(config, relation_id, scrape_timeout=None):
+    '''Return the exporter endpoints the given relation should scrape.
+
+    Endpoints that wouldn't collect anything for the consumer, because
+    of its collector subset, are left out.
+
+    @param scrape_timeout: The sampled scrape timeout to suggest, in
+        seconds, if scrape_hints is set.
+    '''
+    try:
+        slow = get_collectors(config, 'slow_collectors')
+        intervals = get_scrape_intervals(config)
+        subset = get_consumer_subset(config, relation_id)
+    except ValueError:
+        # configure_exporter() reports the invalid config.
+        return []
+    endpoints = []
+    main_subset = None if subset is None else subset - slow
+    if main_subset is None or main_subset:
+        endpoint = {
+            'port': str(get_scrape_port(config)),
+            'metrics-path': '/metrics',
+            'params': get_collect_params(main_subset),
+            'scrape-interval': intervals['scrape_interval'],
+        }
+        if config.get('scrape_hints') and scrape_timeout is not None:
+            endpoint['scrape-interval'] = hints.get_interval(
+                intervals['scrape_interval'], scrape_timeout)
+            endpoint['scrape-timeout'] = '{}s'.format(scrape_timeout)
+        endpoints.append(endpoint)
+    slow_subset = slow if subset is None else subset & slow
+    if slow_subset:
+        endpoints.append({
+            'port': str(config.get('slow_exporter_port') or
+                        SLOW_EXPORTER_PORT),
+            'metrics-path': '/metrics',
+            'params': get_collect_params(
+                None if subset is None else slow_subset),
+            'scrape-interval': intervals['slow_scrape_interval'],
+        })
+    return endpoints
+
+
+def get_collect_params(collectors):
+    '''Return the scrape params collecting only the given collectors.'''
+    if collectors is None:
+        return {}
+    return {'collect[]': sorted(collectors)}
+
+
+def get_consumer_subset(config, relation_id):
+    '''Return the set of collectors the given relation should scrape.
+
+    If a subset of the collectors is configured for the related
+    application, or requested by it, only those are collected when it
+    scrapes. Configured subsets take precedence. Collectors that aren't
+    enabled are left out, since node_exporter rejects scrapes asking
+    for them. None is returned if all collectors should be scraped.
+
+    A ValueError is raised if the config isn't valid.
+    '''
+    collectors = get_requested_collectors(config, relation_id)
+    return (collectors & get_enabled_collectors(config)) or None
+
+
+def get_unavailable_collectors(config, relation_id):
+    '''Return the collectors the relation asks for that aren't enabled.
+
+    A ValueError is raised if the config isn't valid.
+    '''
+    return (
+        get_requested_collectors(config, relation_id) -
+        get_enabled_collectors(config))
+
+
+def get_requested_collectors(config, relation_id):
+    '''Return the configured or requested subset for the relation.
+
+    An empty set is returned if there isn't one.
+    '''
+    consumer = unitdata.kv().get(CONSUMERS_KEY, {}).get(relation_id, {})
+    collectors = get_consumer_collectors(config).get(
+        consumer.get('application'))
+    if collectors is None:
+        collectors = [
+            name for name in consumer.get('collectors', [])
+            if COLLECTOR_NAME_RE.match(name)]
+    return set(collectors)
+
+
+def get_enabled_collectors(config):
+    '''Return the collectors that one of the exporters runs.
+
+    A ValueError is raised if the config isn't valid.
+    '''
+    enabled = (
+        DEFAULT_COLLECTORS | get_collectors(config, 'enable_collectors') |
+        get_collectors(config, 'slow_collectors'))
+    return enabled - get_collectors(config, 'disable_collectors')
+
+
+def get_scrape_intervals(config):
+    '''Return the suggested scrape intervals.
+
+    A ValueError is raised if the config isn't valid.
+    '''
+    intervals = {}
+    for option, default in SCRAPE_INTERVALS.items():
+        interval = config.get(option) or default
+        if not SCRAPE_INTERVAL_RE.match(interval):
+            raise ValueError('Invalid {}: {}'.format(option, interval))
+        intervals[option] = interval
+    return intervals
+
+
+def get_raised_scrape_interval(config, scrape_timeout):
+    '''Return the raised scrape interval that is suggested, or None.
+
+    Prometheus doesn't accept timeouts that are longer than the
+    interval, so if scrape_hints is set, and the sampled timeout is
+    longer than scrape_interval, the interval is raised to match.
+
+    A ValueError is raised if the config isn't valid.
+
+    @param scrape_timeout: The sampled scrape timeout, in seconds.
+    '''
+    if not config.get('scrape_hints') or scrape_timeout is None:
+        return None
+    interval = get_scrape_intervals(config)['scrape_interval']
+    raised = hints.get_interval(interval, scrape_timeout)
+    return None if raised == interval else raised
+
+
+def get_refresh_window(config):
+    '''Return the snap refresh window, or None if there isn't one.
+
+    A ValueError is raised if the config isn't valid.
+    '''
+    window = config.get('refresh_window')
+    if not window:
+        return None
+    refresh.parse_window(window)
+    if config.get('refresh_slot_minutes', 0) < 1:
+        raise ValueError('refresh_slot_minutes has to be positive')
+    return window
+
+
+def get_refresh_key():
+    '''Return the key that the unit's refresh slot is based on.
+
+    The principal unit is used if it's known, so that the slot doesn't
+    change if the subordinate is redeployed.
+    '''
+    return get_principal_unit() or hookenv.local_unit()
+
+
+def get_consumer_collectors(config):
+    '''Return the configured collector subsets, keyed by application.
+
+    A ValueError is raised if the config isn't valid.
+    '''
+    try:
+        subsets = yaml.safe_load(config.get('consumer_collectors') or '')
+    except yaml.YAMLError as error:
+        raise ValueError('Invalid consumer_collectors: {}'.format(error))
+    if not subsets:
+        return {}
+    if not isinstance(subsets, dict):
+        raise ValueError('consumer_collectors has to be a mapping')
+    consumer_collectors = {}
+    for application, collectors in subsets.items():
+        if isinstance(collectors, str):
+            collectors = collectors.split()
+        if not isinstance(collectors, list):
+            raise ValueError(
+                'Invalid collectors for {} in consumer_collectors'.format(
+                    application))
+        invalid = [
+            name for name in collectors
+            if not COLLECTOR_NAME_RE.match(str(name))]
+        if invalid:
+            raise ValueError(
+                'Invalid collector names in consumer_collectors: {}'.format(
+                    ', '.join(sorted(map(str, invalid)))))
+        consumer_collectors[str(application)] = collectors
+    return consumer_collectors
+
+
+def get_slow_exporter_command(config):
+    '''Return the command running the exporter for slow collectors.
+
+    None is returned if there are no slow collectors. A ValueError is
+    raised if the config isn't valid.
+    '''
+    slow = get_collectors(config, 'slow_collectors')
+    if not slow:
+        return None
+    disabled = get_collectors(config, 'disable_collectors')
+    if slow & disabled:
+        raise ValueError(
+            'Collectors both slow and disabled: {}'.format(
+                ', '.join(sorted(slow & disabled))))
+    port = config.get('slow_exporter_port') or SLOW_EXPORTER_PORT
+    if port in (EXPORTER_PORT, get_scrape_port(config)):
+        raise ValueError(
+            'slow_exporter_port has to differ from the other exporter ports')
+    command = [
+        EXPORTER_COMMAND, '--web.listen-address={}:{}'.format(
+            format_host(get_listen_address()), port),
+        '--collector.disable-defaults']
+    command.extend('--collector.{}'.format(name) for name in sorted(slow))
+    for flag, regex in sorted(get_collector_filters(config).items()):
+        command.append('--{}={}'.format(flag, regex))
+    if 'textfile' in slow:
+        command.append(
+            '--collector.textfile.directory={}'.format(textfile.TEXTFILE_DIR))
+    return command
+
+
+def get_resource_limits(config):
+    '''Return the systemd directives limiting the exporter's resources.
+
+    A ValueError is raised if the config isn't valid.
+
+    @return: A list of (key, value) tuples for the [Service] section.
+    '''
+    limits = []
+    cpu_quota = config.get('cpu_quota')
+    if cpu_quota:
+        if not CPU_QUOTA_RE.match(cpu_quota):
+            raise ValueError('Invalid cpu_quota: {}'.format(cpu_quota))
+        limits.append(('CPUQuota', cpu_quota))
+    memory_limit = config.get('memory_limit')
+    if memory_limit:
+        if not MEMORY_LIMIT_RE.match(memory_limit):
+            raise ValueError('Invalid memory_limit: {}'.format(memory_limit))
+        # MemoryMax isn't supported by the systemd in xenial.
+        limits.append(('MemoryLimit', memory_limit))
+    nice = config.get('nice') or 0
+    if not -20 <= nice <= 19:
+        raise ValueError('nice has to be between -20 and 19')
+    if nice:
+        limits.append(('Nice', nice))
+    io_class = config.get('io_scheduling_class')
+    if io_class:
+        if io_class not in IO_SCHEDULING_CLASSES:
+            raise ValueError(
+                'io_scheduling_class has to be one of: {}'.format(
+                    ', '.join(IO_SCHEDULING_CLASSES)))
+        limits.append(('IOSchedulingClass', io_class))
+        io_priority = config.get('io_scheduling_priority')
+        if io_class != 'idle' and io_priority is not None:
+            if not 0 <= io_priority <= 7:
+                raise ValueError(
+                    'io_scheduling_priority has to be between 0 and 7')
+            limits.append(('IOSchedulingPriority', io_priority))
+    gomaxprocs = config.get('gomaxprocs') or 0
+    if gomaxprocs < 0:
+        raise ValueError('gomaxprocs has to be positive')
+    if gomaxprocs:
+        limits.append(('Environment', 'GOMAXPROCS={}'.format(gomaxprocs)))
+    return limits
+
+
+def get_health_url(config):
+    '''Return the URL the exporter's health is probed with.
+
+    Only the time collector is requested if it's enabled. Otherwise the
+    landing page is requested, which at least shows that the exporter
+    is running.
+    '''
+    disabled = get_collectors(config, 'disable_collectors')
+    slow = get_collectors(config, 'slow_collectors')
+    if 'time' in disabled | slow:
+        return health.EXPORTER_URL + '/'
+    return health.EXPORTER_URL + health.PROBE_PATH
+
+
+def get_scrape_port(config):
+    '''Return the port Prometheus should scrape.'''
+    if (config.get('scrape_cache_ttl') or 0) > 0:
+        return config.get('scrape_cache_port') or cache.PORT
+    return EXPORTER_PORT
+
+
+def get_scrape_cache_command(config):
+    '''Return the command running the caching front-end.
+
+    None is returned if the front-end is disabled. A ValueError is
+    raised if the config isn't valid.
+    '''
+    ttl = config.get('scrape_cache_ttl') or 0
+    if ttl <= 0:
+        return None
+    port = config.get('scrape_cache_port') or cache.PORT
+    if port == EXPORTER_PORT:
+        raise ValueError(
+            'scrape_cache_port has to differ from the exporter port')
+    command = [
+        '/usr/bin/python3', get_module_path('cache'),
+        '--address', get_listen_address(),
+        '--port', str(port),
+        '--upstream', 'http://localhost:{}'.format(EXPORTER_PORT),
+        '--ttl', str(ttl)]
+    if config.get('scrape_cache_gzip'):
+        command.append('--gzip')
+    return command
+
+
+def get_push_command(config):
+    '''Return the command running the push agent.
+
+    None is returned if push_endpoint isn't set. A ValueError is raised
+    if the config isn't valid.
+    '''
+    endpoint = (config.get('push_endpoint') or '').strip()
+    if not endpoint:
+        return None
+    if not endpoint.startswith(('http://', 'https://')):
+        raise ValueError(
+            'push_endpoint has to be an http:// or https:// URL')
+    for name in ['push_interval', 'push_batch_size', 'push_spool_max_bytes']:
+        if (config.get(name) or 0) <= 0:
+            raise ValueError('{} has to be positive'.format(name))
+    instance = (
+        (config.get('push_instance') or '').strip() or
+        get_principal_unit() or socket.gethostname())
+    command = [
+        '/usr/bin/python3', get_module_path('push'),
+        '--endpoint', endpoint,
+        '--label', 'instance=' + instance,
+        '--upstream', 'main=http://localhost:{}/metrics'.format(
+            EXPORTER_PORT)]
+    if get_collectors(config, 'slow_collectors'):
+        command.extend([
+            '--upstream', 'slow=http://{}:{}/metrics'.format(
+                format_host(get_listen_address()),
+                config.get('slow_exporter_port') or SLOW_EXPORTER_PORT)])
+    command.extend([
+        '--interval', str(config['push_interval']),
+        '--batch-size', str(config['push_batch_size']),
+        '--spool-dir', PUSH_SPOOL_DIR,
+        '--max-spool-bytes', str(config['push_spool_max_bytes'])])
+    return command
+
+
+def get_listen_address():
+    '''Return the address the charm's exporter services listen on.
+
+    It's the address that is published on the prometheus-client
+    relations, so that the services aren't exposed on other networks.
+    '''
+    return hookenv.unit_get('private-address')
+
+
+def format_host(address):
+    '''Return the address formatted as the host part of a URL.'''
+    return '[{}]'.format(address) if ':' in address else address
+
+
+def get_module_path(name):
+    '''Return the path to a charms.layer.nodeexporter module.
+
+    Used for running the modules that only depend on the standard
+    library outside of the charm's virtualenv.
+    '''
+    return os.path.join(
+        hookenv.charm_dir(), 'lib', 'charms', 'layer', 'nodeexporter',
+        name + '.py')
+
+
+def get_exporter_args(config):
+    '''Return the command line arguments for the exporter.
+
+    A ValueError is raised if the config isn't valid.
+    '''
+    enabled = get_collectors(config, 'enable_collectors')
+    disabled = get_collectors(config, 'disable_collectors')
+    both = enabled & disabled
+    if both:
+        raise ValueError(
+            'Collectors both enabled and disabled: {}'.format(
+                ', '.join(sorted(both))))
+    # Slow collectors are run by a separate exporter.
+    slow = get_collectors(config, 'slow_collectors')
+    enabled -= slow
+    disabled |= slow
+    args = ['--collector.{}'.format(name) for name in sorted(enabled)]
+    args.extend('--no-collector.{}'.format(name) for name in sorted(disabled))
+    for flag, regex in sorted(get_collector_filters(config).items()):
+        args.append('--{}={}'.format(flag, regex))
+    if 'textfile' not in disabled:
+        args.append(
+            '--collector.textfile.directory={}'.format(textfile.TEXTFILE_DIR))
+    return args
+
+
+def check_exporter_support(config):
+    '''Check that the installed exporter supports the configured flags.
+
+    A ValueError is raised if it doesn't. The check is skipped if the
+    version of the exporter can't be determined.
+    '''
+    args = get_exporter_args(config)
+    if (args and os.path.isdir(fastpath.SNAP_CURRENT) and
+            not compat.has_configure_hook(fastpath.SNAP_CURRENT)):
+        raise ValueError(
+            'The installed {} snap doesn\'t take exporter arguments'.format(
+                SNAP_NAME))
+    version = get_exporter_version()
+    if version is None:
+        return
+    slow_command = get_slow_exporter_command(config) or []
+    compat.check_version(version, args + slow_command[1:])
+
+
+def get_exporter_version():
+    '''Return the version of the installed node_exporter, or None.
+
+    The version is cached for the installed snap revision, so that the
+    exporter is only run again when the snap changes.
+    '''
+    revision = fastpath.get_snap_revision()
+    kv = unitdata.kv()
+    cached = kv.get(EXPORTER_VERSION_KEY)
+    if (revision is not None and cached is not None and
+            cached['revision'] == revision):
+        return tuple(cached['version']) if cached['version'] else None
+    try:
+        # Older versions print the version to stderr.
+        process = subprocess.Popen(
+            [EXPORTER_COMMAND, '--version'], stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+    except OSError as error:
+        hookenv.log(
+            'Failed to get the exporter version: {}'.format(error),
+            level=hookenv.WARNING)
+        return None
+    version = compat.parse_version(
+        (stdout + stderr).decode('utf-8', 'replace'))
+    if version is None:
+        hookenv.log(
+            'Unknown exporter version, its flags aren\'t checked',
+            level=hookenv.WARNING)
+    if revision is not None:
+        kv.set(EXPORTER_VERSION_KEY, {
+            'revision': revision,
+            'version': list(version) if version else None})
+    return version
+
+
+def get_collector_filters(config):
+    '''Return the configured series filters, keyed by exporter flag.
+
+    A ValueError is raised if a filter isn't a regular expression that
+    node_exporter accepts, or if mutually exclusive filters are set.
+    '''
+    filters = {}
+    for group in COLLECTOR_FILTERS:
+        options = [option for option, _ in group if config.get(option)]
+        if len(options) > 1:
+            raise ValueError(
+                'Only one of {} can be set'.format(', '.join(options)))
+        for option, flag in group:
+            regex = config.get(option)
+            if not regex:
+                continue
+            try:
+                re2.check(regex)
+            except ValueError as error:
+                raise ValueError(
+                    'Invalid regular expression in {}: {}'.format(
+                        option, error))
+            filters[flag] = regex
+    return filters
+
+
+def get_collectors(config, option):
+    '''Return the set of collector names in the given config option.'''
+    collectors = set((config.get(option) or '').replace(',', ' ').split())
+    invalid = [
+        name for name in collectors if not COLLECTOR_NAME_RE.match(name)]
+    if invalid:
+        raise ValueError(
+            'Invalid collector names in {}: {}'.format(
+                option, ', '.join(sorted(invalid))))
+    return collectors
+
+
+def get_textfile_generators(config):
+    '''Return the configured textfile generators.
+
+    A ValueError is raised if the config isn't valid.
+
+    @return: A dict mapping the generator names to dicts with the
+        'command' to run and its 'inputs', as textfile.load_registry()
+        expects them.
+    '''
+    try:
+        generators = yaml.safe_load(config.get('textfile_generators') or '')
+    except yaml.YAMLError as error:
+        raise ValueError('Invalid textfile_generators: {}'.format(error))
+    if not generators:
+        return {}
+    if not isinstance(generators, dict):
+        raise ValueError('textfile_generators has to be a mapping')
+    result = {}
+    for name, options in sorted(generators.items()):
+        if not textfile.NAME_RE.match(str(name)):
+            raise ValueError(
+                'Invalid textfile generator name: {}'.format(name))
+        if not isinstance(options, dict) or not options.get('command'):
+            raise ValueError(
+                'Textfile generator {} needs a command'.format(name))
+        result[str(name)] = {
+            'command': options['command'],
+            'inputs': [str(path) for path in options.get('inputs') or []],
+        }
+    if (config.get('textfile_generators_interval') or 0) <= 0:
+        raise ValueError('textfile_generators_interval has to be positive')
+    return result
+
+
+def get_textfile_generators_command(config):
+    '''Return the command the timer runs the textfile generators with.'''
+    return [
+        '/usr/bin/python3', get_module_path('textfile'),
+        '--max-bytes', str(config.get('textfile_max_bytes') or
+                           textfile.MAX_BYTES),
+        '--max-series', str(config.get('textfile_max_series') or
+                            textfile.MAX_SERIES),
+        'run', '--state', TEXTFILE_STATE_PATH, TEXTFILE_GENERATORS_PATH,
+    ]
+
+
+def get_digest(data):
+    '''Return a digest of the given JSON-serializable data.'''
+    serialized = json.dumps(data, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(serialized).hexdigest()
 
 
 def get_principal_unit():
-    '''Return the principal unit for this subordinate.'''
+    '''Return the principal unit for this subordinate.
+
+    The principal unit is recorded when the container relation is
+    joined, so that hooks don't have to look it up using hook tools.
+    Units that were deployed before it was recorded look it up once.
+    '''
+    kv = unitdata.kv()
+    principal_unit = kv.get(PRINCIPAL_UNIT_KEY)
+    if principal_unit is None:
+        principal_unit = discover_principal_unit()
+        if principal_unit is not None:
+            kv.set(PRINCIPAL_UNIT_KEY, principal_unit)
+    return principal_unit
+
+
+def discover_principal_unit():
+    '''Look up the principal unit using the container relation.'''
     for relation_id in hookenv.relation_ids('container'):
         for relation_data in hookenv.relations_for_id(relation_id):
             return relation_data['__unit__']
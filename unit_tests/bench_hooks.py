@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+"""Benchmark how hook execution time grows with the model.
+
+The hooks are run in the same fake model as the unit tests, with many
+prometheus-client relations and many units per Prometheus application.
+Each run of charms.reactive.main() is timed, and the results are
+written as JSON, so that they can be compared between commits:
+
+    python3 unit_tests/bench_hooks.py run --output before.json
+    python3 unit_tests/bench_hooks.py run --output after.json
+    python3 unit_tests/bench_hooks.py compare before.json after.json
+
+It has to be run from the built charm directory, like the unit tests.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import unittest
+
+from test_nodeexporter import NodeExporterTest
+
+
+class HookBenchmark(NodeExporterTest):
+    """Time the hooks for a model of a given size.
+
+    @ivar relations: The number of Prometheus applications related to
+        the unit under test.
+    @ivar units: The number of units of each Prometheus application.
+    @ivar updates: How many times update-status and relation-changed
+        are run.
+    @ivar results: A list that the timings are appended to.
+    """
+
+    def __init__(self, relations, units, updates, results):
+        super().__init__("runTest")
+        self.relations = relations
+        self.units = units
+        self.updates = updates
+        self.results = results
+
+    def runTest(self):
+        model = self.fakes.juju.model
+        applications = [
+            "prometheus{}".format(index) for index in range(self.relations)]
+        model.deploy(["mysql"])
+        model.deploy(applications, units=self.units)
+        model.relate("container", "mysql")
+        for application in applications:
+            model.relate("prometheus-client", application)
+        model.start("mysql")
+        for application in applications:
+            model.start(application)
+        for _ in range(self.updates):
+            model.run_hook("update-status")
+        for update in range(self.updates):
+            for relation in model.relations["prometheus-client"]:
+                unit_name = sorted(relation["units"])[0]
+                model.change_remote_unit(
+                    relation, unit_name,
+                    {"collectors": "cpu" if update % 2 else "meminfo"})
+        for hook_name, timings in sorted(model.hook_timings.items()):
+            self.results.append({
+                "relations": self.relations,
+                "units": self.units,
+                "hook": hook_name,
+                "runs": len(timings),
+                "mean": statistics.mean(timings),
+                "median": statistics.median(timings),
+                "max": max(timings),
+            })
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+            universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    results = []
+    suite = unittest.TestSuite()
+    for relations in args.relations:
+        for units in args.units:
+            suite.addTest(
+                HookBenchmark(relations, units, args.updates, results))
+    outcome = unittest.TextTestRunner(stream=sys.stderr).run(suite)
+    if not outcome.wasSuccessful():
+        return 1
+    with open(args.output, "w") as output:
+        json.dump(
+            {"commit": get_commit(), "python": sys.version.split()[0],
+             "results": results},
+            output, indent=2, sort_keys=True)
+    return 0
+
+
+def compare(args):
+    with open(args.old) as old_file:
+        old = json.load(old_file)
+    with open(args.new) as new_file:
+        new = json.load(new_file)
+
+    def key(result):
+        return result["relations"], result["units"], result["hook"]
+
+    old_results = {key(result): result for result in old["results"]}
+    failed = False
+    print("{:>9} {:>5}  {:<40} {:>10} {:>10} {:>6}".format(
+        "relations", "units", "hook", "old (ms)", "new (ms)", "ratio"))
+    for result in sorted(new["results"], key=key):
+        old_result = old_results.get(key(result))
+        if old_result is None:
+            continue
+        ratio = result["median"] / old_result["median"]
+        print("{:>9} {:>5}  {:<40} {:>10.1f} {:>10.1f} {:>6.2f}".format(
+            result["relations"], result["units"], result["hook"],
+            old_result["median"] * 1000, result["median"] * 1000, ratio))
+        if args.max_ratio is not None and ratio > args.max_ratio:
+            failed = True
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command")
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks.")
+    run_parser.add_argument(
+        "--relations", type=int, nargs="+", default=[1, 10, 50],
+        help="The numbers of prometheus-client relations to try.")
+    run_parser.add_argument(
+        "--units", type=int, nargs="+", default=[1, 3],
+        help="The numbers of units per Prometheus application to try.")
+    run_parser.add_argument(
+        "--updates", type=int, default=3,
+        help="How many times to run update-status and relation-changed.")
+    run_parser.add_argument("--output", default="bench.json")
+    compare_parser = subparsers.add_parser(
+        "compare", help="Compare the median hook times of two runs.")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument(
+        "--max-ratio", type=float,
+        help="Exit with an error if a hook got slower than this ratio.")
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        return run(args)
+    elif args.command == "compare":
+        return compare(args)
+    parser.error("a command is required")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
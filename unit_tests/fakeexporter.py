@@ -0,0 +1,82 @@
+import gzip
+import http.server
+import socketserver
+import threading
+
+
+METRICS = b"""\
+# HELP node_load1 1m load average.
+# TYPE node_load1 gauge
+node_load1 0.5
+# HELP node_scrape_collector_duration_seconds Collector duration.
+# TYPE node_scrape_collector_duration_seconds gauge
+node_scrape_collector_duration_seconds{collector="cpu"} 0.001
+node_scrape_collector_duration_seconds{collector="filesystem"} 0.02
+node_scrape_collector_success{collector="cpu"} 1
+node_scrape_collector_success{collector="filesystem"} 1
+"""
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+
+    daemon_threads = True
+
+
+class FakeExporter:
+    """A stand-in node_exporter serving canned metrics over HTTP.
+
+    @ivar body: The metrics that are served on /metrics.
+    @ivar requests: The paths of the requests that have been made.
+    @ivar delay: If set, an Event that requests wait for before they
+        are answered.
+    @ivar status: The HTTP status code of the responses.
+    @ivar truncate: If set, the number of bytes of the body that are
+        sent before the connection is closed, as if the exporter was
+        cut off mid-response.
+    """
+
+    def __init__(self, body=METRICS):
+        self.body = body
+        self.requests = []
+        self.delay = None
+        self.status = 200
+        self.truncate = None
+        exporter = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                exporter.requests.append(self.path)
+                if exporter.delay is not None:
+                    exporter.delay.wait(10)
+                body = exporter.body
+                self.send_response(exporter.status)
+                self.send_header("Content-Type", "text/plain")
+                if "gzip" in self.headers.get("Accept-Encoding", ""):
+                    body = gzip.compress(body)
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if exporter.truncate is not None:
+                    body = body[:exporter.truncate]
+                    self.close_connection = True
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(
+            ("127.0.0.1", 0), Handler)
+        self.port = self.server.server_address[1]
+        self.url = "http://127.0.0.1:{}/metrics".format(self.port)
+
+    def start(self):
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        if self.delay is not None:
+            self.delay.set()
+        self.server.shutdown()
+        self.server.server_close()
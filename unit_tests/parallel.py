@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+"""Run the unit tests spread across worker processes.
+
+Each worker is a separate Python process, so the tests in different
+workers can't affect each other through global state. The tests are
+dealt out to the workers one by one, since most of them are in a few
+large TestCase classes. Each worker still runs its tests in id order,
+so that consecutive tests of a class share per-process setup, like
+NodeExporterTest's pristine charm copy.
+
+It has to be run from the built charm directory:
+
+    python3 unit_tests/parallel.py --jobs 4
+"""
+import argparse
+import os
+import subprocess
+import sys
+import unittest
+
+
+def iter_test_ids(suite):
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            yield from iter_test_ids(test)
+        else:
+            yield test.id()
+
+
+def partition(test_ids, jobs):
+    """Split the tests into at most jobs groups of about the same size.
+
+    The tests are dealt out in turn, so that the tests of each class
+    are spread evenly across the groups, and each group keeps the order
+    of the given ids.
+    """
+    groups = [test_ids[start::jobs] for start in range(jobs)]
+    return [group for group in groups if group]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=os.cpu_count() or 1,
+        help="The number of worker processes.")
+    parser.add_argument(
+        "--start-directory", "-s", default="unit_tests",
+        help="The directory to discover tests in.")
+    args = parser.parse_args(argv)
+
+    suite = unittest.defaultTestLoader.discover(args.start_directory)
+    test_ids = sorted(iter_test_ids(suite))
+    groups = partition(test_ids, max(args.jobs, 1))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [os.path.abspath(args.start_directory),
+                      env.get("PYTHONPATH")]))
+    workers = [
+        subprocess.Popen(
+            [sys.executable, "-m", "unittest"] + group,
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True)
+        for group in groups]
+    failed = False
+    for worker in workers:
+        output, _ = worker.communicate()
+        sys.stdout.write(output)
+        if worker.returncode != 0:
+            failed = True
+    print("Ran {} tests in {} worker processes: {}".format(
+        len(test_ids), len(groups), "FAILED" if failed else "OK"))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+import gzip
+import threading
+import unittest
+import unittest.mock
+import urllib.error
+import urllib.request
+
+from charms.layer.nodeexporter import cache
+
+from fakeexporter import FakeExporter
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ScrapeCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.exporter = FakeExporter()
+        self.exporter.start()
+        self.addCleanup(self.exporter.stop)
+        self.upstream = "http://127.0.0.1:{}".format(self.exporter.port)
+        self.clock = FakeClock()
+
+    def test_get(self):
+        scrape_cache = cache.ScrapeCache(self.upstream, ttl=10)
+
+        entry = scrape_cache.get("/metrics")
+
+        self.assertEqual(self.exporter.body, entry.body)
+        self.assertIsNone(entry.gzipped)
+        self.assertEqual(["/metrics"], self.exporter.requests)
+
+    def test_get_cached(self):
+        scrape_cache = cache.ScrapeCache(
+            self.upstream, ttl=10, clock=self.clock)
+        scrape_cache.get("/metrics")
+
+        self.clock.now += 9
+        scrape_cache.get("/metrics")
+
+        self.assertEqual(["/metrics"], self.exporter.requests)
+
+    def test_get_expired(self):
+        scrape_cache = cache.ScrapeCache(
+            self.upstream, ttl=10, clock=self.clock)
+        scrape_cache.get("/metrics")
+
+        self.clock.now += 10
+        scrape_cache.get("/metrics")
+
+        self.assertEqual(["/metrics"] * 2, self.exporter.requests)
+
+    def test_get_by_path(self):
+        scrape_cache = cache.ScrapeCache(self.upstream, ttl=10)
+
+        scrape_cache.get("/metrics")
+        scrape_cache.get("/metrics?collect[]=cpu")
+
+        self.assertEqual(
+            ["/metrics", "/metrics?collect[]=cpu"], self.exporter.requests)
+
+    def test_get_coalesced(self):
+        self.exporter.delay = threading.Event()
+        scrape_cache = cache.ScrapeCache(self.upstream, ttl=10)
+        entries = []
+        threads = [
+            threading.Thread(
+                target=lambda: entries.append(scrape_cache.get("/metrics")))
+            for _ in range(3)]
+        for thread in threads:
+            thread.start()
+
+        self.exporter.delay.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(["/metrics"], self.exporter.requests)
+        self.assertEqual(3, len(entries))
+        self.assertEqual(1, len(set(id(entry) for entry in entries)))
+
+    def test_get_error(self):
+        self.exporter.status = 500
+        scrape_cache = cache.ScrapeCache(self.upstream, ttl=10)
+
+        with self.assertRaises(OSError):
+            scrape_cache.get("/metrics")
+        with self.assertRaises(OSError):
+            scrape_cache.get("/metrics")
+        self.assertEqual(["/metrics"] * 2, self.exporter.requests)
+
+    def test_get_truncated(self):
+        self.exporter.truncate = 10
+        scrape_cache = cache.ScrapeCache(self.upstream, ttl=10)
+
+        with self.assertRaises(OSError):
+            scrape_cache.get("/metrics")
+        self.exporter.truncate = None
+        entry = scrape_cache.get("/metrics")
+
+        self.assertEqual(self.exporter.body, entry.body)
+
+    def test_get_unexpected_error(self):
+        scrape_cache = cache.ScrapeCache(self.upstream, ttl=10)
+
+        with unittest.mock.patch.object(
+                cache, "Entry", side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                scrape_cache.get("/metrics")
+        entry = scrape_cache.get("/metrics")
+
+        # The failed flight was completed, rather than left for the
+        # next scrapes to wait for.
+        self.assertEqual(self.exporter.body, entry.body)
+        self.assertEqual(["/metrics"] * 2, self.exporter.requests)
+
+    def test_compress(self):
+        scrape_cache = cache.ScrapeCache(self.upstream, ttl=10, compress=True)
+
+        entry = scrape_cache.get("/metrics")
+
+        self.assertEqual(self.exporter.body, gzip.decompress(entry.gzipped))
+
+
+class ServerTest(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.exporter = FakeExporter()
+        self.exporter.start()
+        self.addCleanup(self.exporter.stop)
+        scrape_cache = cache.ScrapeCache(
+            "http://127.0.0.1:{}".format(self.exporter.port), ttl=10,
+            compress=True)
+        self.server = cache.make_server(
+            scrape_cache, port=0, address="127.0.0.1")
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = "http://127.0.0.1:{}/metrics".format(
+            self.server.server_address[1])
+
+    def test_serve(self):
+        with urllib.request.urlopen(self.url) as response:
+            self.assertEqual(self.exporter.body, response.read())
+        with urllib.request.urlopen(self.url) as response:
+            self.assertEqual(self.exporter.body, response.read())
+
+        self.assertEqual(["/metrics"], self.exporter.requests)
+
+    def test_serve_gzip(self):
+        request = urllib.request.Request(
+            self.url, headers={"Accept-Encoding": "gzip"})
+        with urllib.request.urlopen(request) as response:
+            self.assertEqual("gzip", response.headers["Content-Encoding"])
+            self.assertEqual(
+                self.exporter.body, gzip.decompress(response.read()))
+
+    def test_serve_upstream_error(self):
+        self.exporter.status = 500
+
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            urllib.request.urlopen(self.url)
+        self.assertEqual(502, context.exception.code)
@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+
+from charms.layer.nodeexporter import compat
+
+
+class ParseVersionTest(unittest.TestCase):
+
+    def test_version(self):
+        output = (
+            "node_exporter, version 1.3.1 (branch: HEAD, revision: a2321e7)\n"
+            "  build user:       root@243aafa5525c\n")
+        self.assertEqual((1, 3, 1), compat.parse_version(output))
+
+    def test_old_version(self):
+        self.assertEqual(
+            (0, 15, 2),
+            compat.parse_version("node_exporter, version v0.15.2 (branch: "))
+
+    def test_no_version(self):
+        self.assertIsNone(compat.parse_version("flag provided but not"))
+
+
+class CheckVersionTest(unittest.TestCase):
+
+    def test_supported(self):
+        compat.check_version(
+            (1, 4, 0),
+            ["--collector.disable-defaults", "--collector.cpu",
+             "--collector.diskstats.device-include=^sd"])
+
+    def test_collector_flags(self):
+        compat.check_version(
+            (0, 15, 0), ["--collector.systemd", "--no-collector.wifi"])
+
+    def test_too_old(self):
+        with self.assertRaises(ValueError) as context:
+            compat.check_version(
+                (1, 2, 2), ["--collector.netdev.device-exclude=^tap"])
+        self.assertEqual(
+            "node_exporter 1.2.2 doesn't support "
+            "--collector.netdev.device-exclude, which needs 1.3.0 or later",
+            str(context.exception))
+
+    def test_older_than_collector_flags(self):
+        with self.assertRaises(ValueError):
+            compat.check_version((0, 14, 0), ["--collector.systemd"])
+
+
+class ConfigureHookTest(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.snap_dir = temp_dir.name
+
+    def test_configure_hook(self):
+        os.makedirs(os.path.join(self.snap_dir, "meta", "hooks"))
+        with open(os.path.join(self.snap_dir, "meta", "hooks", "configure"),
+                  "w"):
+            pass
+        self.assertTrue(compat.has_configure_hook(self.snap_dir))
+
+    def test_no_configure_hook(self):
+        os.makedirs(os.path.join(self.snap_dir, "meta"))
+        self.assertFalse(compat.has_configure_hook(self.snap_dir))
@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from charms.layer.nodeexporter import election
+
+
+class ElectTest(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "common", "active-unit")
+        self.alive = set()
+
+    def elect(self, unit):
+        self.alive.add(unit)
+        return election.elect(
+            unit, path=self.path, is_alive=self.alive.__contains__)
+
+    def test_first(self):
+        self.assertEqual("app1/0", self.elect("app1/0"))
+        self.assertEqual("app1/0", election.get_active_unit(self.path))
+
+    def test_active(self):
+        self.elect("app1/0")
+
+        self.assertEqual("app1/0", self.elect("app1/0"))
+
+    def test_passive(self):
+        self.elect("app1/0")
+
+        self.assertEqual("app1/0", self.elect("app2/0"))
+        self.assertEqual("app1/0", election.get_active_unit(self.path))
+
+    def test_active_gone(self):
+        self.elect("app1/0")
+        self.alive.remove("app1/0")
+
+        self.assertEqual("app2/0", self.elect("app2/0"))
+
+    def test_release(self):
+        self.elect("app1/0")
+        election.release("app1/0", path=self.path)
+
+        self.assertEqual("app2/0", self.elect("app2/0"))
+
+    def test_release_passive(self):
+        self.elect("app1/0")
+        election.release("app2/0", path=self.path)
+
+        self.assertEqual("app1/0", election.get_active_unit(self.path))
+
+    def test_release_none(self):
+        election.release("app1/0", path=self.path)
+
+        self.assertIsNone(election.get_active_unit(self.path))
+
+    def test_share(self):
+        self.elect("app1/0")
+
+        self.assertTrue(
+            election.share_exporter("app1/0", {"a": 1}, path=self.path))
+        self.assertEqual({"a": 1}, election.get_shared_exporter(self.path))
+
+    def test_share_unchanged(self):
+        self.elect("app1/0")
+        election.share_exporter("app1/0", {"a": 1}, path=self.path)
+
+        self.assertFalse(
+            election.share_exporter("app1/0", {"a": 1}, path=self.path))
+
+    def test_share_passive(self):
+        self.elect("app1/0")
+        self.elect("app2/0")
+
+        self.assertFalse(
+            election.share_exporter("app2/0", {"a": 1}, path=self.path))
+        self.assertIsNone(election.get_shared_exporter(self.path))
+
+    def test_shared_by_previous_unit(self):
+        self.elect("app1/0")
+        election.share_exporter("app1/0", {"a": 1}, path=self.path)
+        self.alive.remove("app1/0")
+        self.elect("app2/0")
+
+        self.assertIsNone(election.get_shared_exporter(self.path))
+
+    def test_release_shared(self):
+        self.elect("app1/0")
+        election.share_exporter("app1/0", {"a": 1}, path=self.path)
+        election.release("app1/0", path=self.path)
+
+        self.assertFalse(
+            os.path.exists(election.get_shared_path(self.path)))
+
+    def test_is_alive(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        os.mkdir(os.path.join(directory, "unit-app1-0"))
+        self.addCleanup(setattr, election, "AGENTS_DIR", election.AGENTS_DIR)
+        election.AGENTS_DIR = directory
+
+        self.assertTrue(election.is_alive("app1/0"))
+        self.assertFalse(election.is_alive("app2/0"))
@@ -0,0 +1,116 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from charms.layer.nodeexporter import election, fastpath
+
+
+class FingerprintTest(unittest.TestCase):
+
+    def test_relation_order(self):
+        self.assertEqual(
+            fastpath.get_fingerprint({"a": 1}, ["r:1", "r:2"], "12", "a/0"),
+            fastpath.get_fingerprint({"a": 1}, ["r:2", "r:1"], "12", "a/0"))
+
+    def test_changes(self):
+        fingerprint = fastpath.get_fingerprint({"a": 1}, ["r:1"], "12", "a/0")
+
+        for changed in [
+                ({"a": 2}, ["r:1"], "12", "a/0"),
+                ({"a": 1}, [], "12", "a/0"),
+                ({"a": 1}, ["r:1"], "13", "a/0"),
+                ({"a": 1}, ["r:1"], "12", None),
+                ({"a": 1}, ["r:1"], "12", "a/0", "{}\n")]:
+            self.assertNotEqual(
+                fingerprint, fastpath.get_fingerprint(*changed))
+
+    def test_snap_revision(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        current = os.path.join(directory, "current")
+        os.symlink("12", current)
+
+        self.assertEqual("12", fastpath.get_snap_revision(current))
+
+    def test_snap_revision_not_installed(self):
+        self.assertIsNone(fastpath.get_snap_revision("/nonexistent"))
+
+    def test_active_unit(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "charm-active-unit")
+        with open(path, "w") as election_file:
+            election_file.write("mysql-exporter/0\n")
+
+        self.assertEqual("mysql-exporter/0", fastpath.get_active_unit(path))
+
+    def test_active_unit_released(self):
+        self.assertIsNone(fastpath.get_active_unit("/nonexistent"))
+
+    def test_election_path(self):
+        self.assertEqual(election.ELECTION_PATH, fastpath.ELECTION_PATH)
+        self.assertEqual(
+            election.get_shared_path(election.ELECTION_PATH),
+            fastpath.SHARED_PATH)
+
+    def test_shared_missing(self):
+        self.assertIsNone(fastpath.get_shared("/nonexistent"))
+
+
+class CanSkipTest(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "state.json")
+
+    def can_skip(self, now=100, fingerprint="abc"):
+        return fastpath.can_skip(
+            self.path, clock=lambda: now,
+            current_fingerprint=lambda: fingerprint)
+
+    def test_unchanged(self):
+        fastpath.write_state("abc", 200, path=self.path)
+
+        self.assertTrue(self.can_skip())
+
+    def test_changed(self):
+        fastpath.write_state("abc", 200, path=self.path)
+
+        self.assertFalse(self.can_skip(fingerprint="def"))
+
+    def test_due(self):
+        fastpath.write_state("abc", 200, path=self.path)
+
+        self.assertFalse(self.can_skip(now=200))
+
+    def test_no_state(self):
+        self.assertFalse(self.can_skip())
+
+    def test_invalid_state(self):
+        with open(self.path, "w") as state_file:
+            state_file.write("{")
+
+        self.assertFalse(self.can_skip())
+
+    def test_fingerprint_error(self):
+        fastpath.write_state("abc", 200, path=self.path)
+
+        def fail():
+            raise subprocess.CalledProcessError(1, "config-get")
+
+        self.assertFalse(fastpath.can_skip(
+            self.path, clock=lambda: 100, current_fingerprint=fail))
+
+    def test_write_state(self):
+        fastpath.write_state("abc", 200, path=self.path)
+
+        with open(self.path) as state_file:
+            self.assertEqual(
+                {"fingerprint": "abc", "due": 200}, json.load(state_file))
+        self.assertEqual(
+            ["state.json"], os.listdir(os.path.dirname(self.path)))
@@ -0,0 +1,127 @@
+import threading
+import unittest
+
+from charms.layer.nodeexporter import health
+
+from fakeexporter import FakeExporter
+
+
+class ProbeTest(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.exporter = FakeExporter()
+        self.exporter.start()
+        self.addCleanup(self.exporter.stop)
+
+    def test_healthy(self):
+        latency, error = health.probe(self.exporter.url)
+
+        self.assertIsNone(error)
+        self.assertGreater(latency, 0)
+        self.assertEqual(["/metrics"], self.exporter.requests)
+
+    def test_error_status(self):
+        self.exporter.status = 500
+
+        latency, error = health.probe(self.exporter.url)
+
+        self.assertIsNone(latency)
+        self.assertIn("500", error)
+
+    def test_timeout(self):
+        self.exporter.delay = threading.Event()
+
+        latency, error = health.probe(self.exporter.url, timeout=0.1)
+
+        self.assertIsNone(latency)
+        self.assertIn("timed out", error)
+
+    def test_truncated(self):
+        self.exporter.truncate = 10
+
+        latency, error = health.probe(self.exporter.url)
+
+        self.assertIsNone(latency)
+        self.assertIn("IncompleteRead", error)
+
+    def test_not_running(self):
+        self.exporter.stop()
+
+        latency, error = health.probe(self.exporter.url)
+
+        self.assertIsNone(latency)
+        self.assertIsNotNone(error)
+
+
+class StateTest(unittest.TestCase):
+
+    def test_due_first(self):
+        self.assertTrue(health.is_due(None, 100))
+
+    def test_backoff(self):
+        state = health.update(None, 0, 0.01, None)
+        intervals = [state["interval"]]
+        for _ in range(4):
+            state = health.update(state, 0, 0.01, None)
+            intervals.append(state["interval"])
+
+        self.assertEqual(
+            [health.MIN_INTERVAL, 2 * health.MIN_INTERVAL,
+             4 * health.MIN_INTERVAL, health.MAX_INTERVAL,
+             health.MAX_INTERVAL],
+            intervals)
+
+    def test_due(self):
+        state = health.update(None, 100, 0.01, None)
+
+        self.assertFalse(health.is_due(state, 100 + health.MIN_INTERVAL - 1))
+        self.assertTrue(health.is_due(state, 100 + health.MIN_INTERVAL))
+
+    def test_failure(self):
+        state = health.update(None, 0, 0.01, None)
+        state = health.update(state, 100, None, "timed out")
+
+        self.assertEqual(1, state["failures"])
+        self.assertEqual("timed out", state["error"])
+        self.assertEqual(0.01, state["latency"])
+        # Failing exporters are probed on every update-status.
+        self.assertTrue(health.is_due(state, 100))
+
+    def test_recovery(self):
+        state = health.update(None, 0, None, "timed out")
+        state = health.update(state, 100, 0.02, None)
+
+        self.assertEqual(0, state["failures"])
+        self.assertIsNone(state["error"])
+        self.assertEqual(health.MIN_INTERVAL, state["interval"])
+
+    def test_status_healthy(self):
+        self.assertIsNone(health.get_status(None))
+        self.assertIsNone(
+            health.get_status(health.update(None, 0, 0.01, None)))
+
+    def test_status_failing(self):
+        state = health.update(None, 0, None, "timed out")
+
+        self.assertEqual(
+            ("maintenance", "Exporter health check failed (1/2): timed out"),
+            health.get_status(state))
+
+    def test_status_second_failure(self):
+        # Only the first failure is treated as transient.
+        state = health.update(None, 0, None, "timed out")
+        state = health.update(state, 0, None, "connection refused")
+
+        self.assertEqual(
+            ("blocked", "Exporter is unhealthy: connection refused"),
+            health.get_status(state))
+
+    def test_status_unhealthy(self):
+        state = None
+        for _ in range(health.FAILURE_THRESHOLD):
+            state = health.update(state, 0, None, "timed out")
+
+        self.assertEqual(
+            ("blocked", "Exporter is unhealthy: timed out"),
+            health.get_status(state))
@@ -0,0 +1,59 @@
+import unittest
+
+from charms.layer.nodeexporter import hints
+
+
+class ParseDurationTest(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(0.5, hints.parse_duration("500ms"))
+        self.assertEqual(15, hints.parse_duration("15s"))
+        self.assertEqual(300, hints.parse_duration("5m"))
+        self.assertEqual(3600, hints.parse_duration("1h"))
+
+    def test_parse_invalid(self):
+        with self.assertRaises(ValueError):
+            hints.parse_duration("5 minutes")
+
+
+class RecommendTest(unittest.TestCase):
+
+    def test_add_sample(self):
+        samples = []
+        for duration in range(hints.MAX_SAMPLES + 2):
+            samples = hints.add_sample(samples, duration)
+
+        self.assertEqual(
+            list(range(2, hints.MAX_SAMPLES + 2)), samples)
+
+    def test_recommend_timeout(self):
+        self.assertEqual(6, hints.recommend_timeout([0.1, 1.9, 0.5]))
+
+    def test_recommend_timeout_minimum(self):
+        self.assertEqual(1, hints.recommend_timeout([0.01]))
+
+    def test_recommend_timeout_no_samples(self):
+        self.assertIsNone(hints.recommend_timeout([]))
+
+    def test_get_interval(self):
+        self.assertEqual("15s", hints.get_interval("15s", 10))
+        self.assertEqual("15s", hints.get_interval("15s", None))
+        self.assertEqual("20s", hints.get_interval("15s", 20))
+
+
+class ShouldPublishTest(unittest.TestCase):
+
+    def test_unpublished(self):
+        self.assertTrue(hints.should_publish(None, 1))
+
+    def test_no_recommendation(self):
+        self.assertFalse(hints.should_publish(4, None))
+
+    def test_small_change(self):
+        self.assertFalse(hints.should_publish(10, 12))
+        self.assertFalse(hints.should_publish(1, 1))
+
+    def test_large_change(self):
+        self.assertTrue(hints.should_publish(10, 13))
+        self.assertTrue(hints.should_publish(10, 7))
+        self.assertTrue(hints.should_publish(1, 2))
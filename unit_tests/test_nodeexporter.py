@@ -1,22 +1,45 @@
 import argparse
+import atexit
+import hashlib
 import io
 import itertools
 import json
 import os
 import shutil
+import subprocess
 import sys
+import tempfile
+import time
 
 import yaml
 
 from charms.layer import basic
+from charms.layer.nodeexporter import election, fastpath, health
 import charms.reactive
 from charms.reactive.helpers import data_changed
 
 from charmhelpers.core import hookenv, unitdata
 from charmtest import CharmTest
 
+from fixtures import EnvironmentVariable, MonkeyPatch, TempDir
 from systemfixtures.filesystem import Overlay
 
+from fakeexporter import FakeExporter
+
+
+TEXTFILE_ARG = (
+    "--collector.textfile.directory="
+    "/var/snap/bjornt-prometheus-node-exporter/common/textfile_collector")
+
+LIMITS_DROP_IN = (
+    "/etc/systemd/system/snap.bjornt-prometheus-node-exporter."
+    "bjornt-prometheus-node-exporter.service.d/nodeexporter-limits.conf")
+
+
+# Environment variables that are set while running hooks.
+HOOK_ENVIRONMENT = [
+    "JUJU_HOOK_NAME", "JUJU_RELATION", "JUJU_RELATION_ID", "JUJU_REMOTE_UNIT"]
+
 
 class Apt:
 
@@ -24,14 +47,14 @@ class Apt:
 
     def __init__(self):
         self.installs = []
+        self.parser = argparse.ArgumentParser()
+        self.parser.add_argument("command")
+        self.parser.add_argument("package_name")
 
     def __call__(self, proc_args):
-        parser = argparse.ArgumentParser()
-        parser.add_argument("command")
-        parser.add_argument("package_name")
         non_flag_args = [
             arg for arg in proc_args["args"][1:] if not arg.startswith("-")]
-        args = parser.parse_args(non_flag_args)
+        args = self.parser.parse_args(non_flag_args)
         if args.command == "install":
             self.installs.append(args.package_name)
         else:
@@ -45,39 +68,143 @@ class Snap:
 
     def __init__(self):
         self.snaps = {}
+        self.installs = []
+        self.held = set()
+        self.restarts = []
+        self.parser = argparse.ArgumentParser()
+        self.parser.add_argument("command")
+        self.parser.add_argument("snap_name")
+        self.parser.add_argument("settings", nargs="*")
+        self.parser.add_argument("--channel")
+        self.parser.add_argument("--dangerous", action="store_true")
+        self.parser.add_argument("--amend", action="store_true")
+        self.parser.add_argument("--hold", nargs="?", const="forever")
+        self.parser.add_argument("--unhold", action="store_true")
 
     def __call__(self, proc_args):
-        parser = argparse.ArgumentParser()
-        parser.add_argument("command")
-        parser.add_argument("snap_name")
-        args = parser.parse_args(proc_args["args"][1:])
+        args = self.parser.parse_args(proc_args["args"][1:])
         if args.command == "install":
-            self.snaps[args.snap_name] = {}
+            if args.dangerous:
+                # Snap files are named <name>_<revision>.snap.
+                snap_name = os.path.basename(args.snap_name).split("_")[0]
+                source = args.snap_name
+            else:
+                snap_name = args.snap_name
+                source = args.channel
+            self.snaps.setdefault(snap_name, {})
+            self.installs.append((args.command, snap_name, source))
+        elif args.command == "refresh" and args.hold:
+            self.held.add(args.snap_name)
+        elif args.command == "refresh" and args.unhold:
+            self.held.discard(args.snap_name)
+        elif args.command == "refresh":
+            self.installs.append(
+                (args.command, args.snap_name, args.channel))
+        elif args.command == "set":
+            for setting in args.settings:
+                key, value = setting.split("=", 1)
+                self.snaps[args.snap_name][key] = value
+        elif args.command == "restart":
+            self.restarts.append(args.snap_name)
         else:
             raise AssertionError("Command not implemented: " + args.command)
         return {}
 
 
-class ResourceGet:
+class Exporter:
+    """Fake node_exporter, only answering --version."""
 
-    name = "resource-get"
+    name = "bjornt-prometheus-node-exporter"
+
+    def __init__(self):
+        self.version = "1.5.0"
+
+    def __call__(self, proc_args):
+        if proc_args["args"][1:] != ["--version"]:
+            raise AssertionError(
+                "Arguments not implemented: {}".format(proc_args["args"]))
+        output = "node_exporter, version {} (branch: HEAD)\n".format(
+            self.version)
+        return {"stderr": io.BytesIO(output.encode("utf-8"))}
+
+
+class Systemctl:
+
+    name = "systemctl"
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, proc_args):
+        self.calls.append(proc_args["args"][1:])
+        return {}
+
+
+class HookTool:
+    """Base class for fake hook tools.
+
+    Each call is recorded, together with the hook it was made in, so
+    that tests can check how many hook tools a hook runs.
+
+    The argument parser is only built once per tool, since building it
+    costs more than parsing the arguments.
+
+    @ivar calls: A list of (hook name, arguments) tuples.
+    @ivar parser: The argument parser, or None if the tool doesn't
+        take any arguments.
+    """
+
+    name = None
+
+    def __init__(self):
+        self.calls = []
+        self.parser = self.make_parser()
 
     def __call__(self, proc_args):
-        return {"stdout": io.BytesIO(b"")}
+        self.calls.append(
+            (os.environ.get("JUJU_HOOK_NAME"), proc_args["args"][1:]))
+        return self.run(proc_args)
+
+    def make_parser(self):
+        return None
 
+    def run(self, proc_args):
+        raise NotImplementedError()
 
-class UnitGet:
+
+class ResourceGet(HookTool):
+    """Fake resource-get, returning the paths of attached resources.
+
+    @ivar resources: A dict mapping resource names to file paths.
+    """
+
+    name = "resource-get"
+
+    def __init__(self):
+        super().__init__()
+        self.resources = {}
+
+    def run(self, proc_args):
+        path = self.resources.get(proc_args["args"][1], "")
+        return {"stdout": io.BytesIO(path.encode("utf-8"))}
+
+
+class UnitGet(HookTool):
 
     name = "unit-get"
 
     def __init__(self, unit_data):
+        super().__init__()
         self.unit_data = unit_data
 
-    def __call__(self, proc_args):
+    def make_parser(self):
         parser = argparse.ArgumentParser()
         parser.add_argument("setting")
         parser.add_argument("--format", nargs="?", default="yaml")
-        args = parser.parse_args(proc_args["args"][1:])
+        return parser
+
+    def run(self, proc_args):
+        args = self.parser.parse_args(proc_args["args"][1:])
         if args.setting not in self.unit_data:
             error = 'error: unknown setting "{}"'.format(args.setting)
             return {"error": io.BytesIO(error.encode("utf-8"))}
@@ -86,18 +213,22 @@ class UnitGet:
         return {"stdout": io.BytesIO(value.encode("utf-8"))}
 
 
-class RelationIds:
+class RelationIds(HookTool):
 
     name = "relation-ids"
 
     def __init__(self, relations):
+        super().__init__()
         self.relations = relations
 
-    def __call__(self, proc_args):
+    def make_parser(self):
         parser = argparse.ArgumentParser()
         parser.add_argument("name")
         parser.add_argument("--format", nargs="?", default="yaml")
-        args = parser.parse_args(proc_args["args"][1:])
+        return parser
+
+    def run(self, proc_args):
+        args = self.parser.parse_args(proc_args["args"][1:])
         relation_ids = []
         if args.name in self.relations:
             for relation in self.relations[args.name]:
@@ -107,18 +238,22 @@ class RelationIds:
         return {"stdout": io.BytesIO(value.encode("utf-8"))}
 
 
-class RelationList:
+class RelationList(HookTool):
 
     name = "relation-list"
 
     def __init__(self, relations):
+        super().__init__()
         self.relations = relations
 
-    def __call__(self, proc_args):
+    def make_parser(self):
         parser = argparse.ArgumentParser()
         parser.add_argument("-r", "--relation")
         parser.add_argument("--format", nargs="?", default="yaml")
-        args = parser.parse_args(proc_args["args"][1:])
+        return parser
+
+    def run(self, proc_args):
+        args = self.parser.parse_args(proc_args["args"][1:])
         relation_name = args.relation.rsplit(":", 1)[0]
         relations = self.relations[relation_name]
         for relation in relations:
@@ -131,21 +266,25 @@ class RelationList:
         return {"stdout": io.BytesIO(value.encode("utf-8"))}
 
 
-class RelationSet:
+class RelationSet(HookTool):
 
     name = "relation-set"
 
     def __init__(self, relations):
+        super().__init__()
         self.relations = relations
 
-    def __call__(self, proc_args):
+    def make_parser(self):
         # Don't add help, since it prints to stdout and raises
         # SystemExit.
         parser = argparse.ArgumentParser(add_help=False)
         parser.add_argument("-r", "--relation")
         parser.add_argument("--file")
         parser.add_argument("--help", action="store_true")
-        args = parser.parse_args(proc_args["args"][1:])
+        return parser
+
+    def run(self, proc_args):
+        args = self.parser.parse_args(proc_args["args"][1:])
         if args.help:
             # We should return BytesIO here, but since fixture's
             # FakeProcess doesn't respect universal_newlines, we have to
@@ -165,20 +304,24 @@ class RelationSet:
         return {}
 
 
-class RelationGet:
+class RelationGet(HookTool):
 
     name = "relation-get"
 
     def __init__(self, relations):
+        super().__init__()
         self.relations = relations
 
-    def __call__(self, proc_args):
+    def make_parser(self):
         parser = argparse.ArgumentParser()
         parser.add_argument("key")
         parser.add_argument("unit")
         parser.add_argument("-r", "--relation")
         parser.add_argument("--format", nargs="?", default="yaml")
-        args = parser.parse_args(proc_args["args"][1:])
+        return parser
+
+    def run(self, proc_args):
+        args = self.parser.parse_args(proc_args["args"][1:])
         relation_name = args.relation.rsplit(":", 1)[0]
         relations = self.relations[relation_name]
         for relation in relations:
@@ -187,12 +330,58 @@ class RelationGet:
         else:
             raise AssertionError("invalid relation id")
         data = relation["units"][args.unit]
-        value = data if args.key == "-" else data[args.key]
+        value = data if args.key == "-" else data.get(args.key)
         converter = json.dumps if args.format == "json" else yaml.dump
         value = converter(value)
         return {"stdout": io.BytesIO(value.encode("utf-8"))}
 
 
+class InProcessSubprocess:
+    """Stand-in for the subprocess module used by charmhelpers' hookenv.
+
+    Hook tools are served by calling the fake hook tools directly,
+    without going through the fake subprocess layer. Other commands are
+    passed on to the real (or faked) subprocess module.
+    """
+
+    def __init__(self, hook_tools):
+        self.hook_tools = {
+            hook_tool.name: hook_tool for hook_tool in hook_tools}
+
+    def __getattr__(self, name):
+        return getattr(subprocess, name)
+
+    def check_output(self, args, **kwargs):
+        hook_tool = self.hook_tools.get(os.path.basename(args[0]))
+        if hook_tool is None:
+            return subprocess.check_output(args, **kwargs)
+        result = hook_tool({"args": list(args)})
+        if result.get("returncode", 0) != 0:
+            raise subprocess.CalledProcessError(result["returncode"], args)
+        output = result["stdout"].getvalue() if "stdout" in result else b""
+        text = kwargs.get("universal_newlines")
+        if text and isinstance(output, bytes):
+            output = output.decode("utf-8")
+        elif not text and isinstance(output, str):
+            output = output.encode("utf-8")
+        return output
+
+    def check_call(self, args, **kwargs):
+        if os.path.basename(args[0]) not in self.hook_tools:
+            return subprocess.check_call(args, **kwargs)
+        self.check_output(args)
+        return 0
+
+    def call(self, args, **kwargs):
+        if os.path.basename(args[0]) not in self.hook_tools:
+            return subprocess.call(args, **kwargs)
+        try:
+            self.check_output(args)
+        except subprocess.CalledProcessError as error:
+            return error.returncode
+        return 0
+
+
 class JujuReactiveModel:
     """Simulate a Juju model for a reactive charm.
 
@@ -240,13 +429,17 @@ class JujuReactiveModel:
     When mysql is started, the nrpe install hook will fire, as well as
     the general-info-relation-{joined,changed} hooks.
 
-    Only one unit per application is supported.
+    Other applications can have multiple units. Each of them joins the
+    relations separately when it's started. For container relations,
+    only the first unit is related to the unit under test.
 
     @ivar unit_name: The name of the Juju unit under test.
     @ivar application: The name of the Juju application the unit under
         test is part of.
     @ivar local_unit: The state of the unit under test.
     @ivar relations: The state of the relations for the unit under test.
+    @ivar hook_timings: A dict mapping hook names to a list of how long,
+        in seconds, each run of charms.reactive.main() took.
     """
 
     def __init__(self, unit_name):
@@ -262,21 +455,27 @@ class JujuReactiveModel:
         self.local_unit = self.applications[self.application][0]
         self.local_unit["data"] = {"private-address": "10.1.2.3"}
         self.relations = {}
+        self.hook_timings = {}
 
-    def deploy(self, applications, subordinate=False):
-        """Deploy one unit each of the given applications.
+    def deploy(self, applications, subordinate=False, units=1):
+        """Deploy units of the given applications.
 
-        The unit won't be started. They have to be started explicitly
+        The units won't be started. They have to be started explicitly
         using start().
 
         @param applications: List of application names that should be deployed.
         @param subordinate: Whether the application is a subordinate.
+        @param units: The number of units to deploy of each application.
         """
         for application in applications:
-            unit_info = {
-                "state": "deployed", "subordinate": subordinate,
-                "application": application, "name": application + "/0"}
-            self.applications.setdefault(application, []).append(unit_info)
+            application_units = self.applications.setdefault(application, [])
+            for _ in range(units):
+                unit_info = {
+                    "state": "deployed", "subordinate": subordinate,
+                    "application": application,
+                    "name": "{}/{}".format(
+                        application, len(application_units))}
+                application_units.append(unit_info)
 
     def start(self, application):
         """Start the application.
@@ -292,10 +491,10 @@ class JujuReactiveModel:
         @param application: The name of the application that should be
             started.
         """
-        unit = self.applications[application][0]
-        assert not unit["subordinate"], (
-            "Can't manually start subordinate units.")
-        self._transition_unit(unit, "started")
+        for unit in self.applications[application]:
+            assert not unit["subordinate"], (
+                "Can't manually start subordinate units.")
+            self._transition_unit(unit, "started")
 
     def relate(self, relation_name, application):
         """Relate the application under test to another application.
@@ -321,25 +520,56 @@ class JujuReactiveModel:
         self.relations.setdefault(relation_name, []).append(relation)
         self._check_relations()
 
-    def run_hook(self, name):
+    def run_hook(self, name, remote_unit=None, relation_id=None):
         """Run the given hook for the unit under test.
 
         The reactive framework will be used to execute the hook.
 
         The JUJU_HOOK_NAME and JUJU_RELATION environment variables will
-        be set during the hook executing.
+        be set during the hook executing. For relation hooks,
+        JUJU_REMOTE_UNIT and JUJU_RELATION_ID are set as well, if a
+        remote unit and relation id are given.
 
         @param name: The name of the hook to execute.
+        @param remote_unit: The name of the remote unit, for relation
+            hooks.
+        @param relation_id: The id of the relation, for relation hooks.
         """
-        os.environ["JUJU_HOOK_NAME"] = name
-        if self._is_relation_hook(name):
-            os.environ["JUJU_RELATION"] = name.rsplit("-", 2)[0]
-        charms.reactive.main()
-        # XXX: Instead of deleting the environment variables, we should
-        #      reset them to their original values.
+        hook_environ = {"JUJU_HOOK_NAME": name}
         if self._is_relation_hook(name):
-            del os.environ["JUJU_RELATION"]
-        del os.environ["JUJU_HOOK_NAME"]
+            hook_environ["JUJU_RELATION"] = name.rsplit("-", 2)[0]
+            if remote_unit is not None:
+                hook_environ["JUJU_REMOTE_UNIT"] = remote_unit
+            if relation_id is not None:
+                hook_environ["JUJU_RELATION_ID"] = relation_id
+        original_environ = {
+            key: os.environ.get(key) for key in hook_environ}
+        os.environ.update(hook_environ)
+        try:
+            start = time.monotonic()
+            charms.reactive.main()
+            self.hook_timings.setdefault(name, []).append(
+                time.monotonic() - start)
+        finally:
+            for key, value in original_environ.items():
+                if value is None:
+                    del os.environ[key]
+                else:
+                    os.environ[key] = value
+
+    def change_remote_unit(self, relation, unit_name, data):
+        """Change the relation data of a remote unit.
+
+        The relation-changed hook is fired for the unit under test.
+
+        @param relation: The relation, as stored in self.relations.
+        @param unit_name: The name of the remote unit.
+        @param data: A dict with the data to update.
+        """
+        relation["units"][unit_name].update(data)
+        self.run_hook(
+            relation["name"] + "-relation-changed", unit_name,
+            relation["id"])
 
     def _is_relation_hook(self, hook_name):
         """Return whether the hook is a relation hook.
@@ -369,22 +599,26 @@ class JujuReactiveModel:
         relations = itertools.chain(*self.relations.values())
         for relation_name, relations in self.relations.items():
             for relation in relations:
-                if relation["state"] != "waiting":
-                    continue
                 if relation["application"] not in self.applications:
                     continue
-                remote_unit = self.applications[relation["application"]][0]
+                remote_units = self.applications[relation["application"]]
                 if relation.get("scope") == "container":
+                    if relation["state"] != "waiting":
+                        continue
+                    remote_unit = remote_units[0]
                     if (self.local_unit["state"] == "deployed" and
                             remote_unit["state"] == "started"):
                         self._transition_unit(self.local_unit, "started")
                         self._transition_relation(
                             relation, "joined", remote_unit)
                 else:
-                    if (self.local_unit["state"] == "started" and
-                            remote_unit["state"] == "started"):
-                        self._transition_relation(
-                            relation, "joined", remote_unit)
+                    if self.local_unit["state"] != "started":
+                        continue
+                    for remote_unit in remote_units:
+                        if (remote_unit["state"] == "started" and
+                                remote_unit["name"] not in relation["units"]):
+                            self._transition_relation(
+                                relation, "joined", remote_unit)
 
     def _transition_unit(self, unit, state):
         """Transition a unit to the given state.
@@ -405,25 +639,68 @@ class JujuReactiveModel:
         Any relation hooks that need to be fired as a consequence of the
         state transition will be fired.
         """
-        if state == "joined" and relation["state"] == "waiting":
-            self.run_hook(relation["name"] + "-relation-joined")
-            self.run_hook(relation["name"] + "-relation-changed")
-            relation["state"] = "joined"
+        if (state == "joined" and
+                remote_unit["name"] not in relation["units"]):
+            # Like in Juju, the remote unit is part of the relation
+            # already when the joined hook fires.
             relation["units"][remote_unit["name"]] = {}
+            self.run_hook(
+                relation["name"] + "-relation-joined", remote_unit["name"],
+                relation["id"])
+            self.run_hook(
+                relation["name"] + "-relation-changed", remote_unit["name"],
+                relation["id"])
+            relation["state"] = "joined"
+
+
+class NodeExporterTest(CharmTest):
+    """Base class for tests running the charm's hooks in a fake model.
+
+    @cvar in_process_hook_tools: Whether the hook tools should be
+        called directly by charmhelpers, instead of through the fake
+        subprocess layer. It's faster, but doesn't exercise the command
+        line handling of charmhelpers as much.
+    """
 
+    in_process_hook_tools = False
 
-class FooTest(CharmTest):
+    # The reactive code and hooks are copied once per process, and
+    # linked into the charm directory of each test.
+    _pristine_dir = None
 
     def setUp(self):
         super().setUp()
+        self._isolate_global_state()
         self._init_reactive()
         self._init_snap_layer()
         self._init_fake_juju()
 
+    def _isolate_global_state(self):
+        """Make sure that state the hooks change doesn't leak between tests.
+
+        The hook environment, the cached hook tool results, the unitdata
+        kv store and the snap layer's registration are reset before the
+        test, and restored afterwards.
+        """
+        for name in HOOK_ENVIRONMENT:
+            self.useFixture(EnvironmentVariable(name))
+        hookenv.cache.clear()
+        self.addCleanup(hookenv.cache.clear)
+        self.addCleanup(
+            setattr, unitdata, "_KV", getattr(unitdata, "_KV", None))
+        unitdata._KV = None
+        if hasattr(charms.reactive, "_snap_registered"):
+            self.addCleanup(
+                setattr, charms.reactive, "_snap_registered",
+                charms.reactive._snap_registered)
+            delattr(charms.reactive, "_snap_registered")
+
     def _clean_up_unitdata(self):
-        unitdata.kv().close
+        if unitdata._KV is not None:
+            unitdata._KV.close()
         unitdata._KV = None
-        delattr(charms.reactive, "_snap_registered")
+        if hasattr(charms.reactive, "_snap_registered"):
+            delattr(charms.reactive, "_snap_registered")
         new_modules = set(sys.modules.keys()) - self.loaded_modules
         for module_name in new_modules:
             del sys.modules[module_name]
@@ -437,34 +714,87 @@ class FooTest(CharmTest):
         os.chmod(jujud_path, 0o755)
 
         self.resource_get = ResourceGet()
-        self.fakes.processes.add(self.resource_get)
 
         self.fakes.juju.model = JujuReactiveModel(os.environ["JUJU_UNIT_NAME"])
         self.addCleanup(self._clean_up_unitdata)
-        unit_get = UnitGet(self.fakes.juju.model.local_unit["data"])
-        self.fakes.processes.add(unit_get)
-        relation_ids = RelationIds(self.fakes.juju.model.relations)
-        self.fakes.processes.add(relation_ids)
-        relation_list = RelationList(self.fakes.juju.model.relations)
-        self.fakes.processes.add(relation_list)
-        relation_get = RelationGet(self.fakes.juju.model.relations)
-        self.fakes.processes.add(relation_get)
-        relation_set = RelationSet(self.fakes.juju.model.relations)
-        self.fakes.processes.add(relation_set)
+        relations = self.fakes.juju.model.relations
+        self.hook_tools = [
+            self.resource_get,
+            UnitGet(self.fakes.juju.model.local_unit["data"]),
+            RelationIds(relations),
+            RelationList(relations),
+            RelationGet(relations),
+            RelationSet(relations),
+        ]
+        if self.in_process_hook_tools:
+            self.useFixture(MonkeyPatch(
+                "charmhelpers.core.hookenv.subprocess",
+                InProcessSubprocess(self.hook_tools)))
+            self.fakes.processes.add(self.resource_get)
+        else:
+            for hook_tool in self.hook_tools:
+                self.fakes.processes.add(hook_tool)
+
+    def get_hook_tool_calls(self, hook_name):
+        """Return the hook tool calls made while running the given hook.
+
+        @return: A dict mapping hook tool names to a list of the
+            arguments of each call.
+        """
+        calls = {}
+        for hook_tool in self.hook_tools:
+            for call_hook_name, args in hook_tool.calls:
+                if call_hook_name == hook_name:
+                    calls.setdefault(hook_tool.name, []).append(args)
+        return calls
+
+    def assertHookToolBudget(self, hook_name, budget):
+        """Assert that a hook didn't call hook tools more than allowed.
+
+        @param hook_name: The name of the hook.
+        @param budget: A dict mapping hook tool names to the maximum
+            number of calls allowed.
+        """
+        calls = self.get_hook_tool_calls(hook_name)
+        over_budget = {
+            name: calls.get(name, [])
+            for name, maximum in budget.items()
+            if len(calls.get(name, [])) > maximum}
+        self.assertEqual(
+            {}, over_budget,
+            "{} called hook tools more than allowed".format(hook_name))
+
+    def reset_hook_tool_calls(self):
+        for hook_tool in self.hook_tools:
+            del hook_tool.calls[:]
+
+    @classmethod
+    def _get_pristine_dir(cls):
+        """Return a directory with a copy of the charm's code.
+
+        The copy is made the first time it's needed in the process.
+        """
+        if NodeExporterTest._pristine_dir is None:
+            code_dir = os.getcwd()
+            pristine_dir = tempfile.mkdtemp(prefix="charm-")
+            for sub_dir in ["reactive", "hooks"]:
+                shutil.copytree(
+                    os.path.join(code_dir, sub_dir),
+                    os.path.join(pristine_dir, sub_dir))
+            atexit.register(shutil.rmtree, pristine_dir, True)
+            NodeExporterTest._pristine_dir = pristine_dir
+        return NodeExporterTest._pristine_dir
 
     def _init_reactive(self):
         self.loaded_modules = set(sys.modules.keys())
         basic.init_config_states()
         code_dir = os.getcwd()
         charm_dir = hookenv.charm_dir()
-        shutil.copytree(
-            os.path.join(code_dir, "reactive"),
-            os.path.join(
-                self.fakes.fs.root.path, charm_dir.lstrip("/"), "reactive"))
-        shutil.copytree(
-            os.path.join(code_dir, "hooks"),
-            os.path.join(
-                self.fakes.fs.root.path, charm_dir.lstrip("/"), "hooks"))
+        pristine_dir = self._get_pristine_dir()
+        for sub_dir in ["reactive", "hooks"]:
+            os.symlink(
+                os.path.join(pristine_dir, sub_dir),
+                os.path.join(charm_dir, sub_dir))
         for sub_path in ["layer.yaml"]:
             source = os.path.join(code_dir, sub_path)
             target = os.path.join(charm_dir, sub_path)
@@ -478,8 +808,15 @@ class FooTest(CharmTest):
 
     def _init_snap_layer(self):
         """Add a snap binary, which the snap layer needs."""
+        self.fakes.fs.add("/var/snap")
+        self.fakes.fs.add("/usr/local/bin")
+        self.fakes.fs.add("/etc/systemd/system")
+        self.systemctl = Systemctl()
+        self.fakes.processes.add(self.systemctl)
         self.snap = Snap()
         self.fakes.processes.add(self.snap)
+        self.exporter = Exporter()
+        self.fakes.processes.add(self.exporter)
         self.apt = Apt()
         self.fakes.processes.add(self.apt)
         # The snap layer reloads snapd when proxy settings have change.
@@ -488,6 +825,9 @@ class FooTest(CharmTest):
         hookenv.config()["snap_proxy"] = ""
         data_changed("snap.proxy", "")
 
+
+class FooTest(NodeExporterTest):
+
     def test_install_snap(self):
         self.fakes.juju.model.deploy(["mysql"])
         self.fakes.juju.model.relate("container", "mysql")
@@ -497,6 +837,184 @@ class FooTest(CharmTest):
         self.assertEqual(
             ["bjornt-prometheus-node-exporter"], list(self.snap.snaps.keys()))
 
+    def test_install_snap_channel(self):
+        hookenv.config()["snap_channel"] = "edge"
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        self.assertEqual(
+            [("install", "bjornt-prometheus-node-exporter", "edge")],
+            self.snap.installs)
+
+    def test_change_snap_channel(self):
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        hookenv.config()["snap_channel"] = "candidate"
+        self.fakes.juju.model.run_hook("config-changed")
+
+        self.assertEqual(
+            [("install", "bjornt-prometheus-node-exporter", "stable"),
+             ("refresh", "bjornt-prometheus-node-exporter", "candidate")],
+            self.snap.installs)
+
+    def attach_snap_resource(self, content):
+        if not self.resource_get.resources:
+            # The snaps are cached next to the charm directory.
+            self.fakes.fs.add(os.path.join(
+                os.path.dirname(hookenv.charm_dir()), "nodeexporter-snaps"))
+        path = os.path.join(self.useFixture(TempDir()).path, "exporter.snap")
+        with open(path, "wb") as snap_file:
+            snap_file.write(content)
+        self.resource_get.resources["bjornt-prometheus-node-exporter"] = path
+        return path
+
+    def test_install_snap_resource(self):
+        self.attach_snap_resource(b"snap")
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        digest = hashlib.sha256(b"snap").hexdigest()
+        [(command, snap_name, source)] = self.snap.installs
+        self.assertEqual(
+            ("install", "bjornt-prometheus-node-exporter"),
+            (command, snap_name))
+        self.assertEqual(
+            "bjornt-prometheus-node-exporter_{}.snap".format(digest),
+            os.path.basename(source))
+        self.assertTrue(os.path.exists(source))
+        self.assertTrue(
+            charms.reactive.is_state(
+                "snap.installed.bjornt-prometheus-node-exporter"))
+
+    def test_upgrade_snap_resource_unchanged(self):
+        self.attach_snap_resource(b"snap")
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        self.attach_snap_resource(b"snap")
+        self.fakes.juju.model.run_hook("upgrade-charm")
+
+        self.assertEqual(1, len(self.snap.installs))
+
+    def test_upgrade_snap_resource_changed(self):
+        self.attach_snap_resource(b"snap")
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        self.attach_snap_resource(b"new snap")
+        self.fakes.juju.model.run_hook("upgrade-charm")
+
+        digest = hashlib.sha256(b"new snap").hexdigest()
+        self.assertEqual(2, len(self.snap.installs))
+        self.assertIn(digest, self.snap.installs[-1][2])
+
+    def test_passive_snap_resource(self):
+        self.make_other_exporter_active()
+        self.attach_snap_resource(b"snap")
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        self.attach_snap_resource(b"new snap")
+        self.fakes.juju.model.run_hook("upgrade-charm")
+
+        # Installing the snap would restart the other unit's exporter.
+        self.assertEqual([], self.snap.installs)
+        self.assertTrue(
+            charms.reactive.is_state(
+                "snap.installed.bjornt-prometheus-node-exporter"))
+
+    def test_passive_snap_resource_takeover(self):
+        self.make_other_exporter_active()
+        self.attach_snap_resource(b"snap")
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        os.rmdir("/var/lib/juju/agents/unit-other-0")
+        self.fakes.juju.model.run_hook("update-status")
+
+        digest = hashlib.sha256(b"snap").hexdigest()
+        [(command, _, source)] = self.snap.installs
+        self.assertEqual("install", command)
+        self.assertIn(digest, source)
+
+    def test_refresh_window_hold(self):
+        hookenv.config()["refresh_window"] = "02:00-06:00"
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        self.assertEqual({"bjornt-prometheus-node-exporter"}, self.snap.held)
+
+    def test_refresh_window_unhold(self):
+        hookenv.config()["refresh_window"] = "02:00-06:00"
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        hookenv.config()["refresh_window"] = ""
+        self.fakes.juju.model.run_hook("config-changed")
+
+        self.assertEqual(set(), self.snap.held)
+
+    def test_refresh_window_invalid(self):
+        hookenv.config()["refresh_window"] = "02:00"
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        self.assertTrue(
+            charms.reactive.is_state("nodeexporter.invalid-config"))
+        self.assertEqual(set(), self.snap.held)
+
+    def test_refresh_in_slot(self):
+        # A single slot that lasts the whole day is always open.
+        hookenv.config()["refresh_window"] = "00:00-00:00"
+        hookenv.config()["refresh_slot_minutes"] = 24 * 60
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        self.fakes.juju.model.run_hook("update-status")
+        self.fakes.juju.model.run_hook("update-status")
+
+        # The snap is only refreshed once per slot.
+        self.assertEqual(
+            [("refresh", "bjornt-prometheus-node-exporter", None)],
+            [install for install in self.snap.installs
+             if install[0] == "refresh"])
+
+    def test_refresh_slot_not_skipped(self):
+        self.start_fake_exporter()
+        hookenv.config()["refresh_window"] = "00:00-00:00"
+        hookenv.config()["refresh_slot_minutes"] = 24 * 60
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+        path = os.path.join(hookenv.charm_dir(), fastpath.STATE_PATH)
+
+        # Another hook runs while the slot is open, before the snap has
+        # been refreshed in it.
+        self.fakes.juju.model.run_hook("config-changed")
+
+        self.assertLessEqual(fastpath.read_state(path)["due"], time.time())
+        self.fakes.juju.model.run_hook("update-status")
+        self.assertEqual(
+            1, len([install for install in self.snap.installs
+                    if install[0] == "refresh"]))
+        self.assertGreater(fastpath.read_state(path)["due"], time.time())
+
     def test_relate_prometheus(self):
         self.fakes.juju.model.deploy(["mysql", "prometheus"])
         self.fakes.juju.model.relate("container", "mysql")
@@ -535,3 +1053,1248 @@ class FooTest(CharmTest):
         self.assertEqual("9100", relation2["data"]["port"])
         self.assertEqual(
             "mysql/0", relation2["data"]["principal-unit"])
+
+    def make_other_exporter_active(self):
+        """Make another unit on the machine manage the exporter."""
+        os.makedirs("/var/lib/juju/agents/unit-other-0")
+        os.makedirs("/var/snap/bjornt-prometheus-node-exporter/common")
+        with open(election.ELECTION_PATH, "w") as election_file:
+            election_file.write("other/0\n")
+        # The other unit installed the snap.
+        self.snap.snaps["bjornt-prometheus-node-exporter"] = {}
+
+    def test_exporter_active(self):
+        self.fakes.juju.model.deploy(["mysql", "prometheus"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.relate("prometheus-client", "prometheus")
+
+        self.fakes.juju.model.start("mysql")
+        self.fakes.juju.model.start("prometheus")
+
+        [relation] = self.fakes.juju.model.relations["prometheus-client"]
+        self.assertEqual("active", relation["data"]["exporter-role"])
+        self.assertEqual(
+            os.environ["JUJU_UNIT_NAME"], relation["data"]["active-unit"])
+        self.assertTrue(charms.reactive.is_state("nodeexporter.active"))
+
+    def test_exporter_passive(self):
+        self.make_other_exporter_active()
+        self.fakes.juju.model.deploy(["mysql", "prometheus"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.relate("prometheus-client", "prometheus")
+
+        self.fakes.juju.model.start("mysql")
+        self.fakes.juju.model.start("prometheus")
+
+        # The exporter is left to the other unit.
+        self.assertEqual([], self.snap.installs)
+        self.assertEqual(
+            {}, self.snap.snaps["bjornt-prometheus-node-exporter"])
+        self.assertEqual([], self.snap.restarts)
+        [relation] = self.fakes.juju.model.relations["prometheus-client"]
+        self.assertEqual("passive", relation["data"]["exporter-role"])
+        self.assertEqual("other/0", relation["data"]["active-unit"])
+        self.assertEqual("9100", relation["data"]["port"])
+        self.assertEqual("mysql/0", relation["data"]["principal-unit"])
+
+    def test_exporter_shared(self):
+        # Only the options describing the published exporter are shared
+        # with the passive units.
+        hookenv.config()["scrape_cache_ttl"] = 10
+        hookenv.config()["slow_collectors"] = "textfile"
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        shared = election.get_shared_exporter()
+        self.assertEqual(10, shared["config"]["scrape_cache_ttl"])
+        self.assertEqual("textfile", shared["config"]["slow_collectors"])
+        self.assertNotIn("push_endpoint", shared["config"])
+
+    def test_exporter_passive_shared(self):
+        self.make_other_exporter_active()
+        election.share_exporter("other/0", {
+            "config": {
+                "scrape_cache_ttl": 10, "scrape_cache_port": 9101,
+                "slow_collectors": "textfile"},
+            "collector-filters": {"collector.netdev.device-exclude": "^tap"},
+            "scrape-timeout": None,
+        })
+        hookenv.config()["netdev_device_exclude"] = "^veth"
+        self.fakes.juju.model.deploy(["mysql", "prometheus"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.relate("prometheus-client", "prometheus")
+
+        self.fakes.juju.model.start("mysql")
+        self.fakes.juju.model.start("prometheus")
+
+        [relation] = self.fakes.juju.model.relations["prometheus-client"]
+        self.assertEqual("passive", relation["data"]["exporter-role"])
+        self.assertEqual("9101", relation["data"]["port"])
+        self.assertEqual(
+            ["9101", "9110"],
+            [endpoint["port"] for endpoint in json.loads(
+                relation["data"]["endpoints"])])
+        self.assertEqual(
+            {"collector.netdev.device-exclude": "^tap"},
+            json.loads(relation["data"]["collector-filters"]))
+
+    def test_exporter_passive_shared_changed(self):
+        self.make_other_exporter_active()
+        self.fakes.juju.model.deploy(["mysql", "prometheus"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.relate("prometheus-client", "prometheus")
+        self.fakes.juju.model.start("mysql")
+        self.fakes.juju.model.start("prometheus")
+
+        election.share_exporter("other/0", {
+            "config": {"scrape_cache_ttl": 10},
+            "collector-filters": {},
+            "scrape-timeout": None,
+        })
+        self.fakes.juju.model.run_hook("update-status")
+
+        [relation] = self.fakes.juju.model.relations["prometheus-client"]
+        self.assertEqual("9101", relation["data"]["port"])
+
+    def test_exporter_takeover(self):
+        self.make_other_exporter_active()
+        self.fakes.juju.model.deploy(["mysql", "prometheus"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.relate("prometheus-client", "prometheus")
+        self.fakes.juju.model.start("mysql")
+        self.fakes.juju.model.start("prometheus")
+
+        os.rmdir("/var/lib/juju/agents/unit-other-0")
+        self.fakes.juju.model.run_hook("update-status")
+
+        self.assertEqual(
+            TEXTFILE_ARG,
+            self.snap.snaps["bjornt-prometheus-node-exporter"]["args"])
+        [relation] = self.fakes.juju.model.relations["prometheus-client"]
+        self.assertEqual("active", relation["data"]["exporter-role"])
+        # The snap is switched to this unit's channel. The other unit
+        # may have installed it from a file.
+        self.assertEqual(
+            [("refresh", "bjornt-prometheus-node-exporter", "stable")],
+            self.snap.installs)
+
+    def test_exporter_released(self):
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        self.fakes.juju.model.run_hook("stop")
+
+        self.assertFalse(os.path.exists(election.ELECTION_PATH))
+
+    def test_exporter_released_cleanup(self):
+        hookenv.config()["scrape_cache_ttl"] = 10
+        hookenv.config()["slow_collectors"] = "textfile"
+        hookenv.config()["push_endpoint"] = "https://push.example.com/import"
+        hookenv.config()["cpu_quota"] = "20%"
+        hookenv.config()["textfile_generators"] = (
+            "backup: {command: /usr/local/bin/backup-metrics}")
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        self.fakes.juju.model.run_hook("stop")
+
+        for service in [
+                "node-exporter-scrape-cache", "node-exporter-slow",
+                "node-exporter-push"]:
+            self.assertFalse(os.path.exists(
+                "/etc/systemd/system/{}.service".format(service)))
+            self.assertIn(
+                ["disable", "--now", service], self.systemctl.calls)
+        self.assertFalse(os.path.exists(LIMITS_DROP_IN))
+        self.assertFalse(
+            os.path.exists("/usr/local/bin/node-exporter-textfile"))
+        self.assertFalse(os.path.exists(
+            "/etc/systemd/system/node-exporter-textfile-generators.timer"))
+        self.assertFalse(os.path.exists(election.ELECTION_PATH))
+
+    def test_passive_exporter_released(self):
+        self.make_other_exporter_active()
+        hookenv.config()["scrape_cache_ttl"] = 10
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        self.fakes.juju.model.run_hook("stop")
+
+        # The services belong to the active unit.
+        self.assertNotIn(
+            ["disable", "--now", "node-exporter-scrape-cache"],
+            self.systemctl.calls)
+        self.assertEqual("other/0", election.get_active_unit())
+
+    def test_upgrade_charm_restarts_services(self):
+        hookenv.config()["scrape_cache_ttl"] = 10
+        hookenv.config()["push_endpoint"] = "https://push.example.com/import"
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+        del self.systemctl.calls[:]
+        del self.snap.restarts[:]
+
+        self.fakes.juju.model.run_hook("upgrade-charm")
+
+        self.assertIn(
+            ["restart", "node-exporter-scrape-cache"], self.systemctl.calls)
+        self.assertIn(["restart", "node-exporter-push"], self.systemctl.calls)
+        # The exporter itself isn't restarted.
+        self.assertEqual([], self.snap.restarts)
+
+    def test_principal_unit_cached(self):
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        self.assertEqual(
+            "mysql/0", unitdata.kv().get("nodeexporter.principal-unit"))
+
+    def test_principal_unit_cached_used(self):
+        self.fakes.juju.model.deploy(["mysql", "prometheus"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.relate("prometheus-client", "prometheus")
+        self.fakes.juju.model.start("mysql")
+        # The container relation isn't looked at once the principal
+        # unit has been recorded.
+        [container] = self.fakes.juju.model.relations["container"]
+        container["units"].clear()
+
+        self.fakes.juju.model.start("prometheus")
+
+        [relation] = self.fakes.juju.model.relations["prometheus-client"]
+        self.assertEqual("mysql/0", relation["data"]["principal-unit"])
+
+    def test_principal_unit_departed(self):
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+        [container] = self.fakes.juju.model.relations["container"]
+        del container["units"]["mysql/0"]
+
+        self.fakes.juju.model.run_hook(
+            "container-relation-departed", "mysql/0", container["id"])
+
+        self.assertIsNone(unitdata.kv().get("nodeexporter.principal-unit"))
+
+    def test_relate_prometheus_unchanged_not_republished(self):
+        self.fakes.juju.model.deploy(["mysql", "prometheus"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.relate("prometheus-client", "prometheus")
+        self.fakes.juju.model.start("mysql")
+        self.fakes.juju.model.start("prometheus")
+        [relation] = self.fakes.juju.model.relations["prometheus-client"]
+        relation["data"].clear()
+
+        self.fakes.juju.model.run_hook("update-status")
+
+        self.assertEqual({}, relation["data"])
+
+    def test_relate_prometheus_changed_republished(self):
+        self.fakes.juju.model.deploy(["mysql", "prometheus"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.relate("prometheus-client", "prometheus")
+        self.fakes.juju.model.start("mysql")
+        self.fakes.juju.model.start("prometheus")
+        [relation] = self.fakes.juju.model.relations["prometheus-client"]
+        self.fakes.juju.model.local_unit["data"]["private-address"] = (
+            "10.1.2.4")
+
+        self.fakes.juju.model.run_hook("update-status")
+
+        self.assertEqual("10.1.2.4", relation["data"]["hostname"])
+        self.assertEqual("10.1.2.4", relation["data"]["private-address"])
+
+    def test_collectors_default(self):
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        self.assertEqual(
+            TEXTFILE_ARG,
+            self.snap.snaps["bjornt-prometheus-node-exporter"]["args"])
+        self.assertEqual(
+            ["bjornt-prometheus-node-exporter"], self.snap.restarts)
+
+    def test_collectors_config(self):
+        hookenv.config()["enable_collectors"] = "systemd processes"
+        hookenv.config()["disable_collectors"] = "interrupts,filesystem"
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        self.assertEqual(
+            "--collector.processes --collector.systemd "
+            "--no-collector.filesystem --no-collector.interrupts " +
+            TEXTFILE_ARG,
+            self.snap.snaps["bjornt-prometheus-node-exporter"]["args"])
+
+    def test_collectors_unchanged_no_restart(self):
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        self.fakes.juju.model.run_hook("config-changed")
+
+        self.assertEqual(
+            ["bjornt-prometheus-node-exporter"], self.snap.restarts)
+
+    def test_collectors_changed_restart(self):
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        hookenv.config()["disable_collectors"] = "interrupts"
+        self.fakes.juju.model.run_hook("config-changed")
+
+        self.assertEqual(
+            "--no-collector.interrupts " + TEXTFILE_ARG,
+            self.snap.snaps["bjornt-prometheus-node-exporter"]["args"])
+        self.assertEqual(
+            ["bjornt-prometheus-node-exporter"] * 2, self.snap.restarts)
+
+    def test_collectors_invalid(self):
+        hookenv.config()["enable_collectors"] = "systemd"
+        hookenv.config()["disable_collectors"] = "systemd"
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        self.assertEqual(
+            {}, self.snap.snaps["bjornt-prometheus-node-exporter"])
+        self.assertTrue(
+            charms.reactive.is_state("nodeexporter.invalid-config"))
+
+    def test_collector_filters(self):
+        hookenv.config()["netdev_device_exclude"] = "^(tap|veth).*$"
+        hookenv.config()["filesystem_fs_types_exclude"] = "^overlay$"
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        self.assertEqual(
+            "'--collector.filesystem.fs-types-exclude=^overlay$' "
+            "'--collector.netdev.device-exclude=^(tap|veth).*$' " +
+            TEXTFILE_ARG,
+            self.snap.snaps["bjornt-prometheus-node-exporter"]["args"])
+
+    def test_collector_filters_invalid_regex(self):
+        hookenv.config()["diskstats_device_exclude"] = "^(loop"
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        self.assertTrue(
+            charms.reactive.is_state("nodeexporter.invalid-config"))
+
+    def test_collector_filters_unsupported_by_re2(self):
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        # Python's re accepts these, but node_exporter's RE2 doesn't.
+        for regex in [
+                "^(?!eth).*", "^(?=veth)", "(?<=a)b", "(?<!a)b",
+                "^(tap)\\1$", "(?P<a>x)(?P=a)", "^loop\\Z", "(?#c)loop",
+                "(?x)loop", "(?a)loop"]:
+            hookenv.config()["diskstats_device_exclude"] = regex
+            self.fakes.juju.model.run_hook("config-changed")
+
+            self.assertTrue(
+                charms.reactive.is_state("nodeexporter.invalid-config"),
+                regex)
+
+    def test_collector_filters_supported_by_re2(self):
+        # The constructs are only rejected outside of character
+        # classes, and when they aren't escaped.
+        hookenv.config()["diskstats_device_exclude"] = (
+            "^(loop|[(?=]|\\(?!)[0-9]+?$")
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        self.assertFalse(
+            charms.reactive.is_state("nodeexporter.invalid-config"))
+
+    def test_collector_filters_re2_only(self):
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        # Python's re doesn't accept these, but node_exporter's RE2 does.
+        for regex in ["^loop\\z", "\\p{Greek}", "(?<name>loop)"]:
+            hookenv.config()["diskstats_device_exclude"] = regex
+            self.fakes.juju.model.run_hook("config-changed")
+
+            self.assertFalse(
+                charms.reactive.is_state("nodeexporter.invalid-config"),
+                regex)
+
+    def test_collector_filters_exclusive(self):
+        hookenv.config()["netdev_device_include"] = "^eth"
+        hookenv.config()["netdev_device_exclude"] = "^tap"
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        self.assertTrue(
+            charms.reactive.is_state("nodeexporter.invalid-config"))
+
+    def test_collector_filters_published(self):
+        hookenv.config()["netdev_device_exclude"] = "^tap"
+        self.fakes.juju.model.deploy(["mysql", "prometheus"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.relate("prometheus-client", "prometheus")
+
+        self.fakes.juju.model.start("mysql")
+        self.fakes.juju.model.start("prometheus")
+
+        [relation] = self.fakes.juju.model.relations["prometheus-client"]
+        self.assertEqual(
+            {"collector.netdev.device-exclude": "^tap"},
+            json.loads(relation["data"]["collector-filters"]))
+
+    def test_textfile_directory(self):
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        self.assertTrue(os.path.isdir(
+            "/var/snap/bjornt-prometheus-node-exporter/common/"
+            "textfile_collector"))
+        self.assertTrue(
+            os.access("/usr/local/bin/node-exporter-textfile", os.X_OK))
+
+    def test_textfile_collector_disabled(self):
+        hookenv.config()["disable_collectors"] = "textfile"
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        self.assertEqual(
+            "--no-collector.textfile",
+            self.snap.snaps["bjornt-prometheus-node-exporter"]["args"])
+
+    def test_textfile_generators_invalid(self):
+        hookenv.config()["textfile_generators"] = "backup: {}"
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        self.assertTrue(
+            charms.reactive.is_state("nodeexporter.invalid-config"))
+
+    def test_exporter_too_old(self):
+        self.exporter.version = "1.0.1"
+        hookenv.config()["slow_collectors"] = "textfile"
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        self.assertTrue(
+            charms.reactive.is_state("nodeexporter.invalid-config"))
+        self.assertNotIn(
+            "args", self.snap.snaps["bjornt-prometheus-node-exporter"])
+
+    def test_exporter_old_default_config(self):
+        # The default config works with exporters that predate the
+        # collector selection and filter flags.
+        self.exporter.version = "0.15.2"
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        self.assertTrue(charms.reactive.is_state("nodeexporter.config-valid"))
+        self.assertEqual(
+            TEXTFILE_ARG,
+            self.snap.snaps["bjornt-prometheus-node-exporter"]["args"])
+
+    def test_textfile_generators(self):
+        hookenv.config()["textfile_generators"] = (
+            "backup:\n"
+            "  command: /usr/local/bin/backup-metrics\n"
+            "  inputs: [/var/backups/latest]\n")
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        # The generators are run by a timer, not by the hooks.
+        with open("/var/snap/bjornt-prometheus-node-exporter/common/"
+                  "textfile-generators.json") as registry_file:
+            self.assertEqual(
+                {"backup": {"command": "/usr/local/bin/backup-metrics",
+                            "inputs": ["/var/backups/latest"]}},
+                json.loads(registry_file.read()))
+        with open("/etc/systemd/system/"
+                  "node-exporter-textfile-generators.service") as unit_file:
+            unit = unit_file.read()
+        self.assertIn("Type=oneshot\n", unit)
+        self.assertIn("User=nobody\n", unit)
+        self.assertIn(
+            "ExecStartPre=-/bin/chown nobody:nogroup /var/snap/"
+            "bjornt-prometheus-node-exporter/common/textfile_collector/"
+            "backup.prom\n", unit)
+        with open("/etc/systemd/system/"
+                  "node-exporter-textfile-generators.timer") as timer_file:
+            self.assertIn("OnUnitActiveSec=300s\n", timer_file.read())
+        self.assertIn(
+            ["enable", "node-exporter-textfile-generators.timer"],
+            self.systemctl.calls)
+
+    def test_textfile_generators_removed(self):
+        hookenv.config()["textfile_generators"] = (
+            "backup: {command: /usr/local/bin/backup-metrics}")
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+        # The timer ran the generator.
+        os.makedirs(
+            "/var/snap/bjornt-prometheus-node-exporter/common/"
+            "textfile-generators")
+        with open("/var/snap/bjornt-prometheus-node-exporter/common/"
+                  "textfile-generators/state.json", "w") as state_file:
+            state_file.write(json.dumps({"backup": None}))
+        backup_path = (
+            "/var/snap/bjornt-prometheus-node-exporter/common/"
+            "textfile_collector/backup.prom")
+        with open(backup_path, "w") as prom_file:
+            prom_file.write("backup_ok 1\n")
+
+        hookenv.config()["textfile_generators"] = ""
+        self.fakes.juju.model.run_hook("config-changed")
+
+        self.assertIn(
+            ["disable", "--now", "node-exporter-textfile-generators.timer"],
+            self.systemctl.calls)
+        self.assertFalse(os.path.exists(
+            "/etc/systemd/system/node-exporter-textfile-generators.timer"))
+        self.assertFalse(os.path.exists(backup_path))
+
+    def test_textfile_generators_passive(self):
+        self.make_other_exporter_active()
+        hookenv.config()["textfile_generators"] = (
+            "backup: {command: /usr/local/bin/backup-metrics}")
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        self.assertFalse(os.path.exists(
+            "/etc/systemd/system/node-exporter-textfile-generators.timer"))
+
+    def test_textfile_generators_update_status_due(self):
+        hookenv.config()["textfile_generators"] = (
+            "backup: {command: /usr/local/bin/backup-metrics}")
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        # The generators don't need update-status to do a full run.
+        state = fastpath.read_state(
+            os.path.join(hookenv.charm_dir(), fastpath.STATE_PATH))
+        self.assertGreater(state["due"], time.time())
+
+    def test_scrape_cache_disabled(self):
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        self.assertFalse(os.path.exists(
+            "/etc/systemd/system/node-exporter-scrape-cache.service"))
+        self.assertEqual([], self.systemctl.calls)
+
+    def test_scrape_cache(self):
+        hookenv.config()["scrape_cache_ttl"] = 10
+        hookenv.config()["scrape_cache_port"] = 9101
+        hookenv.config()["scrape_cache_gzip"] = True
+        self.fakes.juju.model.deploy(["mysql", "prometheus"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.relate("prometheus-client", "prometheus")
+
+        self.fakes.juju.model.start("mysql")
+        self.fakes.juju.model.start("prometheus")
+
+        with open(
+                "/etc/systemd/system/"
+                "node-exporter-scrape-cache.service") as unit_file:
+            unit = unit_file.read()
+        self.assertIn("--address 10.1.2.3 --port 9101", unit)
+        self.assertIn("--ttl 10 --gzip", unit)
+        self.assertIn("User=nobody\nGroup=nogroup\n", unit)
+        self.assertIn(
+            ["restart", "node-exporter-scrape-cache"], self.systemctl.calls)
+        [relation] = self.fakes.juju.model.relations["prometheus-client"]
+        self.assertEqual("9101", relation["data"]["port"])
+
+    def test_scrape_cache_removed(self):
+        hookenv.config()["scrape_cache_ttl"] = 10
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        hookenv.config()["scrape_cache_ttl"] = 0
+        self.fakes.juju.model.run_hook("config-changed")
+
+        self.assertFalse(os.path.exists(
+            "/etc/systemd/system/node-exporter-scrape-cache.service"))
+        self.assertIn(
+            ["disable", "--now", "node-exporter-scrape-cache"],
+            self.systemctl.calls)
+
+    def test_push_agent(self):
+        hookenv.config()["push_endpoint"] = "https://push.example.com/import"
+        hookenv.config()["push_interval"] = 30
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        with open(
+                "/etc/systemd/system/node-exporter-push.service") as unit_file:
+            unit = unit_file.read()
+        self.assertIn(
+            "push.py --endpoint https://push.example.com/import", unit)
+        self.assertIn(
+            "--label instance=mysql/0 "
+            "--upstream main=http://localhost:9100/metrics", unit)
+        self.assertIn("--interval 30 --batch-size 4", unit)
+        self.assertIn("User=nobody\nGroup=nogroup\n", unit)
+        self.assertIn(
+            "ExecStartPre=/bin/chown -R nobody:nogroup "
+            "/var/snap/bjornt-prometheus-node-exporter/common/push-spool\n",
+            unit)
+        self.assertIn(["restart", "node-exporter-push"], self.systemctl.calls)
+
+    def test_push_agent_instance(self):
+        hookenv.config()["push_endpoint"] = "https://push.example.com/import"
+        hookenv.config()["push_instance"] = "db-1"
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        with open(
+                "/etc/systemd/system/node-exporter-push.service") as unit_file:
+            self.assertIn("--label instance=db-1 ", unit_file.read())
+
+    def test_push_agent_slow_collectors(self):
+        hookenv.config()["push_endpoint"] = "https://push.example.com/import"
+        hookenv.config()["slow_collectors"] = "textfile"
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        with open(
+                "/etc/systemd/system/node-exporter-push.service") as unit_file:
+            self.assertIn(
+                "--upstream slow=http://10.1.2.3:9110/metrics",
+                unit_file.read())
+
+    def test_push_agent_invalid_endpoint(self):
+        hookenv.config()["push_endpoint"] = "push.example.com"
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        self.assertTrue(
+            charms.reactive.is_state("nodeexporter.invalid-config"))
+        self.assertFalse(os.path.exists(
+            "/etc/systemd/system/node-exporter-push.service"))
+
+    def test_push_agent_removed(self):
+        hookenv.config()["push_endpoint"] = "https://push.example.com/import"
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        hookenv.config()["push_endpoint"] = ""
+        self.fakes.juju.model.run_hook("config-changed")
+
+        self.assertFalse(os.path.exists(
+            "/etc/systemd/system/node-exporter-push.service"))
+        self.assertIn(
+            ["disable", "--now", "node-exporter-push"], self.systemctl.calls)
+
+    def test_resource_limits(self):
+        hookenv.config()["cpu_quota"] = "20%"
+        hookenv.config()["memory_limit"] = "256M"
+        hookenv.config()["nice"] = 10
+        hookenv.config()["io_scheduling_class"] = "best-effort"
+        hookenv.config()["io_scheduling_priority"] = 7
+        hookenv.config()["gomaxprocs"] = 1
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        with open(LIMITS_DROP_IN) as drop_in:
+            self.assertEqual(
+                "[Service]\n"
+                "CPUQuota=20%\n"
+                "MemoryLimit=256M\n"
+                "Nice=10\n"
+                "IOSchedulingClass=best-effort\n"
+                "IOSchedulingPriority=7\n"
+                "Environment=GOMAXPROCS=1\n",
+                drop_in.read())
+        # The limits and the arguments are applied with a single restart.
+        self.assertEqual(
+            ["bjornt-prometheus-node-exporter"], self.snap.restarts)
+
+    def test_resource_limits_changed(self):
+        hookenv.config()["cpu_quota"] = "20%"
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        hookenv.config()["cpu_quota"] = "50%"
+        self.fakes.juju.model.run_hook("config-changed")
+
+        with open(LIMITS_DROP_IN) as drop_in:
+            self.assertIn("CPUQuota=50%\n", drop_in.read())
+        self.assertEqual(
+            ["bjornt-prometheus-node-exporter"] * 2, self.snap.restarts)
+
+    def test_resource_limits_removed(self):
+        hookenv.config()["cpu_quota"] = "20%"
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        hookenv.config()["cpu_quota"] = ""
+        self.fakes.juju.model.run_hook("config-changed")
+
+        self.assertFalse(os.path.exists(LIMITS_DROP_IN))
+        self.assertEqual(
+            ["bjornt-prometheus-node-exporter"] * 2, self.snap.restarts)
+
+    def test_resource_limits_none(self):
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        self.assertFalse(os.path.exists(LIMITS_DROP_IN))
+
+    def test_resource_limits_invalid(self):
+        hookenv.config()["cpu_quota"] = "a lot"
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        self.assertTrue(
+            charms.reactive.is_state("nodeexporter.invalid-config"))
+        self.assertFalse(os.path.exists(LIMITS_DROP_IN))
+
+    def test_config_becomes_invalid(self):
+        hookenv.config()["cpu_quota"] = "20%"
+        hookenv.config()["slow_collectors"] = "systemd"
+        hookenv.config()["push_endpoint"] = "https://push.example.com/"
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+        args = self.snap.snaps["bjornt-prometheus-node-exporter"]["args"]
+
+        # The handlers applying the config were already selected when
+        # configure_exporter() finds that it's invalid, and they would
+        # fail if they still ran.
+        hookenv.config()["cpu_quota"] = "a lot"
+        hookenv.config()["push_interval"] = 0
+        self.fakes.juju.model.run_hook("config-changed")
+
+        self.assertTrue(
+            charms.reactive.is_state("nodeexporter.invalid-config"))
+        self.assertFalse(
+            charms.reactive.is_state("nodeexporter.config-valid"))
+        self.assertEqual(
+            args, self.snap.snaps["bjornt-prometheus-node-exporter"]["args"])
+        with open(LIMITS_DROP_IN) as drop_in:
+            self.assertIn("CPUQuota=20%\n", drop_in.read())
+
+        hookenv.config()["cpu_quota"] = "50%"
+        hookenv.config()["push_interval"] = 15
+        self.fakes.juju.model.run_hook("config-changed")
+
+        self.assertTrue(
+            charms.reactive.is_state("nodeexporter.config-valid"))
+        with open(LIMITS_DROP_IN) as drop_in:
+            self.assertIn("CPUQuota=50%\n", drop_in.read())
+
+    def test_resource_limits_slow_exporter(self):
+        hookenv.config()["slow_collectors"] = "systemd"
+        hookenv.config()["cpu_quota"] = "20%"
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        with open("/etc/systemd/system/node-exporter-slow.service") as unit:
+            self.assertIn("\nCPUQuota=20%\n", unit.read())
+
+    def test_consumer_collectors_default(self):
+        self.fakes.juju.model.deploy(["mysql", "prometheus"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.relate("prometheus-client", "prometheus")
+
+        self.fakes.juju.model.start("mysql")
+        self.fakes.juju.model.start("prometheus")
+
+        [relation] = self.fakes.juju.model.relations["prometheus-client"]
+        self.assertEqual("/metrics", relation["data"]["metrics-path"])
+        self.assertEqual({}, json.loads(relation["data"]["params"]))
+
+    def test_consumer_collectors_configured(self):
+        hookenv.config()["consumer_collectors"] = (
+            "prometheus1: [cpu, meminfo, filesystem]")
+        self.fakes.juju.model.deploy(
+            ["mysql", "prometheus1", "prometheus2"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.relate("prometheus-client", "prometheus1")
+        self.fakes.juju.model.relate("prometheus-client", "prometheus2")
+
+        self.fakes.juju.model.start("mysql")
+        self.fakes.juju.model.start("prometheus1")
+        self.fakes.juju.model.start("prometheus2")
+
+        relation1, relation2 = self.fakes.juju.model.relations[
+            "prometheus-client"]
+        self.assertEqual(
+            {"collect[]": ["cpu", "filesystem", "meminfo"]},
+            json.loads(relation1["data"]["params"]))
+        self.assertEqual({}, json.loads(relation2["data"]["params"]))
+
+    def test_consumer_collectors_requested(self):
+        hookenv.config()["disable_collectors"] = "filesystem"
+        self.fakes.juju.model.deploy(["mysql", "prometheus"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.relate("prometheus-client", "prometheus")
+        self.fakes.juju.model.start("mysql")
+        self.fakes.juju.model.start("prometheus")
+        [relation] = self.fakes.juju.model.relations["prometheus-client"]
+
+        self.fakes.juju.model.change_remote_unit(
+            relation, "prometheus/0", {"collectors": "cpu filesystem"})
+
+        self.assertEqual(
+            {"collect[]": ["cpu"]}, json.loads(relation["data"]["params"]))
+
+    def test_consumer_collectors_requested_not_enabled(self):
+        self.fakes.juju.model.deploy(["mysql", "prometheus"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.relate("prometheus-client", "prometheus")
+        self.fakes.juju.model.start("mysql")
+        self.fakes.juju.model.start("prometheus")
+        [relation] = self.fakes.juju.model.relations["prometheus-client"]
+
+        # systemd isn't enabled by default, and node_exporter rejects
+        # scrapes asking for a collector that isn't enabled.
+        self.fakes.juju.model.change_remote_unit(
+            relation, "prometheus/0", {"collectors": "cpu systemd unknown"})
+
+        self.assertEqual(
+            {"collect[]": ["cpu"]}, json.loads(relation["data"]["params"]))
+        self.assertEqual(
+            [{"port": "9100", "metrics-path": "/metrics",
+              "params": {"collect[]": ["cpu"]}, "scrape-interval": "15s"}],
+            json.loads(relation["data"]["endpoints"]))
+
+    def test_consumer_collectors_requested_enabled(self):
+        hookenv.config()["enable_collectors"] = "systemd"
+        self.fakes.juju.model.deploy(["mysql", "prometheus"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.relate("prometheus-client", "prometheus")
+        self.fakes.juju.model.start("mysql")
+        self.fakes.juju.model.start("prometheus")
+        [relation] = self.fakes.juju.model.relations["prometheus-client"]
+
+        self.fakes.juju.model.change_remote_unit(
+            relation, "prometheus/0", {"collectors": "cpu systemd"})
+
+        self.assertEqual(
+            {"collect[]": ["cpu", "systemd"]},
+            json.loads(relation["data"]["params"]))
+
+    def test_consumer_collectors_invalid(self):
+        hookenv.config()["consumer_collectors"] = "prometheus: [cpu, -x]"
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        self.assertTrue(
+            charms.reactive.is_state("nodeexporter.invalid-config"))
+
+    def test_slow_collectors_disabled(self):
+        self.fakes.juju.model.deploy(["mysql", "prometheus"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.relate("prometheus-client", "prometheus")
+
+        self.fakes.juju.model.start("mysql")
+        self.fakes.juju.model.start("prometheus")
+
+        self.assertFalse(os.path.exists(
+            "/etc/systemd/system/node-exporter-slow.service"))
+        [relation] = self.fakes.juju.model.relations["prometheus-client"]
+        self.assertEqual("15s", relation["data"]["scrape-interval"])
+        self.assertEqual(
+            [{"port": "9100", "metrics-path": "/metrics", "params": {},
+              "scrape-interval": "15s"}],
+            json.loads(relation["data"]["endpoints"]))
+
+    def test_slow_collectors(self):
+        hookenv.config()["slow_collectors"] = "textfile systemd"
+        hookenv.config()["slow_exporter_port"] = 9110
+        hookenv.config()["slow_scrape_interval"] = "5m"
+        self.fakes.juju.model.deploy(["mysql", "prometheus"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.relate("prometheus-client", "prometheus")
+
+        self.fakes.juju.model.start("mysql")
+        self.fakes.juju.model.start("prometheus")
+
+        self.assertEqual(
+            "--no-collector.systemd --no-collector.textfile",
+            self.snap.snaps["bjornt-prometheus-node-exporter"]["args"])
+        with open("/etc/systemd/system/node-exporter-slow.service") as unit:
+            self.assertIn(
+                "ExecStart=/snap/bin/bjornt-prometheus-node-exporter "
+                "--web.listen-address=10.1.2.3:9110 "
+                "--collector.disable-defaults "
+                "--collector.systemd --collector.textfile " + TEXTFILE_ARG,
+                unit.read())
+        [relation] = self.fakes.juju.model.relations["prometheus-client"]
+        self.assertEqual(
+            [{"port": "9100", "metrics-path": "/metrics", "params": {},
+              "scrape-interval": "15s"},
+             {"port": "9110", "metrics-path": "/metrics", "params": {},
+              "scrape-interval": "5m"}],
+            json.loads(relation["data"]["endpoints"]))
+
+    def test_slow_collectors_consumer_subset(self):
+        hookenv.config()["slow_collectors"] = "systemd"
+        hookenv.config()["consumer_collectors"] = "prometheus: [cpu]"
+        self.fakes.juju.model.deploy(["mysql", "prometheus"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.relate("prometheus-client", "prometheus")
+
+        self.fakes.juju.model.start("mysql")
+        self.fakes.juju.model.start("prometheus")
+
+        [relation] = self.fakes.juju.model.relations["prometheus-client"]
+        self.assertEqual(
+            [{"port": "9100", "metrics-path": "/metrics",
+              "params": {"collect[]": ["cpu"]}, "scrape-interval": "15s"}],
+            json.loads(relation["data"]["endpoints"]))
+
+    def test_slow_collectors_invalid_port(self):
+        hookenv.config()["slow_collectors"] = "systemd"
+        hookenv.config()["slow_exporter_port"] = 9100
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+
+        self.fakes.juju.model.start("mysql")
+
+        self.assertTrue(
+            charms.reactive.is_state("nodeexporter.invalid-config"))
+
+    def test_scrape_hints(self):
+        hookenv.config()["scrape_hints"] = True
+        hookenv.config()["scrape_interval"] = "15s"
+        self.fakes.juju.model.deploy(["mysql", "prometheus"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.relate("prometheus-client", "prometheus")
+        self.fakes.juju.model.start("mysql")
+        self.fakes.juju.model.start("prometheus")
+
+        unitdata.kv().set("nodeexporter.scrape-timeout", 20)
+        self.fakes.juju.model.run_hook("config-changed")
+
+        [relation] = self.fakes.juju.model.relations["prometheus-client"]
+        self.assertEqual("20s", relation["data"]["scrape-timeout"])
+        self.assertEqual("20s", relation["data"]["scrape-interval"])
+
+    def test_scrape_hints_interval_raised_status(self):
+        hookenv.config()["scrape_hints"] = True
+        hookenv.config()["scrape_interval"] = "15s"
+        statuses = []
+        self.useFixture(MonkeyPatch(
+            "charmhelpers.core.hookenv.status_set",
+            lambda *args: statuses.append(args)))
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        unitdata.kv().set("nodeexporter.scrape-timeout", 20)
+        self.fakes.juju.model.run_hook("config-changed")
+
+        self.assertEqual(
+            ("active", "Ready, scrape interval raised to 20s"), statuses[-1])
+
+    def test_scrape_hints_default(self):
+        self.fakes.juju.model.deploy(["mysql", "prometheus"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.relate("prometheus-client", "prometheus")
+        self.fakes.juju.model.start("mysql")
+        self.fakes.juju.model.start("prometheus")
+
+        self.fakes.juju.model.run_hook("update-status")
+
+        # The exporter isn't scraped to sample its duration by default.
+        self.assertIsNone(unitdata.kv().get("nodeexporter.scrape-samples"))
+        [relation] = self.fakes.juju.model.relations["prometheus-client"]
+        self.assertNotIn("scrape-timeout", relation["data"])
+
+    def test_scrape_hints_disabled(self):
+        hookenv.config()["scrape_hints"] = False
+        self.fakes.juju.model.deploy(["mysql", "prometheus"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.relate("prometheus-client", "prometheus")
+        self.fakes.juju.model.start("mysql")
+        self.fakes.juju.model.start("prometheus")
+
+        unitdata.kv().set("nodeexporter.scrape-timeout", 20)
+        self.fakes.juju.model.run_hook("config-changed")
+
+        [relation] = self.fakes.juju.model.relations["prometheus-client"]
+        self.assertNotIn("scrape-timeout", relation["data"])
+
+    def test_hook_profiling(self):
+        hookenv.config()["hook_profiling"] = True
+        # Make sure the profiler is removed, even if the hook fails.
+        invoke = charms.reactive.bus.Handler.invoke
+        check_call = subprocess.check_call
+        self.useFixture(
+            MonkeyPatch("charms.reactive.bus.Handler.invoke", invoke))
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        # The handlers are only loaded once per test, so only the first
+        # hook is profiled.
+        [record] = unitdata.kv().get("nodeexporter.hook-profile")
+        handlers = [handler["handler"] for handler in record["handlers"]]
+        self.assertTrue(
+            any(handler.endswith(":configure_exporter")
+                for handler in handlers))
+        self.assertGreater(record["tool-calls"], 0)
+        # The wrapped functions are restored when the hook completes.
+        self.assertIs(invoke, charms.reactive.bus.Handler.invoke)
+        self.assertIs(check_call, subprocess.check_call)
+
+    def test_hook_profiling_disabled(self):
+        hookenv.config()["hook_profiling"] = False
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        self.assertIsNone(unitdata.kv().get("nodeexporter.hook-profile"))
+
+    def test_fastpath_state(self):
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        path = os.path.join(hookenv.charm_dir(), fastpath.STATE_PATH)
+        state = fastpath.read_state(path)
+        self.assertEqual(
+            fastpath.get_fingerprint(
+                dict(hookenv.config()), [], fastpath.get_snap_revision(),
+                os.environ["JUJU_UNIT_NAME"]),
+            state["fingerprint"])
+        self.assertGreater(state["due"], time.time())
+
+    def test_fastpath_active_unit_released(self):
+        self.make_other_exporter_active()
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+        path = os.path.join(hookenv.charm_dir(), fastpath.STATE_PATH)
+        state = fastpath.read_state(path)
+
+        # The active unit is stopped, which releases the election.
+        election.release("other/0")
+
+        self.assertNotEqual(
+            fastpath.get_fingerprint(
+                dict(hookenv.config()), [], fastpath.get_snap_revision(),
+                fastpath.get_active_unit()),
+            state["fingerprint"])
+
+    def start_fake_exporter(self):
+        exporter = FakeExporter()
+        exporter.start()
+        self.addCleanup(exporter.stop)
+        self.useFixture(MonkeyPatch(
+            "charms.layer.nodeexporter.health.EXPORTER_URL",
+            "http://127.0.0.1:{}".format(exporter.port)))
+        return exporter
+
+    def test_health_check(self):
+        exporter = self.start_fake_exporter()
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        self.fakes.juju.model.run_hook("update-status")
+
+        self.assertEqual(["/metrics?collect[]=time"], exporter.requests)
+        state = unitdata.kv().get("nodeexporter.health")
+        self.assertEqual(0, state["failures"])
+        self.assertIsNotNone(state["latency"])
+
+    def test_health_check_backoff(self):
+        exporter = self.start_fake_exporter()
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        self.fakes.juju.model.run_hook("update-status")
+        self.fakes.juju.model.run_hook("update-status")
+
+        # The exporter was healthy, so it's not probed again right away.
+        self.assertEqual(1, len(exporter.requests))
+
+    def test_health_check_time_disabled(self):
+        hookenv.config()["disable_collectors"] = "time"
+        exporter = self.start_fake_exporter()
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        self.fakes.juju.model.run_hook("update-status")
+
+        self.assertEqual(["/"], exporter.requests)
+
+    def test_health_check_failing(self):
+        exporter = self.start_fake_exporter()
+        exporter.status = 500
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        for _ in range(health.FAILURE_THRESHOLD):
+            self.fakes.juju.model.run_hook("update-status")
+
+        # Failing exporters are probed on every update-status.
+        self.assertEqual(health.FAILURE_THRESHOLD, len(exporter.requests))
+        state = unitdata.kv().get("nodeexporter.health")
+        self.assertEqual(
+            ("blocked", "Exporter is unhealthy: HTTP Error 500: "
+             "Internal Server Error"),
+            health.get_status(state))
+
+    def test_health_check_first_failure(self):
+        exporter = self.start_fake_exporter()
+        exporter.status = 500
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.start("mysql")
+
+        self.fakes.juju.model.run_hook("update-status")
+
+        # The exporter may have been restarting, so the unit isn't
+        # blocked yet.
+        state = unitdata.kv().get("nodeexporter.health")
+        self.assertEqual(
+            "maintenance", health.get_status(state)[0])
+
+    def test_relate_prometheus_multiple_units(self):
+        self.fakes.juju.model.deploy(["mysql"])
+        self.fakes.juju.model.deploy(["prometheus"], units=2)
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.relate("prometheus-client", "prometheus")
+
+        self.fakes.juju.model.start("mysql")
+        self.fakes.juju.model.start("prometheus")
+
+        [relation] = self.fakes.juju.model.relations["prometheus-client"]
+        self.assertEqual(
+            ["prometheus/0", "prometheus/1"], sorted(relation["units"]))
+        self.assertEqual(
+            2, len(self.fakes.juju.model.hook_timings[
+                "prometheus-client-relation-joined"]))
+        self.assertEqual("9100", relation["data"]["port"])
+
+
+class HookToolBudgetTest(NodeExporterTest):
+    """Hook tool calls are what makes hooks slow on loaded machines."""
+
+    def setUp(self):
+        super().setUp()
+        self.fakes.juju.model.deploy(["mysql", "prometheus1", "prometheus2"])
+        self.fakes.juju.model.relate("container", "mysql")
+        self.fakes.juju.model.relate("prometheus-client", "prometheus1")
+        self.fakes.juju.model.relate("prometheus-client", "prometheus2")
+        self.fakes.juju.model.start("mysql")
+        self.fakes.juju.model.start("prometheus1")
+        self.fakes.juju.model.start("prometheus2")
+        self.reset_hook_tool_calls()
+
+    def test_update_status(self):
+        self.fakes.juju.model.run_hook("update-status")
+
+        self.assertHookToolBudget(
+            "update-status",
+            {"relation-set": 0, "relation-get": 0, "relation-list": 0,
+             "relation-ids": 1, "unit-get": 1})
+
+    def test_config_changed_unchanged(self):
+        self.fakes.juju.model.run_hook("config-changed")
+
+        self.assertHookToolBudget(
+            "config-changed",
+            {"relation-set": 0, "relation-get": 0, "relation-list": 0})
+
+    def test_relation_changed_unchanged(self):
+        [relation, _] = self.fakes.juju.model.relations["prometheus-client"]
+
+        self.fakes.juju.model.change_remote_unit(
+            relation, "prometheus1/0", {})
+
+        # Only the remote unit's requested collectors are read.
+        self.assertHookToolBudget(
+            "prometheus-client-relation-changed",
+            {"relation-set": 0, "relation-get": 1})
+
+    def test_relation_changed_republished_once(self):
+        relation1, relation2 = self.fakes.juju.model.relations[
+            "prometheus-client"]
+
+        self.fakes.juju.model.change_remote_unit(
+            relation1, "prometheus1/0", {"collectors": "cpu"})
+
+        calls = self.get_hook_tool_calls("prometheus-client-relation-changed")
+        relation_sets = [
+            args for args in calls.get("relation-set", [])
+            if "--help" not in args]
+        self.assertEqual(1, len(relation_sets))
+        self.assertIn("prometheus-client:0", relation_sets[0])
+
+
+class InProcessHookToolBudgetTest(HookToolBudgetTest):
+    """The hook tool budgets hold when serving hook tools in-process."""
+
+    in_process_hook_tools = True
@@ -0,0 +1,195 @@
+import subprocess
+import unittest
+
+from charms.layer.nodeexporter import profiling
+from charms.reactive import bus
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeKV(dict):
+
+    def set(self, key, value):
+        self[key] = value
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.clock = FakeClock()
+
+    def make_handler(self, action):
+        # Handlers are created directly, so that they aren't registered
+        # for dispatching.
+        return bus.Handler(action)
+
+    def install(self, profiler):
+        profiler.install()
+        self.addCleanup(profiler.uninstall)
+
+    def test_handler(self):
+        profiler = profiling.Profiler("update-status", clock=self.clock)
+        self.install(profiler)
+
+        def action():
+            self.clock.now += 2
+
+        self.make_handler(action).invoke()
+
+        [record] = profiler.handlers
+        self.assertEqual(2, record["duration"])
+        self.assertEqual(0, record["tool-calls"])
+        # The id is the relative path, line number and function name.
+        self.assertRegex(record["handler"], r"test_profiling\.py:\d+:action$")
+        self.assertNotIn("functions", record)
+
+    def test_subprocesses(self):
+        profiler = profiling.Profiler("update-status", clock=self.clock)
+        self.install(profiler)
+
+        def action():
+            subprocess.check_call(["true"])
+            subprocess.check_output(["true"])
+
+        self.make_handler(action).invoke()
+
+        [record] = profiler.handlers
+        # The nested call() and run() calls aren't counted.
+        self.assertEqual(2, record["tool-calls"])
+        self.assertEqual(2, profiler.tool_calls)
+
+    def test_cprofile(self):
+        profiler = profiling.Profiler("update-status", use_cprofile=True)
+        self.install(profiler)
+
+        def action():
+            sorted(range(10))
+
+        self.make_handler(action).invoke()
+
+        [record] = profiler.handlers
+        functions = [function for function, _, _ in record["functions"]]
+        self.assertTrue(
+            any(function.endswith("(action)") for function in functions))
+
+    def test_uninstall(self):
+        invoke = bus.Handler.invoke
+        check_call = subprocess.check_call
+        profiler = profiling.Profiler("update-status")
+        profiler.install()
+        profiler.uninstall()
+
+        self.assertIs(invoke, bus.Handler.invoke)
+        self.assertIs(check_call, subprocess.check_call)
+
+    def test_handler_fails(self):
+        invoke = bus.Handler.invoke
+        profiler = profiling.Profiler("update-status", clock=self.clock)
+        self.install(profiler)
+
+        def action():
+            raise RuntimeError("failed")
+
+        with self.assertRaises(RuntimeError):
+            self.make_handler(action).invoke()
+
+        # The hook won't complete, so the functions are restored at once.
+        self.assertIs(invoke, bus.Handler.invoke)
+        self.assertEqual(1, len(profiler.handlers))
+
+    def test_get_record(self):
+        profiler = profiling.Profiler("update-status", clock=self.clock)
+        self.install(profiler)
+        self.clock.now += 3
+
+        record = profiler.get_record()
+
+        self.assertEqual("update-status", record["hook"])
+        self.assertEqual(3, record["duration"])
+        self.assertEqual([], record["handlers"])
+
+
+class FormatKeyTest(unittest.TestCase):
+
+    def test_handler_id(self):
+        self.assertEqual(
+            "reactive-nodeexporter-py-120-configure-exporter",
+            profiling.format_key(
+                "reactive/nodeexporter.py:120:configure_exporter"))
+
+    def test_hook(self):
+        self.assertEqual(
+            "update-status", profiling.format_key("update-status"))
+
+    def test_external_handler(self):
+        self.assertEqual(
+            "hooks-relations-foo-py-when-foo",
+            profiling.format_key('hooks/relations/foo.py "when foo"'))
+
+
+class RecordsTest(unittest.TestCase):
+
+    def make_record(self, hook, duration, handlers=()):
+        return {
+            "hook": hook, "time": 0, "duration": duration,
+            "tool-calls": len(handlers), "tool-time": 0.5 * len(handlers),
+            "handlers": [
+                {"handler": handler, "duration": duration,
+                 "tool-calls": 1, "tool-time": 0.5}
+                for handler in handlers],
+        }
+
+    def test_add_record(self):
+        kv = FakeKV()
+        for duration in range(5):
+            profiling.add_record(
+                kv, self.make_record("update-status", duration),
+                max_records=3)
+
+        self.assertEqual(
+            [2, 3, 4],
+            [record["duration"] for record in kv[profiling.PROFILE_KEY]])
+
+    def test_aggregate(self):
+        records = [
+            self.make_record("update-status", 1, ["ready"]),
+            self.make_record("update-status", 3, ["ready"]),
+            self.make_record("config-changed", 4, ["ready", "configure"]),
+        ]
+
+        stats = profiling.aggregate(records)
+
+        self.assertEqual(
+            {"count": 2, "mean": 2, "max": 3, "tool-calls": 1,
+             "tool-time": 0.5},
+            stats["hooks"]["update-status"])
+        self.assertEqual(3, stats["handlers"]["ready"]["count"])
+        self.assertEqual(1, stats["handlers"]["configure"]["count"])
+        self.assertEqual({}, stats["functions"])
+
+    def test_aggregate_hook(self):
+        records = [
+            self.make_record("update-status", 1, ["ready"]),
+            self.make_record("config-changed", 4, ["configure"]),
+        ]
+
+        stats = profiling.aggregate(records, hook="config-changed")
+
+        self.assertEqual(["config-changed"], list(stats["hooks"]))
+        self.assertEqual(["configure"], list(stats["handlers"]))
+
+    def test_aggregate_functions(self):
+        record = self.make_record("update-status", 1, ["ready"])
+        record["handlers"][0]["functions"] = [["a.py:1(f)", 2, 0.25]]
+
+        stats = profiling.aggregate([record, record])
+
+        self.assertEqual({"a.py:1(f)": 0.5}, stats["functions"])
@@ -0,0 +1,380 @@
+import argparse
+import gzip
+import http.server
+import os
+import tempfile
+import threading
+import unittest
+
+from charms.layer.nodeexporter import push
+
+from fakeexporter import FakeExporter, ThreadingHTTPServer
+
+
+class FakeReceiver:
+    """A stand-in for the endpoint metrics are pushed to.
+
+    @ivar batches: The decompressed bodies of the accepted requests.
+    @ivar headers: The headers of the accepted requests.
+    @ivar status: The HTTP status code of the responses.
+    @ivar statuses: Status codes for the next responses, used before
+        status.
+    """
+
+    def __init__(self):
+        self.batches = []
+        self.headers = []
+        self.status = 204
+        self.statuses = []
+        receiver = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_POST(self):
+                length = int(self.headers["Content-Length"])
+                body = self.rfile.read(length)
+                status = (
+                    receiver.statuses.pop(0) if receiver.statuses
+                    else receiver.status)
+                if status < 300:
+                    receiver.headers.append(dict(self.headers))
+                    receiver.batches.append(
+                        gzip.decompress(body).decode("utf-8"))
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:{}/api/v1/import".format(
+            self.server.server_address[1])
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class DeduplicatorTest(unittest.TestCase):
+
+    def test_first_seen(self):
+        deduplicator = push.Deduplicator(60)
+
+        self.assertEqual(
+            [("a", "1"), ("b", "2")],
+            deduplicator.filter([("a", "1"), ("b", "2")], 0))
+
+    def test_unchanged(self):
+        deduplicator = push.Deduplicator(60)
+        deduplicator.filter([("a", "1"), ("b", "2")], 0)
+
+        self.assertEqual(
+            [("b", "3")], deduplicator.filter([("a", "1"), ("b", "3")], 15))
+
+    def test_resend(self):
+        deduplicator = push.Deduplicator(60)
+        deduplicator.filter([("a", "1")], 0)
+        deduplicator.filter([("a", "1")], 30)
+
+        self.assertEqual([("a", "1")], deduplicator.filter([("a", "1")], 60))
+
+    def test_reappeared(self):
+        deduplicator = push.Deduplicator(60)
+        deduplicator.filter([("a", "1")], 0)
+        deduplicator.filter([], 15)
+
+        self.assertEqual([("a", "1")], deduplicator.filter([("a", "1")], 30))
+
+    def test_delivered(self):
+        deduplicator = push.Deduplicator(60)
+        deduplicator.filter([("a", "1")], 0, batch=1)
+        deduplicator.delivered(1)
+
+        self.assertEqual([], deduplicator.filter([("a", "1")], 15, batch=2))
+
+    def test_dropped(self):
+        deduplicator = push.Deduplicator(60)
+        deduplicator.filter([("a", "1")], 0, batch=1)
+        deduplicator.dropped(1)
+
+        self.assertEqual(
+            [("a", "1")], deduplicator.filter([("a", "1")], 15, batch=2))
+
+    def test_dropped_after_delivered(self):
+        deduplicator = push.Deduplicator(60)
+        deduplicator.filter([("a", "1")], 0, batch=1)
+        deduplicator.delivered(1)
+        deduplicator.filter([("a", "2")], 15, batch=2)
+        deduplicator.dropped(2)
+
+        # The value that was delivered isn't the current one anymore.
+        self.assertEqual(
+            [("a", "2")], deduplicator.filter([("a", "2")], 30, batch=3))
+
+
+class SpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.directory = temp_dir.name
+
+    def test_order(self):
+        spool = push.Spool(self.directory)
+        for payload in [b"1", b"2", b"3"]:
+            spool.add(payload)
+
+        payloads = []
+        for path in spool.pending():
+            with open(path, "rb") as batch_file:
+                payloads.append(batch_file.read())
+        self.assertEqual([b"1", b"2", b"3"], payloads)
+
+    def test_bounded(self):
+        spool = push.Spool(self.directory, max_bytes=20)
+        for payload in [b"a" * 10, b"b" * 10, b"c" * 10]:
+            spool.add(payload)
+
+        payloads = []
+        for path in spool.pending():
+            with open(path, "rb") as batch_file:
+                payloads.append(batch_file.read())
+        self.assertEqual([b"b" * 10, b"c" * 10], payloads)
+        self.assertEqual(2, len(os.listdir(self.directory)))
+
+
+class PusherTest(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.spool = push.Spool(temp_dir.name)
+        self.exporter = FakeExporter(
+            b"# TYPE node_load1 gauge\nnode_load1 0.5\n"
+            b"node_cpu_seconds_total{cpu=\"0\"} 10\n")
+        self.exporter.start()
+        self.addCleanup(self.exporter.stop)
+        self.receiver = FakeReceiver()
+        self.addCleanup(self.receiver.stop)
+        self.now = 1000.0
+
+    def get_pusher(self, **kwargs):
+        return push.Pusher(
+            self.receiver.url, self.spool,
+            upstreams=[("main", self.exporter.url)],
+            labels={"instance": "web-1"}, clock=lambda: self.now, **kwargs)
+
+    def test_batch(self):
+        pusher = self.get_pusher(batch_size=2)
+
+        pusher.collect()
+        self.assertEqual([], self.receiver.batches)
+        self.now += 15
+        self.exporter.body = (
+            b"node_load1 0.7\nnode_cpu_seconds_total{cpu=\"0\"} 10\n")
+        pusher.collect()
+
+        self.assertEqual(
+            ["node_load1{exporter=\"main\",instance=\"web-1\"} 0.5 1000000\n"
+             "node_cpu_seconds_total{exporter=\"main\",instance=\"web-1\","
+             "cpu=\"0\"} 10 1000000\n"
+             "node_load1{exporter=\"main\",instance=\"web-1\"} 0.7 1015000\n"],
+            self.receiver.batches)
+        headers = self.receiver.headers[0]
+        self.assertEqual("gzip", headers["Content-Encoding"])
+        self.assertEqual(push.CONTENT_TYPE, headers["Content-Type"])
+        self.assertEqual([], self.spool.pending())
+
+    def test_multiple_upstreams(self):
+        self.exporter.body = b"go_goroutines 8\nnode_load1 0.5\n"
+        slow_exporter = FakeExporter(
+            b"go_goroutines 5\nnode_textfile_scrape_error 0\n")
+        slow_exporter.start()
+        self.addCleanup(slow_exporter.stop)
+        pusher = push.Pusher(
+            self.receiver.url, self.spool,
+            upstreams=[("main", self.exporter.url),
+                       ("slow", slow_exporter.url)],
+            labels={"instance": "web-1"}, batch_size=1,
+            clock=lambda: self.now)
+
+        pusher.collect()
+        self.now += 15
+        slow_exporter.body = (
+            b"go_goroutines 6\nnode_textfile_scrape_error 0\n")
+        pusher.collect()
+
+        self.assertEqual(
+            ["go_goroutines{exporter=\"main\",instance=\"web-1\"} 8 1000000\n"
+             "node_load1{exporter=\"main\",instance=\"web-1\"} 0.5 1000000\n"
+             "go_goroutines{exporter=\"slow\",instance=\"web-1\"} 5 1000000\n"
+             "node_textfile_scrape_error{exporter=\"slow\","
+             "instance=\"web-1\"} 0 1000000\n",
+             "go_goroutines{exporter=\"slow\",instance=\"web-1\"} 6 "
+             "1015000\n"],
+            self.receiver.batches)
+
+    def test_endpoint_down(self):
+        pusher = self.get_pusher(batch_size=1)
+        self.receiver.status = 503
+
+        pusher.collect()
+        self.now += 15
+        self.exporter.body = b"node_load1 0.7\n"
+        pusher.collect()
+
+        self.assertEqual([], self.receiver.batches)
+        self.assertEqual(2, len(self.spool.pending()))
+
+        self.receiver.status = 204
+        self.now += 15
+        self.exporter.body = b"node_load1 0.9\n"
+        pusher.collect()
+
+        self.assertEqual(
+            ["node_load1{exporter=\"main\",instance=\"web-1\"} 0.5 1000000\n"
+             "node_cpu_seconds_total{exporter=\"main\",instance=\"web-1\","
+             "cpu=\"0\"} 10 1000000\n",
+             "node_load1{exporter=\"main\",instance=\"web-1\"} 0.7 1015000\n",
+             "node_load1{exporter=\"main\",instance=\"web-1\"} 0.9 1030000\n"],
+            self.receiver.batches)
+        self.assertEqual([], self.spool.pending())
+
+    def test_batch_rejected(self):
+        pusher = self.get_pusher(batch_size=1)
+        self.receiver.statuses = [400]
+
+        pusher.collect()
+        self.now += 15
+        self.exporter.body = b"node_load1 0.7\n"
+        pusher.collect()
+
+        # The rejected batch is dropped, rather than blocking the spool.
+        self.assertEqual(
+            ["node_load1{exporter=\"main\",instance=\"web-1\"} 0.7 1015000\n"],
+            self.receiver.batches)
+        self.assertEqual([], self.spool.pending())
+
+    def test_batch_rejected_resent_samples(self):
+        pusher = self.get_pusher(batch_size=1)
+        self.receiver.statuses = [422]
+
+        pusher.collect()
+        self.now += 15
+        pusher.collect()
+
+        # The samples of the dropped batch are sent with the next one.
+        self.assertEqual(
+            ["node_load1{exporter=\"main\",instance=\"web-1\"} 0.5 1015000\n"
+             "node_cpu_seconds_total{exporter=\"main\",instance=\"web-1\","
+             "cpu=\"0\"} 10 1015000\n"],
+            self.receiver.batches)
+
+    def test_batch_throttled(self):
+        pusher = self.get_pusher(batch_size=1)
+        self.receiver.statuses = [429]
+
+        pusher.collect()
+
+        self.assertEqual([], self.receiver.batches)
+        self.assertEqual(1, len(self.spool.pending()))
+
+    def test_batch_pruned_resent_samples(self):
+        pusher = self.get_pusher(batch_size=1)
+        self.receiver.status = 503
+        pusher.collect()
+        [path] = self.spool.pending()
+
+        # The spool only fits one batch, and the first one is pruned.
+        self.spool.max_bytes = os.path.getsize(path)
+        self.now += 15
+        self.exporter.body = (
+            b"node_load1 0.7\nnode_cpu_seconds_total{cpu=\"0\"} 10\n")
+        pusher.collect()
+        self.assertNotIn(path, self.spool.pending())
+        self.receiver.status = 204
+        self.now += 15
+        pusher.collect()
+
+        # The sample that was only in the pruned batch is sent again.
+        self.assertEqual(
+            "node_cpu_seconds_total{exporter=\"main\",instance=\"web-1\","
+            "cpu=\"0\"} 10 1030000\n",
+            self.receiver.batches[-1])
+
+    def test_exporter_down(self):
+        pusher = self.get_pusher(batch_size=1)
+        self.exporter.stop()
+
+        with self.assertRaises(push.SCRAPE_ERRORS):
+            pusher.collect()
+        self.assertEqual([], pusher.batch)
+        self.assertEqual([], self.spool.pending())
+
+    def test_garbled_scrape_keeps_batch(self):
+        pusher = self.get_pusher(batch_size=2)
+        pusher.collect()
+        self.exporter.body = b"node_load1 \xff\n"
+
+        with self.assertRaises(push.SCRAPE_ERRORS):
+            pusher.collect()
+        self.assertEqual(2, len(pusher.batch))
+        self.assertEqual(1, pusher.scrapes)
+
+    def test_truncated_scrape_keeps_batch(self):
+        pusher = self.get_pusher(batch_size=2)
+        pusher.collect()
+        self.exporter.truncate = 10
+
+        with self.assertRaises(push.SCRAPE_ERRORS):
+            pusher.collect()
+        self.assertEqual(2, len(pusher.batch))
+        self.assertEqual(1, pusher.scrapes)
+
+
+class LabelsTest(unittest.TestCase):
+
+    def test_no_labels(self):
+        self.assertEqual(
+            "node_load1{instance=\"a\"}",
+            push.add_labels("node_load1", {"instance": "a"}))
+
+    def test_empty_labels(self):
+        self.assertEqual(
+            "node_load1{instance=\"a\"}",
+            push.add_labels("node_load1{}", {"instance": "a"}))
+
+    def test_labels(self):
+        self.assertEqual(
+            "node_cpu{instance=\"a\",cpu=\"0\"}",
+            push.add_labels("node_cpu{cpu=\"0\"}", {"instance": "a"}))
+
+    def test_existing_label(self):
+        # Like Prometheus, the label the sample has is kept renamed.
+        self.assertEqual(
+            "up{instance=\"a\",job=\"x\",exported_instance=\"b,\\\"c\"}",
+            push.add_labels(
+                "up{job=\"x\",instance=\"b,\\\"c\"}", {"instance": "a"}))
+
+    def test_escaped(self):
+        self.assertEqual(
+            "exporter=\"main\",instance=\"a\\\"b\\\\\"",
+            push.format_labels({"instance": "a\"b\\", "exporter": "main"}))
+
+
+class ParsePairTest(unittest.TestCase):
+
+    def test_pair(self):
+        self.assertEqual(
+            ("main", "http://localhost:9100/metrics?a=b"),
+            push.parse_pair("main=http://localhost:9100/metrics?a=b"))
+
+    def test_invalid(self):
+        with self.assertRaises(argparse.ArgumentTypeError):
+            push.parse_pair("http://localhost:9100/metrics")
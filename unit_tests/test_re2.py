@@ -0,0 +1,147 @@
+import unittest
+
+from charms.layer.nodeexporter import re2
+
+
+class CheckTest(unittest.TestCase):
+
+    def assertValid(self, regex):
+        try:
+            re2.check(regex)
+        except ValueError as error:
+            self.fail("{!r} was rejected: {}".format(regex, error))
+
+    def assertInvalid(self, regex, message):
+        with self.assertRaises(ValueError) as context:
+            re2.check(regex)
+        self.assertEqual(message, str(context.exception))
+
+    def test_literals(self):
+        self.assertValid("^(tap|veth)[0-9]+.*$")
+
+    def test_empty(self):
+        self.assertValid("")
+
+    def test_end_of_text(self):
+        self.assertValid("^loop\\z")
+
+    def test_end_of_text_python(self):
+        self.assertInvalid("^loop\\Z", "invalid escape sequence: `\\Z`")
+
+    def test_assertions(self):
+        self.assertValid("\\Aa\\bb\\B")
+
+    def test_unicode_classes(self):
+        self.assertValid("\\p{Greek}\\pL\\PN\\P{^Latin}\\p{Any}")
+
+    def test_unicode_class_unknown(self):
+        self.assertInvalid(
+            "\\p{Klingon}", "invalid character class range: `\\p{Klingon}`")
+
+    def test_named_groups(self):
+        self.assertValid("(?<name>x)(?P<other>y)")
+
+    def test_named_group_duplicate(self):
+        self.assertInvalid(
+            "(?P<a>x)(?P<a>y)", "duplicate capture group name: `(?P<a>`")
+
+    def test_named_group_invalid(self):
+        self.assertInvalid("(?P<>x)", "invalid named capture: `(?P<>`")
+
+    def test_flags(self):
+        self.assertValid("(?i)a(?-s)b(?im-sU:c)(?:d)")
+
+    def test_flags_unsupported(self):
+        for regex in ["(?x)a", "(?a)a", "(?L)a", "(?u)a"]:
+            self.assertInvalid(
+                regex,
+                "invalid or unsupported Perl syntax: `{}`".format(regex[:3]))
+
+    def test_flags_missing_after_dash(self):
+        self.assertInvalid(
+            "(?i-)a", "invalid or unsupported Perl syntax: `(?i`")
+
+    def test_comment(self):
+        self.assertInvalid(
+            "(?#c)a", "invalid or unsupported Perl syntax: `(?#`")
+
+    def test_lookarounds(self):
+        for regex in ["(?=a)", "(?!a)"]:
+            self.assertInvalid(
+                regex,
+                "invalid or unsupported Perl syntax: `{}`".format(regex[:3]))
+        for regex in ["(?<=a)b", "(?<!a)b"]:
+            self.assertInvalid(
+                regex, "invalid named capture: `{}`".format(regex))
+
+    def test_backreferences(self):
+        self.assertInvalid("(a)\\1", "invalid escape sequence: `\\1`")
+        self.assertInvalid(
+            "(?P<a>x)(?P=a)", "invalid or unsupported Perl syntax: `(?P`")
+
+    def test_atomic_groups_and_conditionals(self):
+        self.assertInvalid(
+            "(?>a)", "invalid or unsupported Perl syntax: `(?>`")
+        self.assertInvalid(
+            "(?(1)a)", "invalid or unsupported Perl syntax: `(?(`")
+
+    def test_octal_and_hex(self):
+        self.assertValid("\\0\\12\\101\\x41\\x{1F600}")
+
+    def test_hex_invalid(self):
+        self.assertInvalid("\\xZZ", "invalid escape sequence: `\\xZZ`")
+        self.assertInvalid(
+            "\\x{110000}", "invalid escape sequence: `\\x{110000}`")
+
+    def test_escaped_punctuation(self):
+        self.assertValid("\\.\\(\\)\\[\\]\\{\\}\\*\\+\\?\\|\\^\\$\\\\\\-\\_")
+
+    def test_escape_unknown(self):
+        for regex in ["\\q", "\\C", "\\8", "\\G"]:
+            self.assertInvalid(
+                regex, "invalid escape sequence: `{}`".format(regex))
+
+    def test_trailing_backslash(self):
+        self.assertInvalid(
+            "a\\", "trailing backslash at end of expression: ``")
+
+    def test_quoted(self):
+        self.assertValid("\\Q(?=*\\E+\\Q[")
+
+    def test_repetitions(self):
+        self.assertValid("a*b+?c?d{2}e{2,}f{2,3}?g{,2}h{")
+
+    def test_repetition_nested(self):
+        self.assertInvalid("a**", "invalid nested repetition operator: `*`")
+
+    def test_repetition_possessive(self):
+        self.assertInvalid("a++", "invalid nested repetition operator: `+`")
+
+    def test_repetition_missing_argument(self):
+        for regex in ["*a", "(+a)", "a|?", "(?i)*"]:
+            with self.assertRaises(ValueError):
+                re2.check(regex)
+
+    def test_repeat_count(self):
+        self.assertInvalid("a{1001}", "invalid repeat count: `{1001}`")
+        self.assertInvalid("a{3,2}", "invalid repeat count: `{3,2}`")
+
+    def test_parentheses(self):
+        self.assertInvalid("(a", "missing closing ): `(a`")
+        self.assertInvalid("a)", "unexpected ): `)`")
+
+    def test_classes(self):
+        self.assertValid("[]a][^]a][a-z\\d-][[:alpha:][:^space:]][\\p{Greek}]")
+
+    def test_class_unterminated(self):
+        self.assertInvalid("[a", "missing closing ]: `[a`")
+
+    def test_class_range_reversed(self):
+        self.assertInvalid("[z-a]", "invalid character class range: `z-a`")
+
+    def test_class_ascii_unknown(self):
+        self.assertInvalid(
+            "[[:foo:]]", "invalid character class range: `[:foo:]`")
+
+    def test_class_assertion(self):
+        self.assertInvalid("[\\b]", "invalid escape sequence: `\\b`")
@@ -0,0 +1,81 @@
+import datetime
+import unittest
+
+from charms.layer.nodeexporter import refresh
+
+
+class ParseWindowTest(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual((120, 240), refresh.parse_window("02:00-06:00"))
+
+    def test_parse_midnight(self):
+        self.assertEqual((22 * 60, 240), refresh.parse_window("22:00-02:00"))
+
+    def test_parse_whole_day(self):
+        self.assertEqual((0, 24 * 60), refresh.parse_window("00:00-00:00"))
+
+    def test_parse_invalid(self):
+        for window in ["02:00", "2:00-6:00", "24:00-01:00", "02:00-06:60"]:
+            with self.assertRaises(ValueError):
+                refresh.parse_window(window)
+
+
+class SlotTest(unittest.TestCase):
+
+    def test_offset(self):
+        offsets = {
+            refresh.get_slot_offset("mysql/{}".format(unit), 240, 10)
+            for unit in range(200)}
+
+        # The units are spread over all the slots.
+        self.assertEqual(set(range(0, 240, 10)), offsets)
+
+    def test_offset_deterministic(self):
+        self.assertEqual(
+            refresh.get_slot_offset("mysql/0", 240, 10),
+            refresh.get_slot_offset("mysql/0", 240, 10))
+
+    def test_offset_single_slot(self):
+        self.assertEqual(0, refresh.get_slot_offset("mysql/0", 5, 10))
+
+    def test_slot_start(self):
+        offset = refresh.get_slot_offset("mysql/0", 240, 10)
+        now = datetime.datetime(2017, 6, 1, 12, 0)
+
+        slot_start = refresh.get_slot_start(now, "02:00-06:00", 10, "mysql/0")
+
+        self.assertEqual(
+            datetime.datetime(2017, 6, 1, 2, 0) +
+            datetime.timedelta(minutes=offset),
+            slot_start)
+
+    def test_slot_start_yesterday(self):
+        now = datetime.datetime(2017, 6, 1, 1, 0)
+
+        slot_start = refresh.get_slot_start(now, "02:00-06:00", 10, "mysql/0")
+
+        self.assertEqual(datetime.date(2017, 5, 31), slot_start.date())
+
+    def test_current_slot(self):
+        slot_start = refresh.get_slot_start(
+            datetime.datetime(2017, 6, 1, 12, 0), "02:00-06:00", 10,
+            "mysql/0")
+
+        self.assertEqual(
+            slot_start,
+            refresh.get_current_slot(
+                slot_start + datetime.timedelta(minutes=9), "02:00-06:00",
+                10, "mysql/0"))
+        self.assertIsNone(
+            refresh.get_current_slot(
+                slot_start + datetime.timedelta(minutes=10), "02:00-06:00",
+                10, "mysql/0"))
+
+    def test_next_slot(self):
+        now = datetime.datetime(2017, 6, 1, 12, 0)
+        slot_start = refresh.get_slot_start(now, "02:00-06:00", 10, "mysql/0")
+
+        self.assertEqual(
+            slot_start + datetime.timedelta(days=1),
+            refresh.get_next_slot(now, "02:00-06:00", 10, "mysql/0"))
@@ -0,0 +1,79 @@
+import unittest
+
+from charms.layer.nodeexporter import scrape
+
+from fakeexporter import FakeExporter
+
+
+class ParseSamplesTest(unittest.TestCase):
+
+    def test_parse(self):
+        text = (
+            "# HELP a Help.\n"
+            "a 1\n"
+            'b{x="1",y="a \\"b\\""} 2.5 1500000000\n'
+            "invalid line\n")
+
+        self.assertEqual(
+            [("a", {}, 1.0), ("b", {"x": "1", "y": 'a \\"b\\"'}, 2.5)],
+            list(scrape.parse_samples(text)))
+
+    def test_collector_durations(self):
+        text = (
+            'node_scrape_collector_duration_seconds{collector="cpu"} 0.1\n'
+            'node_scrape_collector_success{collector="cpu"} 1\n')
+
+        self.assertEqual(
+            {"cpu": 0.1}, scrape.get_collector_durations(text))
+
+
+class PercentileTest(unittest.TestCase):
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+
+        self.assertEqual(50, scrape.percentile(values, 50))
+        self.assertEqual(95, scrape.percentile(values, 95))
+        self.assertEqual(99, scrape.percentile(values, 99))
+
+    def test_percentile_empty(self):
+        self.assertIsNone(scrape.percentile([], 50))
+
+
+class BenchmarkTest(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.exporter = FakeExporter()
+        self.exporter.start()
+        self.addCleanup(self.exporter.stop)
+
+    def test_benchmark(self):
+        result = scrape.benchmark(self.exporter.url, count=5, concurrency=2)
+
+        self.assertEqual(5, len(self.exporter.requests))
+        self.assertEqual(5, result["scrapes"])
+        self.assertEqual([], result["errors"])
+        self.assertEqual(len(self.exporter.body), result["bytes"])
+        self.assertEqual(5, result["series"])
+        self.assertEqual(
+            ["p50", "p95", "p99"], sorted(result["latency"]))
+        self.assertEqual(
+            {"p50": 0.02, "p95": 0.02, "p99": 0.02},
+            result["collectors"]["filesystem"])
+
+    def test_benchmark_errors(self):
+        self.exporter.status = 500
+
+        result = scrape.benchmark(self.exporter.url, count=2)
+
+        self.assertEqual(0, result["scrapes"])
+        self.assertEqual(2, len(result["errors"]))
+
+    def test_benchmark_truncated(self):
+        self.exporter.truncate = 10
+
+        result = scrape.benchmark(self.exporter.url, count=2)
+
+        self.assertEqual(0, result["scrapes"])
+        self.assertEqual(2, len(result["errors"]))
@@ -0,0 +1,71 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from charms.layer.nodeexporter import snapcache
+
+
+class CacheSnapTest(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.cache_dir = os.path.join(self.directory, "cache")
+        os.mkdir(self.cache_dir)
+
+    def make_snap(self, content):
+        path = os.path.join(self.directory, "resource.snap")
+        with open(path, "wb") as snap_file:
+            snap_file.write(content)
+        return path
+
+    def test_cache(self):
+        path = self.make_snap(b"snap")
+
+        cached_path, digest = snapcache.cache_snap(
+            "exporter", path, self.cache_dir)
+
+        self.assertEqual(hashlib.sha256(b"snap").hexdigest(), digest)
+        self.assertEqual(
+            os.path.join(self.cache_dir, "exporter_{}.snap".format(digest)),
+            cached_path)
+        with open(cached_path, "rb") as cached_file:
+            self.assertEqual(b"snap", cached_file.read())
+
+    def test_cached(self):
+        path = self.make_snap(b"snap")
+        cached_path, _ = snapcache.cache_snap(
+            "exporter", path, self.cache_dir)
+        os.utime(cached_path, (0, 0))
+
+        self.assertEqual(
+            (cached_path, hashlib.sha256(b"snap").hexdigest()),
+            snapcache.cache_snap("exporter", path, self.cache_dir))
+        # The cached snap isn't copied again, only marked as used.
+        self.assertEqual(
+            [os.path.basename(cached_path)], os.listdir(self.cache_dir))
+        self.assertNotEqual(0, os.path.getmtime(cached_path))
+
+    def test_prune(self):
+        cached_paths = []
+        for mtime, content in enumerate([b"1", b"2", b"3"]):
+            cached_path, _ = snapcache.cache_snap(
+                "exporter", self.make_snap(content), self.cache_dir)
+            os.utime(cached_path, (mtime, mtime))
+            cached_paths.append(cached_path)
+
+        self.assertEqual(
+            sorted(os.path.basename(path) for path in cached_paths[1:]),
+            sorted(os.listdir(self.cache_dir)))
+
+    def test_prune_other_names(self):
+        other_path = os.path.join(self.cache_dir, "other_abc.snap")
+        open(other_path, "w").close()
+        for content in [b"1", b"2", b"3"]:
+            snapcache.cache_snap(
+                "exporter", self.make_snap(content), self.cache_dir)
+
+        self.assertTrue(os.path.exists(other_path))
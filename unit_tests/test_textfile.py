@@ -0,0 +1,214 @@
+import json
+import os
+import tempfile
+import unittest
+
+from charms.layer.nodeexporter import textfile
+
+
+class WriteMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.directory = temp_dir.name
+
+    def test_write(self):
+        textfile.write_metrics(
+            "backup", "backup_age_seconds 10", directory=self.directory)
+
+        self.assertEqual(["backup.prom"], os.listdir(self.directory))
+        with open(os.path.join(self.directory, "backup.prom")) as prom:
+            self.assertEqual("backup_age_seconds 10\n", prom.read())
+
+    def test_write_replaces(self):
+        textfile.write_metrics("backup", "a 1\n", directory=self.directory)
+        textfile.write_metrics("backup", "a 2\n", directory=self.directory)
+
+        self.assertEqual(["backup.prom"], os.listdir(self.directory))
+        with open(os.path.join(self.directory, "backup.prom")) as prom:
+            self.assertEqual("a 2\n", prom.read())
+
+    def test_write_invalid_name(self):
+        with self.assertRaises(ValueError):
+            textfile.write_metrics(
+                "../backup", "a 1\n", directory=self.directory)
+
+    def test_write_max_bytes(self):
+        with self.assertRaises(textfile.BudgetExceeded):
+            textfile.write_metrics(
+                "backup", "a 1\n", directory=self.directory, max_bytes=3)
+        self.assertEqual([], os.listdir(self.directory))
+
+    def test_write_max_series(self):
+        text = "# HELP a Help.\n# TYPE a gauge\na 1\nb 2\n"
+        with self.assertRaises(textfile.BudgetExceeded):
+            textfile.write_metrics(
+                "backup", text, directory=self.directory, max_series=1)
+        self.assertEqual([], os.listdir(self.directory))
+
+    def test_remove(self):
+        textfile.write_metrics("backup", "a 1\n", directory=self.directory)
+
+        textfile.remove_metrics("backup", directory=self.directory)
+        textfile.remove_metrics("backup", directory=self.directory)
+
+        self.assertEqual([], os.listdir(self.directory))
+
+
+class GeneratorRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.directory = temp_dir.name
+        self.registry = textfile.GeneratorRegistry(directory=self.directory)
+        self.inputs = {"backup": 1}
+        self.renders = []
+
+    def _render(self):
+        self.renders.append("backup")
+        return "backup_age_seconds {}\n".format(self.inputs["backup"])
+
+    def test_run_unchanged(self):
+        self.registry.register(textfile.Generator(
+            "backup", lambda: self.inputs, self._render))
+        state = {}
+
+        self.registry.run(state)
+        rendered, errors = self.registry.run(state)
+
+        self.assertEqual([], rendered)
+        self.assertEqual({}, errors)
+        self.assertEqual(["backup"], self.renders)
+
+    def test_run_changed(self):
+        self.registry.register(textfile.Generator(
+            "backup", lambda: self.inputs, self._render))
+        state = {}
+        self.registry.run(state)
+
+        self.inputs["backup"] = 2
+        rendered, errors = self.registry.run(state)
+
+        self.assertEqual(["backup"], rendered)
+        with open(os.path.join(self.directory, "backup.prom")) as prom:
+            self.assertEqual("backup_age_seconds 2\n", prom.read())
+
+    def test_run_no_inputs(self):
+        self.registry.register(textfile.Generator(
+            "backup", lambda: None, self._render))
+        state = {}
+
+        self.registry.run(state)
+        self.registry.run(state)
+
+        self.assertEqual(["backup", "backup"], self.renders)
+
+    def test_run_removed(self):
+        state = {"backup": "digest"}
+        textfile.write_metrics("backup", "a 1\n", directory=self.directory)
+
+        self.registry.run(state)
+
+        self.assertEqual({}, state)
+        self.assertEqual([], os.listdir(self.directory))
+
+    def test_run_budget_exceeded(self):
+        registry = textfile.GeneratorRegistry(
+            directory=self.directory, max_series=0)
+        registry.register(textfile.Generator(
+            "backup", lambda: self.inputs, self._render))
+        state = {}
+
+        rendered, errors = registry.run(state)
+
+        self.assertEqual([], rendered)
+        self.assertEqual(["backup"], list(errors))
+        self.assertEqual({}, state)
+
+    def test_command_generator(self):
+        input_path = os.path.join(self.directory, "input")
+        with open(input_path, "w") as input_file:
+            input_file.write("1")
+        self.registry.register(textfile.CommandGenerator(
+            "backup", "echo backup_ok 1", input_paths=[input_path]))
+        state = {}
+
+        self.assertEqual((["backup"], {}), self.registry.run(state))
+        self.assertEqual(([], {}), self.registry.run(state))
+        with open(input_path, "w") as input_file:
+            input_file.write("12")
+        self.assertEqual((["backup"], {}), self.registry.run(state))
+
+
+class RunTest(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.directory = os.path.join(temp_dir.name, "textfile")
+        os.mkdir(self.directory)
+        self.registry_path = os.path.join(temp_dir.name, "generators.json")
+        self.state_path = os.path.join(temp_dir.name, "state.json")
+        self.input_path = os.path.join(temp_dir.name, "input")
+        with open(self.input_path, "w") as input_file:
+            input_file.write("1")
+
+    def write_registry(self, generators):
+        with open(self.registry_path, "w") as registry_file:
+            json.dump(generators, registry_file)
+
+    def run_generators(self):
+        textfile.main([
+            "--directory", self.directory, "run", "--state", self.state_path,
+            self.registry_path])
+
+    def test_run(self):
+        self.write_registry({"backup": {
+            "command": "echo backup_ok 1", "inputs": [self.input_path]}})
+
+        self.run_generators()
+
+        with open(os.path.join(self.directory, "backup.prom")) as prom:
+            self.assertEqual("backup_ok 1\n", prom.read())
+        self.assertEqual(
+            ["backup"], list(textfile.read_state(self.state_path)))
+
+    def test_run_unchanged(self):
+        self.write_registry({"backup": {
+            "command": "echo backup_ok 1", "inputs": [self.input_path]}})
+        self.run_generators()
+        path = os.path.join(self.directory, "backup.prom")
+        os.utime(path, (0, 0))
+
+        self.run_generators()
+
+        # The state is kept between runs, so the file isn't written again.
+        self.assertEqual(0, os.stat(path).st_mtime)
+
+    def test_run_removed(self):
+        self.write_registry({"backup": {"command": "echo backup_ok 1"}})
+        self.run_generators()
+
+        self.write_registry({})
+        self.run_generators()
+
+        self.assertEqual([], os.listdir(self.directory))
+        self.assertEqual({}, textfile.read_state(self.state_path))
+
+    def test_run_failed(self):
+        self.write_registry({"backup": {"command": "false"}})
+
+        with self.assertRaises(SystemExit) as context:
+            self.run_generators()
+
+        self.assertEqual(1, context.exception.code)
+        self.assertEqual([], os.listdir(self.directory))
+        self.assertEqual({}, textfile.read_state(self.state_path))
+
+    def test_read_state_missing(self):
+        self.assertEqual({}, textfile.read_state(self.state_path))